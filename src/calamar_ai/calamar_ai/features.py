@@ -0,0 +1,342 @@
+"""
+Feature panels for model training
+    - reads every FY price file of the csv database once (see
+      calamar_backend.price_cache) and the stored index price tables
+    - aligns all securities on one day axis, the union of their price
+      dates: every feature is a (days x securities) panel, NaN before a
+      security's first price and after its last one
+    - panels, computed for all securities at once:
+        - returns: daily log return
+        - volatility: annualised rolling standard deviation of returns
+        - momentum: return over the momentum window
+        - drawdown: depth below the running peak close (<= 0)
+        - rs_{ticker}: return over the relative strength window less the
+          index return over the same window
+    - writes one .npy file per panel (column major, every security's
+      series is contiguous), days.npy, securities.json and meta.json;
+      trainers open the panels with np.load(path, mmap_mode="r")
+
+    run using -> python -m calamar_ai.features --out features
+                 --tickers nifty50 niftynext50
+    (with src/calamar_backend and src/calamar_ai on PYTHONPATH)
+"""
+import argparse
+import datetime
+import json
+import os
+import sqlite3
+import typing
+import numpy as np
+
+from calamar_backend.price_cache import read_price_files
+from calamar_backend.table_interface import Index
+
+TRADING_DAYS = 252
+PANEL_DTYPE = "float32"
+
+
+def load_closes(csv_dir: str) -> tuple[np.ndarray, list[str], np.ndarray]:
+    """
+    Read the csv database once and align it on one day axis
+
+    Returns:
+        [days, securities, closes]
+        datetime64[D] days, security ids (isin, ticker or map_ file name
+        prefix) and the (days x securities) close panel
+    """
+    arrays = read_price_files(csv_dir, ("Close",), "float64")
+    ids = sorted({file.rpartition("_")[0] for file in arrays})
+    col_of = {id_: col for [col, id_] in enumerate(ids)}
+
+    dates = [arr.dates.astype("datetime64[D]") for arr in arrays.values()]
+    cols = [
+        np.full(len(arr.dates), col_of[file.rpartition("_")[0]])
+        for [file, arr] in arrays.items()
+    ]
+    values = [arr.column("Close") for arr in arrays.values()]
+    if len(dates) == 0:
+        return (np.array([], dtype="datetime64[D]"), ids, np.zeros((0, 0)))
+
+    all_dates = np.concatenate(dates)
+    days = np.unique(all_dates)
+    closes = np.full((len(days), len(ids)), np.nan)
+    closes[np.searchsorted(days, all_dates), np.concatenate(cols)] = (
+        np.concatenate(values)
+    )
+    return (days, ids, closes)
+
+
+def load_index_closes(
+    conn: sqlite3.Connection, tickers: list[str], days: np.ndarray
+) -> np.ndarray:
+    """
+    Returns:
+        (days x tickers) index closes on the day axis, carried forward over
+        days the index has no close
+    """
+    closes = np.full((len(days), len(tickers)), np.nan)
+    cursor = conn.cursor()
+
+    for [col, ticker] in enumerate(tickers):
+        cursor.execute(Index(ticker).get_all_query())
+        rows = cursor.fetchall()
+        if len(rows) == 0:
+            continue
+
+        dates = np.array([row[0][:10] for row in rows], dtype="datetime64[D]")
+        pos = np.searchsorted(days, dates)
+        found = pos < len(days)
+        found[found] = days[pos[found]] == dates[found]
+        closes[pos[found], col] = np.array(
+            [row[1] for row in rows], dtype="float64"
+        )[found]
+
+    return forward_fill(closes)
+
+
+def forward_fill(panel: np.ndarray) -> np.ndarray:
+    """
+    Carry every column's last value over NaN gaps between its first and
+    last value, NaN stays outside that range
+    """
+    rows = np.arange(len(panel))[:, None]
+    valid = ~np.isnan(panel)
+    last_valid = np.maximum.accumulate(np.where(valid, rows, 0), axis=0)
+    filled = np.take_along_axis(panel, last_valid, axis=0)
+
+    # after the last value of a column
+    last = len(panel) - 1 - np.argmax(valid[::-1], axis=0)
+    filled[rows > last] = np.nan
+    return filled
+
+
+def shift(panel: np.ndarray, periods: int) -> np.ndarray:
+    """
+    panel[t - periods] on row t, NaN on the first rows
+    """
+    shifted = np.full_like(panel, np.nan)
+    if periods < len(panel):
+        shifted[periods:] = panel[: len(panel) - periods]
+    return shifted
+
+
+def rolling_sum(
+    panel: np.ndarray, window: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns:
+        [sums, counts] of the non NaN values of the window ending on every
+        row, from cumulative sums
+    """
+    valid = ~np.isnan(panel)
+    zero = np.zeros((1, *panel.shape[1:]))
+    cum = np.concatenate([zero, np.cumsum(np.where(valid, panel, 0), 0)])
+    cnt = np.concatenate([zero, np.cumsum(valid, axis=0)])
+
+    start = np.maximum(np.arange(1, len(panel) + 1) - window, 0)
+    end = np.arange(1, len(panel) + 1)
+    return (cum[end] - cum[start], cnt[end] - cnt[start])
+
+
+def log_returns(closes: np.ndarray) -> np.ndarray:
+    log_closes = np.log(forward_fill(closes))
+    return log_closes - shift(log_closes, 1)
+
+
+def rolling_volatility(returns: np.ndarray, window: int) -> np.ndarray:
+    """
+    Annualised standard deviation of the returns of the window, NaN until
+    the window is full
+    """
+    [s1, n] = rolling_sum(returns, window)
+    [s2, _] = rolling_sum(returns**2, window)
+
+    full = n == window
+    var = np.full_like(s1, np.nan)
+    var[full] = (s2[full] - s1[full] ** 2 / window) / (window - 1)
+    return np.sqrt(np.maximum(var, 0) * TRADING_DAYS)
+
+
+def window_return(closes: np.ndarray, window: int) -> np.ndarray:
+    """
+    close[t] / close[t - window] - 1
+    """
+    log_closes = np.log(forward_fill(closes))
+    return np.expm1(log_closes - shift(log_closes, window))
+
+
+def drawdown(closes: np.ndarray) -> np.ndarray:
+    """
+    close / running peak close - 1
+    """
+    filled = forward_fill(closes)
+    # fmax skips the NaN before a security's first price
+    peak = np.fmax.accumulate(filled, axis=0)
+    return filled / peak - 1
+
+
+def relative_strength(
+    closes: np.ndarray, index_close: np.ndarray, window: int
+) -> np.ndarray:
+    """
+    index_close :parameter: index closes on the same day axis
+
+    Returns:
+        window return of every security less the index window return
+    """
+    index_return = window_return(index_close[:, None], window)
+    return window_return(closes, window) - index_return
+
+
+def build_panels(
+    closes: np.ndarray,
+    index_closes: np.ndarray,
+    tickers: list[str],
+    windows: dict[str, int],
+) -> dict[str, np.ndarray]:
+    """
+    windows :parameter: volatility, momentum and relative_strength window
+    lengths in days
+    """
+    returns = log_returns(closes)
+    panels = {
+        "returns": returns,
+        "volatility": rolling_volatility(returns, windows["volatility"]),
+        "momentum": window_return(closes, windows["momentum"]),
+        "drawdown": drawdown(closes),
+    }
+    for [col, ticker] in enumerate(tickers):
+        panels[f"rs_{ticker}"] = relative_strength(
+            closes, index_closes[:, col], windows["relative_strength"]
+        )
+
+    return {
+        name: panel.astype(PANEL_DTYPE) for [name, panel] in panels.items()
+    }
+
+
+def write_features(
+    out_dir: str,
+    days: np.ndarray,
+    securities: list[str],
+    panels: dict[str, np.ndarray],
+    meta: dict[str, typing.Any],
+) -> None:
+    """
+    Write the panels column major, so that np.load(mmap_mode="r") maps
+    every security's series as one contiguous block
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    np.save(os.path.join(out_dir, "days.npy"), days)
+    with open(os.path.join(out_dir, "securities.json"), "w") as file:
+        json.dump(securities, file)
+
+    for [name, panel] in panels.items():
+        np.save(os.path.join(out_dir, f"{name}.npy"), np.asfortranarray(panel))
+
+    meta = {
+        **meta,
+        "created": str(datetime.datetime.now()),
+        "shape": [len(days), len(securities)],
+        "dtype": PANEL_DTYPE,
+        "first_day": str(days[0]) if len(days) != 0 else None,
+        "last_day": str(days[-1]) if len(days) != 0 else None,
+        "panels": sorted(panels),
+    }
+    with open(os.path.join(out_dir, "meta.json"), "w") as file:
+        json.dump(meta, file, indent=2)
+
+
+def load_features(
+    out_dir: str,
+) -> tuple[
+    dict[str, typing.Any], np.ndarray, list[str], dict[str, np.ndarray]
+]:
+    """
+    Trainer side: open a written artifact without reading the panels
+
+    Returns:
+        [meta, days, securities, panels] with memory mapped panels
+    """
+    with open(os.path.join(out_dir, "meta.json")) as file:
+        meta = json.load(file)
+    with open(os.path.join(out_dir, "securities.json")) as file:
+        securities = json.load(file)
+
+    days = np.load(os.path.join(out_dir, "days.npy"))
+    panels = {
+        name: np.load(os.path.join(out_dir, f"{name}.npy"), mmap_mode="r")
+        for name in meta["panels"]
+    }
+    return (meta, days, securities, panels)
+
+
+def build_features(
+    out_dir: str,
+    csv_dir: str,
+    db_name: str,
+    tickers: list[str],
+    windows: dict[str, int],
+) -> dict[str, typing.Any]:
+    """
+    csv_dir :parameter: csv database directory
+    db_name :parameter: database holding the {ticker}_price tables
+
+    Returns:
+        meta of the written artifact
+    """
+    [days, securities, closes] = load_closes(csv_dir)
+    conn = sqlite3.connect(f"file:{db_name}?mode=ro", uri=True)
+    try:
+        index_closes = load_index_closes(conn, tickers, days)
+    finally:
+        conn.close()
+
+    panels = build_panels(closes, index_closes, tickers, windows)
+    write_features(
+        out_dir,
+        days,
+        securities,
+        panels,
+        {"tickers": tickers, "windows": windows},
+    )
+    print(
+        f"{str(datetime.datetime.now())}: wrote {len(panels)} panels "
+        f"({len(days)} days x {len(securities)} securities) to {out_dir}"
+    )
+    return load_features(out_dir)[0]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="build feature panels")
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--tickers", nargs="+", default=["nifty50"])
+    parser.add_argument("--db", default=os.getenv("CALAMAR_DB"))
+    parser.add_argument("--csv-dir", default=os.getenv("CALAMAR_CSV_DB"))
+    parser.add_argument("--volatility-window", type=int, default=21)
+    parser.add_argument("--momentum-window", type=int, default=126)
+    parser.add_argument("--rs-window", type=int, default=63)
+    args = parser.parse_args()
+
+    if args.db is None or args.csv_dir is None:
+        raise Exception(
+            f"{str(datetime.datetime.now())}: "
+            "features: --db and --csv-dir (or CALAMAR_DB and CALAMAR_CSV_DB) "
+            "must be set"
+        )
+
+    build_features(
+        args.out,
+        args.csv_dir,
+        args.db,
+        args.tickers,
+        {
+            "volatility": args.volatility_window,
+            "momentum": args.momentum_window,
+            "relative_strength": args.rs_window,
+        },
+    )
+
+
+if __name__ == "__main__":
+    main()
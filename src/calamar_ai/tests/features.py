@@ -0,0 +1,59 @@
+import os
+import tempfile
+import timeit
+import numpy as np
+from calamar_ai.features import build_features, load_features
+
+
+def test_build_features() -> bool:
+    try:
+        with tempfile.TemporaryDirectory() as out_dir:
+            meta = build_features(
+                out_dir,
+                os.environ["CALAMAR_CSV_DB"],
+                os.environ["CALAMAR_DB"],
+                ["nifty50"],
+                {"volatility": 21, "momentum": 126, "relative_strength": 63},
+            )
+            [_, days, securities, panels] = load_features(out_dir)
+            print(f"\ntest_build_features_results: {meta['shape']}")
+
+            shape = (len(days), len(securities))
+            if any(panel.shape != shape for panel in panels.values()):
+                return False
+            # drawdown is never above the running peak
+            if np.nanmax(panels["drawdown"]) > 0:
+                return False
+            del panels
+
+    except Exception as e:
+        print(e)
+        return False
+
+    return True
+
+
+def main():
+    print("==== Features testing ====")
+    OKGREEN = "\033[92m"
+    FAIL = "\033[91m"
+    ENDC = "\033[0m"
+    tick = OKGREEN + "\N{check mark}" + ENDC
+    cross = FAIL + "\N{cross mark}" + ENDC
+
+    emoji = lambda x: tick if x else cross
+
+    start_time = timeit.default_timer()
+    tst_build_features: bool = test_build_features()
+    end_time = timeit.default_timer()
+    elapsed_time = end_time - start_time
+
+    print("\n\n==== Features test results ====")
+    print(f"test_build_features: {emoji(tst_build_features)}")
+    print("\n")
+    print(f"Total elapsed time for features tests: {elapsed_time}")
+    print("\n")
+
+
+if __name__ == "__main__":
+    main()
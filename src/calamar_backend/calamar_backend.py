@@ -1 +1,6 @@
 # daily update program (will run in a container)
+# run using -> python calamar_backend.py --help
+from calamar_backend.pipeline import main
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,209 @@
+"""
+Batch runner
+    - builds many account databases in parallel across a process pool
+    - every worker shares the same read only price store:
+        - csv database ($CALAMAR_CSV_DB) and ticker map ($TICKER_MAP)
+        - optionally a database holding the index price tables
+        - optionally the csv database parsed once into shared memory
+          (see price_cache.py)
+    - reports per account, per stage timing
+"""
+import argparse
+import concurrent.futures
+import datetime
+import os
+import timeit
+import typing
+
+from calamar_backend.config import AccountConfig, load_accounts
+
+
+class AccountResult:
+    """
+    Outcome of building one account
+    """
+
+    def __init__(
+        self,
+        name: str,
+        timings: dict[str, float],
+        error: typing.Optional[str] = None,
+    ):
+        self.name = name
+        self.timings = timings
+        self.error = error
+
+    @property
+    def total(self) -> float:
+        return sum(self.timings.values())
+
+    def __str__(self) -> str:
+        stages = " ".join(f"{k}:{v:.2f}s" for k, v in self.timings.items())
+        status = "ok" if self.error is None else f"failed - {self.error}"
+        return f"({self.name} {status} total:{self.total:.2f}s {stages})"
+
+
+def _init_worker(
+    csv_db: str, ticker_map: str, price_shm: typing.Optional[str] = None
+) -> None:
+    """
+    Point the worker at the shared price store before the price store
+    singletons are built on first use
+    """
+    os.environ["CALAMAR_CSV_DB"] = csv_db
+    os.environ["TICKER_MAP"] = ticker_map
+    if price_shm is not None:
+        os.environ["CALAMAR_PRICE_SHM"] = price_shm
+
+
+def build_account(
+    config: AccountConfig,
+    tickers: list[str],
+    price_db: typing.Optional[str] = None,
+    start: str = "",
+) -> AccountResult:
+    """
+    Build every table of one account
+
+    :parameter tickers: benchmark tickers (the first one marks sessions)
+    :parameter price_db: database to copy index price tables from, the
+    index prices are downloaded when not set
+    :parameter start: index price download start date (YYYY-MM-DD)
+    """
+    # imported here so that the worker environment is set first
+    import calamar_backend.database as db
+
+    timings: dict[str, float] = {}
+
+    def timed(stage: str, fn: typing.Callable[[], None]) -> None:
+        start_time = timeit.default_timer()
+        fn()
+        timings[stage] = timeit.default_timer() - start_time
+
+    try:
+        db_ = db.Database(config)
+        timed("trade_report", db_.create_trade_report_table)
+        timed("bank_statement", db_.create_bank_statment_table)
+
+        for ticker in tickers:
+            if price_db is not None:
+                timed(
+                    f"{ticker}_price",
+                    lambda: db_.copy_index_table(ticker, price_db),
+                )
+            else:
+                timed(
+                    f"{ticker}_price",
+                    lambda: db_.create_index_table(ticker, start),
+                )
+
+        timed("ledger", lambda: db_.create_ledger_tables(tickers))
+        db_.conn.close()
+
+    except Exception as e:
+        return AccountResult(config.name, timings, str(e))
+
+    return AccountResult(config.name, timings)
+
+
+def run_batch(
+    configs: list[AccountConfig],
+    tickers: list[str],
+    csv_db: str,
+    ticker_map: str,
+    price_db: typing.Optional[str] = None,
+    start: str = "",
+    processes: typing.Optional[int] = None,
+    shared_prices: bool = False,
+) -> list[AccountResult]:
+    """
+    Build all accounts on a process pool
+
+    :parameter shared_prices: parse the csv database once and let the
+    workers read it from shared memory
+
+    Returns:
+        list[AccountResult] in the order of configs
+    """
+    store = None
+    if shared_prices:
+        from calamar_backend.price_cache import SharedPriceStore
+
+        store = SharedPriceStore.publish(
+            csv_db, f"calamar_prices_{os.getpid()}"
+        )
+
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=processes,
+            initializer=_init_worker,
+            initargs=(
+                csv_db,
+                ticker_map,
+                store.name if store is not None else None,
+            ),
+        ) as pool:
+            futures = [
+                pool.submit(build_account, config, tickers, price_db, start)
+                for config in configs
+            ]
+            return [future.result() for future in futures]
+    finally:
+        if store is not None:
+            store.close()
+
+
+def print_report(results: list[AccountResult], elapsed: float) -> None:
+    print(f"\n==== batch report {str(datetime.datetime.now())} ====")
+    for result in results:
+        print(str(result))
+
+    failed = [result for result in results if result.error is not None]
+    print(
+        f"accounts: {len(results)} failed: {len(failed)} "
+        f"wall time: {elapsed:.2f}s "
+        f"summed time: {sum(result.total for result in results):.2f}s"
+    )
+
+
+def main() -> None:
+    """
+    python -m calamar_backend.batch accounts.yaml --tickers nifty50
+    """
+    parser = argparse.ArgumentParser(description="build many accounts")
+    parser.add_argument("accounts", help="accounts yaml file")
+    parser.add_argument("--tickers", nargs="+", default=["nifty50"])
+    parser.add_argument("--price-db", default=None)
+    parser.add_argument("--start", default="")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument(
+        "--shared-prices",
+        action="store_true",
+        help="parse the csv database once into shared memory",
+    )
+    parser.add_argument("--csv-db", default=os.getenv("CALAMAR_CSV_DB"))
+    parser.add_argument("--ticker-map", default=os.getenv("TICKER_MAP"))
+    args = parser.parse_args()
+
+    if args.csv_db is None or args.ticker_map is None:
+        raise Exception(
+            f"{str(datetime.datetime.now())}: "
+            "csv database or ticker map not set"
+        )
+
+    start_time = timeit.default_timer()
+    results = run_batch(
+        load_accounts(args.accounts),
+        args.tickers,
+        args.csv_db,
+        args.ticker_map,
+        args.price_db,
+        args.start,
+        args.processes,
+        args.shared_prices,
+    )
+    print_report(results, timeit.default_timer() - start_time)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Benchmarks
+    - index nav of many indexes computed together
+    - one cash flow pass over the bank statements is shared by every index
+    - index closes are aligned as the columns of one (days x indexes) array
+    - an index can resume from its last computed nav row: only the flows
+      and closes after it are replayed, on its units and amount invested
+      (used by the ledger)
+
+    Note: bank statements on a day without an index close are carried to
+    the next day with a close, instead of failing the build
+"""
+import datetime
+import typing
+import numpy as np
+
+import calamar_backend.time as time
+from calamar_backend.table_row_interface import (
+    BankStatementRow,
+    IndexNAVRow,
+    IndexRow,
+)
+
+
+def daily_net_flows(
+    bnk_statements: list[BankStatementRow],
+) -> dict[datetime.datetime, float]:
+    """
+    Returns:
+        payin - payout of every day with a bank statement
+    """
+    flows: dict[datetime.datetime, float] = {}
+    for bnk_st in bnk_statements:
+        [is_credit, amount] = bnk_st.is_credit_debit()
+        flows[bnk_st.date] = flows.get(bnk_st.date, 0.0) + (
+            amount if is_credit else -amount
+        )
+
+    return flows
+
+
+def compute_index_navs(
+    bnk_statements: list[BankStatementRow],
+    closes: dict[str, list[IndexRow]],
+    last_date: datetime.datetime,
+    since: typing.Optional[
+        dict[str, typing.Optional[datetime.datetime]]
+    ] = None,
+    start: typing.Optional[dict[str, IndexNAVRow]] = None,
+) -> dict[str, list[tuple[str, str, float, float, float, float, float]]]:
+    """
+    bnk_statements :parameter: every bank statement ordered by date
+    closes :parameter: ticker -> index price rows
+    last_date :parameter: last day to compute the nav for
+    since :parameter: ticker -> last day already computed, flows and
+    closes upto it are skipped; None (or a missing ticker) computes from
+    the first bank statement
+    start :parameter: ticker -> nav row on its since day, units and amount
+    invested carry on from it
+
+    Returns:
+        ticker -> index nav rows, in IndexNAV column order
+    """
+    tickers = list(closes.keys())
+    since = since if since is not None else {}
+    start = start if start is not None else {}
+    ret: dict[str, list] = {ticker: [] for ticker in tickers}
+    if len(bnk_statements) == 0:
+        return ret
+
+    flows = daily_net_flows(bnk_statements)
+    day_zero = bnk_statements[0].date
+
+    # aligned day axis
+    days_set = set(flows.keys())
+    for rows in closes.values():
+        days_set.update(row.date for row in rows)
+    days = sorted(day for day in days_set if day_zero <= day <= last_date)
+    day_pos = {day: i for i, day in enumerate(days)}
+
+    # (days x indexes) close matrix, nan on days without a close
+    close_mat = np.full((len(days), len(tickers)), np.nan)
+    for j, ticker in enumerate(tickers):
+        for row in closes[ticker]:
+            if row.date in day_pos:
+                close_mat[day_pos[row.date], j] = row.close
+
+    # (days x indexes) flows and closes after every index's since day
+    before = day_zero - datetime.timedelta(days=1)
+    since_arr = np.array(
+        [since.get(t) or before for t in tickers], dtype="datetime64[s]"
+    )
+    new = np.array(days, dtype="datetime64[s]")[:, None] > since_arr
+    day_flow = np.array([flows.get(day, 0.0) for day in days])
+    cum_flow = np.cumsum(np.where(new, day_flow[:, None], 0.0), axis=0)
+    valid = ~np.isnan(close_mat) & new
+
+    # cash flow since the previous close of each index
+    pos = np.where(valid, np.arange(len(days))[:, None], -1)
+    last_valid = np.maximum.accumulate(pos, axis=0)
+    prev_valid = np.vstack(
+        [np.full((1, len(tickers)), -1), last_valid[:-1]]
+    )
+    prev_cum_flow = np.where(
+        prev_valid >= 0,
+        np.take_along_axis(cum_flow, np.maximum(prev_valid, 0), axis=0),
+        0.0,
+    )
+    net = np.where(valid, cum_flow - prev_cum_flow, 0.0)
+
+    [units_0, invested_0] = [
+        np.array(
+            [
+                getattr(start[t], attr) if t in start else 0.0
+                for t in tickers
+            ]
+        )
+        for attr in ("units", "amount_invested")
+    ]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        units = units_0 + np.cumsum(
+            np.where(valid, net / close_mat, 0.0), axis=0
+        )
+    amount_invested = invested_0 + np.cumsum(net, axis=0)
+    nav = units * close_mat
+    payin = np.maximum(net, 0.0)
+    payout = np.maximum(-net, 0.0)
+
+    days_str = [time.convert_date_to_strf(day) for day in days]
+    for j, ticker in enumerate(tickers):
+        for i in np.flatnonzero(valid[:, j]):
+            ret[ticker].append(
+                (
+                    days_str[i],
+                    ticker,
+                    float(payin[i, j]),
+                    float(payout[i, j]),
+                    float(amount_invested[i, j]),
+                    float(units[i, j]),
+                    float(nav[i, j]),
+                )
+            )
+
+    return ret
@@ -0,0 +1,73 @@
+"""
+Account configuration
+    - AccountConfig: inputs and output database of one account
+    - load accounts from a yaml file
+
+    yaml structure:
+    accounts:
+      - name: account name
+        db: sqlite database file
+        trade_report: zerodha trade report csv
+        bank_statement: zerodha bank statement csv
+        problem_sec: problematic securities file
+"""
+import os
+import typing
+import yaml
+
+
+class AccountConfig:
+    """
+    Explicit configuration of one account, unset values fall back to the
+    environment variables used by a single account run
+    """
+
+    def __init__(
+        self,
+        name: str,
+        db: typing.Optional[str] = None,
+        trade_report: typing.Optional[str] = None,
+        bank_statement: typing.Optional[str] = None,
+        problem_sec: typing.Optional[str] = None,
+    ):
+        self.name = name
+        self.db = db
+        self.trade_report = trade_report
+        self.bank_statement = bank_statement
+        self.problem_sec = problem_sec
+
+    @classmethod
+    def from_env(cls, name: str = "default") -> "AccountConfig":
+        """
+        Configuration from CALAMAR_DB, ZERODHA_TRADE_REPORT,
+        ZERODHA_BANK_STATEMENT and ZERODHA_PROBLEM_SEC
+        """
+        return cls(
+            name,
+            os.getenv("CALAMAR_DB"),
+            os.getenv("ZERODHA_TRADE_REPORT"),
+            os.getenv("ZERODHA_BANK_STATEMENT"),
+            os.getenv("ZERODHA_PROBLEM_SEC"),
+        )
+
+    def __str__(self) -> str:
+        return f"(name:{self.name} db:{self.db})"
+
+
+def load_accounts(file: str) -> list[AccountConfig]:
+    """
+    :parameter file: yaml file with a list of accounts
+    """
+    with open(file, "r") as f:
+        accounts = yaml.safe_load(f)["accounts"]
+
+    return [
+        AccountConfig(
+            account["name"],
+            account["db"],
+            account["trade_report"],
+            account["bank_statement"],
+            account.get("problem_sec"),
+        )
+        for account in accounts
+    ]
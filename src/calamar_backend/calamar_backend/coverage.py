@@ -0,0 +1,243 @@
+"""
+Price coverage preflight
+    - works out from the trade report the closes a nav build reads: a
+      ticker held on a portfolio snapshot day (trade day zero and every
+      session after it) needs a close of its isin on that day or upto 5
+      days after it, same as DatabaseCSV.read_price
+    - holdings are replayed on the snapshot days the way the ledger does,
+      a holding that is not positive on a snapshot is dropped
+    - the FY files of every security are resolved without downloading
+      (shared price store, isin, yahoo ticker and ticker map entry, same
+      as DatabaseCSV)
+    - every needed day is matched against the price dates of all the
+      resolved files at once, on (security, day) integer keys
+    - reports:
+        - needed: first and last needed day of every security
+        - missing files: FY files not in the price store, a build
+          downloads them
+        - unresolvable: securities whose missing files cannot be
+          downloaded under any name, only known when fetching
+        - gaps: needed days without a close in the lookahead, as ranges;
+          days whose lookahead reaches a missing file are left to the
+          download
+"""
+import sqlite3
+import numpy as np
+
+import calamar_backend.time as time
+from calamar_backend.database_csv import get_db_csv
+from calamar_backend.table_interface import Index, TradeReport
+from calamar_backend.table_row_interface import TradeReportRow
+
+# a missing close is looked up upto 5 days forward
+LOOKAHEAD = 5
+# (security, day) and (security, fy) keys
+DAY_SPAN = 1 << 20
+FY_SPAN = 10000
+
+
+def fy_of(days: np.ndarray) -> np.ndarray:
+    """
+    Vectorized time.date_fy of datetime64[D] days
+    """
+    years = days.astype("datetime64[Y]").astype(np.int64) + 1970
+    months = days.astype("datetime64[M]").astype(np.int64) % 12 + 1
+    return years + (months >= 4)
+
+
+def to_strf(day: np.datetime64) -> str:
+    return str(time.convert_datetime64_to_strf(day.astype("datetime64[s]")))
+
+
+def snapshot_days(
+    conn: sqlite3.Connection, session_ticker: str, day_zero: np.datetime64
+) -> np.ndarray:
+    """
+    Returns:
+        datetime64[D] trade day zero and the sessions after it, upto the
+        current date
+    """
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT Date FROM {Index(session_ticker).name}")
+    sessions = np.array(
+        [row[0][:10] for row in cursor.fetchall()], dtype="datetime64[D]"
+    )
+    cur_date = np.datetime64(time.get_current_date(), "D")
+    sessions = sessions[(sessions > day_zero) & (sessions <= cur_date)]
+    return np.unique(np.append(sessions, day_zero))
+
+
+def held_days(
+    trades: list[TradeReportRow], days: np.ndarray
+) -> list[tuple[str, str, np.ndarray]]:
+    """
+    trades :parameter: date ordered trade report rows
+    days :parameter: snapshot days, a trade counts from the first one on
+    or after its date
+
+    Returns:
+        list[(isin, ticker, snapshot days held)], a dropped ticker bought
+        again takes the isin of the trade that opens it, same as the ledger
+    """
+    by_ticker: dict[str, list[TradeReportRow]] = {}
+    for trade in trades:
+        by_ticker.setdefault(trade.ticker, []).append(trade)
+
+    held: dict[tuple[str, str], list[np.ndarray]] = {}
+    for [ticker, rows] in by_ticker.items():
+        pos = np.searchsorted(
+            days, np.array([row.date for row in rows], dtype="datetime64[D]")
+        )
+        change = np.zeros(len(days) + 1)
+        np.add.at(
+            change,
+            pos,
+            [row.quantity if row.is_buy else -row.quantity for row in rows],
+        )
+
+        # only snapshots with trades change the quantity
+        [changed, first] = np.unique(pos, return_index=True)
+        quantity = 0.0
+        isin = ""
+        for [i, [snap, trade]] in enumerate(zip(changed, first)):
+            if snap == len(days):
+                break
+
+            if quantity <= 0:
+                isin = rows[trade].isin
+            quantity = max(quantity + change[snap], 0.0)
+            if quantity > 0:
+                end = changed[i + 1] if i + 1 < len(changed) else len(days)
+                held.setdefault((isin, ticker), []).append(days[snap:end])
+
+    return [
+        (isin, ticker, np.concatenate(spans))
+        for [[isin, ticker], spans] in held.items()
+    ]
+
+
+class PriceCoverage:
+    """
+    Closes needed by a nav build and what the price store is missing
+    """
+
+    def __init__(self):
+        # (isin, ticker, first day, last day)
+        self.needed: list[tuple[str, str, str, str]] = []
+        # (isin, ticker, fy)
+        self.missing_files: list[tuple[str, str, int]] = []
+        # (isin, ticker)
+        self.unresolvable: list[tuple[str, str]] = []
+        # (isin, ticker, first day, last day, needed days without a close)
+        self.gaps: list[tuple[str, str, str, str, int]] = []
+
+    @property
+    def ok(self) -> bool:
+        """
+        Whether a build can value every holding, missing files are
+        downloaded by the build
+        """
+        return len(self.gaps) == 0 and len(self.unresolvable) == 0
+
+    def __str__(self) -> str:
+        return (
+            f"(PriceCoverage securities:{len(self.needed)} "
+            f"missing_files:{len(self.missing_files)} "
+            f"unresolvable:{self.unresolvable} gaps:{self.gaps})"
+        )
+
+
+def analyze(
+    conn: sqlite3.Connection,
+    tr_table: TradeReport,
+    session_ticker: str = "nifty50",
+    fetch: bool = False,
+) -> PriceCoverage:
+    """
+    session_ticker :parameter: index whose closes mark portfolio sessions
+    fetch :parameter: download the missing files now, the ones found under
+    no name are reported unresolvable
+    """
+    coverage = PriceCoverage()
+    trades = tr_table.get_all(conn)
+    if len(trades) == 0:
+        return coverage
+
+    days = snapshot_days(
+        conn, session_ticker, np.datetime64(trades[0].date, "D")
+    )
+    cur_date = np.datetime64(time.get_current_date(), "D")
+    db_csv = get_db_csv()
+
+    [codes, needed, price_keys, missing] = [[], [], [], []]
+    for [code, [isin, ticker, held]] in enumerate(held_days(trades, days)):
+        coverage.needed.append(
+            (isin, ticker, to_strf(held[0]), to_strf(held[-1]))
+        )
+        codes.append(np.full(len(held), code))
+        needed.append(held)
+
+        last = min(held[-1] + LOOKAHEAD, cur_date)
+        for fy in range(int(fy_of(held[0])), int(fy_of(last)) + 1):
+            arr = None
+            if db_csv.has_fy(isin, fy, ticker):
+                arr = db_csv.read_fy(isin, fy, ticker)
+            else:
+                coverage.missing_files.append((isin, ticker, fy))
+                if fetch and (isin, ticker) not in coverage.unresolvable:
+                    try:
+                        arr = db_csv.read_fy(isin, fy, ticker)
+                    except Exception:
+                        coverage.unresolvable.append((isin, ticker))
+
+            if arr is None:
+                missing.append(code * FY_SPAN + fy)
+            else:
+                price_keys.append(
+                    code * DAY_SPAN
+                    + arr.dates.astype("datetime64[D]").astype(np.int64)
+                )
+
+    if len(needed) == 0:
+        return coverage
+
+    code_arr = np.concatenate(codes)
+    day_arr = np.concatenate(needed)
+    keys = code_arr * DAY_SPAN + day_arr.astype(np.int64)
+    prices = np.unique(
+        np.concatenate(price_keys)
+        if len(price_keys) != 0
+        else np.zeros(0, dtype=np.int64)
+    )
+
+    # first close on or after every needed day, within the lookahead
+    pos = np.searchsorted(prices, keys)
+    found = np.zeros(len(keys), dtype=bool)
+    inside = pos < len(prices)
+    found[inside] = prices[pos[inside]] <= keys[inside] + LOOKAHEAD
+
+    # the close may be in a file that is not downloaded yet
+    window_end = np.minimum(day_arr + LOOKAHEAD, cur_date)
+    blocked = np.isin(code_arr * FY_SPAN + fy_of(day_arr), missing) | np.isin(
+        code_arr * FY_SPAN + fy_of(window_end), missing
+    )
+
+    # runs of consecutive needed days of one security
+    gap = np.flatnonzero(~found & ~blocked)
+    if len(gap) != 0:
+        breaks = (np.diff(gap) != 1) | (np.diff(code_arr[gap]) != 0)
+        starts = np.concatenate([[0], np.flatnonzero(breaks) + 1])
+        ends = np.append(starts[1:], len(gap)) - 1
+        for [start, end] in zip(starts, ends):
+            [isin, ticker] = coverage.needed[code_arr[gap[start]]][:2]
+            coverage.gaps.append(
+                (
+                    isin,
+                    ticker,
+                    to_strf(day_arr[gap[start]]),
+                    to_strf(day_arr[gap[end]]),
+                    int(end - start + 1),
+                )
+            )
+
+    return coverage
@@ -2,11 +2,51 @@
 Database utils functions:
     Create:
     - create index table
+    - copy index table from a shared price database
     - create bank statement table
     - create index nav table
+    - create index nav tables for many indexes in one pass
     - create trade_report table
     - create portfolio table
     - create portfolio nav table
+    - create portfolio nav table in parallel (FY partitions)
+    - create prices table
+    - create portfolio nav table using sql (holdings x prices join)
+    - create portfolio positions table (per security value, weight and
+      pnl, see positions.py)
+    - create portfolio report, portfolio nav and index nav tables in a
+      single ledger pass
+    - create weekly, monthly and quarterly nav rollups
+    - create time weighted return prefix sums of the portfolio and index
+      navs (see twr.py)
+    - create underwater curves, drawdown episodes and running peak state
+      of the portfolio and index navs (see drawdown.py)
+    - create rolling beta, correlation, tracking error and information
+      ratio of the portfolio against the benchmarks (see relative_risk.py)
+    - create money weighted returns (xirr) of the portfolio and index navs
+      over trailing windows (see xirr.py)
+    - create monte carlo nav bands and value at risk of the latest
+      holdings (see montecarlo.py)
+    - create long only min variance and max sharpe weights of the latest
+      holdings (see optimizer.py)
+    - create FIFO tax lots: realized gains and open lots valued at the
+      last close, updated from the earliest changed trade (see lots.py)
+
+    Scenarios:
+    - nav difference of hypothetical added or removed trades, without
+      rebuilding the tables (see scenario.py)
+
+    Build:
+    - run every stage whose inputs changed since the last build
+      (see manifest.py)
+    - check that the price store covers every holding of the trade
+      report before the first expensive stage (see coverage.py)
+    - recompute from the earliest date changed in re-exported trade
+      report and bank statement files
+    - rebuild tables into {table}__shadow copies that replace the live
+      table in one transaction, readers see the old table until then
+    - resume an interrupted prices build after its last committed
+      security (build_checkpoints table)
 
     TODO:
     - create sharpe ratio table
@@ -22,19 +62,68 @@ Database utils functions:
     - update trade_report table
 """
 import sqlite3
-import os
+import concurrent.futures
+import contextlib
 import datetime
+import itertools
 import typing
+import numpy as np
 import tqdm
 
 import calamar_backend.time as time
+from calamar_backend.benchmarks import compute_index_navs, daily_net_flows
+from calamar_backend.config import AccountConfig
+from calamar_backend.coverage import PriceCoverage, analyze as analyze_coverage
+from calamar_backend.database_csv import get_db_csv
+from calamar_backend.drawdown import update_drawdowns
+from calamar_backend.ledger import Ledger
+from calamar_backend.lots import (
+    LotBook,
+    open_lot_rows,
+    read_trades,
+    realized_rows,
+)
+from calamar_backend.manifest import BuildManifest, Stage
+from calamar_backend import montecarlo
+from calamar_backend.optimizer import PortfolioOptimizer
+from calamar_backend.positions import compute_positions, exit_rows
+from calamar_backend.maps import get_ticker_map
+from calamar_backend.relative_risk import (
+    aligned_returns,
+    relative_risk_rows,
+    rolling_relative_risk,
+)
+from calamar_backend.rollup import truncate_rollups, update_rollups
+from calamar_backend.scenario import ScenarioEngine
+from calamar_backend.twr import index_twr_rows, portfolio_twr_rows
+from calamar_backend.xirr import xirr_rows
 from calamar_backend.table_interface import (
     BankStatement as BNK,
+    BuildCheckpoints,
+    DrawdownEpisodes,
+    DrawdownState,
+    Table,
     IndexNAV,
     PortfolioNAV,
+    Positions,
     TradeReport,
     Index,
+    MonteCarloBands,
+    MonteCarloRisk,
+    MomentState,
+    NAVRollup,
+    OpenLots,
+    OptimalWeights,
     Portfolio,
+    Prices,
+    RealizedGains,
+    RelativeRisk,
+    ReturnWindow,
+    TWR,
+    Underwater,
+    WriteVersions,
+    XIRR,
+    table_exists,
 )
 from calamar_backend.table_row_interface import (
     IndexNAVRow,
@@ -45,17 +134,32 @@ from calamar_backend.table_row_interface import (
 )
 from calamar_backend import errors
 
+if typing.TYPE_CHECKING:
+    import pandas as pd
+
+# index whose closes mark portfolio sessions in the portfolio report
+SESSION_TICKER = "nifty50"
+
 
 class Database:
     """
     Handles database utility functions
     """
 
-    def __init__(self):
-        self.db_name = os.getenv("CALAMAR_DB")
+    def __init__(self, config: typing.Optional[AccountConfig] = None):
+        """
+        config :parameter: account inputs, defaults to the environment
+        """
+        if config is None:
+            config = AccountConfig.from_env()
+
+        self.config = config
+        self.db_name = config.db
 
         if self.db_name is not None:
             self.conn = sqlite3.connect(self.db_name)
+            # readers keep their snapshot while a build writes
+            self.conn.execute("PRAGMA journal_mode=WAL")
         else:
             raise Exception(
                 f"{str(datetime.datetime.now())}: "
@@ -63,13 +167,322 @@ class Database:
             )
 
         # connect to various tables
-        self.bnk_table = BNK()
-        self.tr_table = TradeReport()
+        self.bnk_table = BNK(config.bank_statement)
+        self.tr_table = TradeReport(config.trade_report, config.problem_sec)
         self.pft_table = Portfolio()
         self.pft_nav_table = PortfolioNAV()
+        self.prices_table = Prices()
+        self.positions_table = Positions()
+        self.twr_table = TWR()
+        self.relative_risk_table = RelativeRisk()
+        self.xirr_table = XIRR()
+        self.mc_bands_table = MonteCarloBands()
+        self.mc_risk_table = MonteCarloRisk()
+        self.optimal_weights_table = OptimalWeights()
+        self.realized_gains_table = RealizedGains()
+        self.open_lots_table = OpenLots()
         self.index_nav_table: typing.Optional[IndexNAV] = None
         self.index_table: typing.Optional[Index] = None
 
+    def stages(
+        self,
+        tickers: list[str],
+        start: str = "",
+        price_db: typing.Optional[str] = None,
+    ) -> list[Stage]:
+        """
+        Build stages in dependency order
+        tickers :parameter: index nav benchmarks, the first one also marks
+        portfolio sessions
+        start, price_db :parameter: see create_index_tables
+        """
+        index_prices = [f"table:{Index(ticker).name}" for ticker in tickers]
+        index_navs = [IndexNAV(ticker).name for ticker in tickers]
+
+        return [
+            Stage(
+                "index_prices",
+                ["day:"],
+                [],
+                [Index(ticker).name for ticker in tickers],
+                lambda: self.create_index_tables(tickers, start, price_db),
+            ),
+            Stage(
+                "trade_report",
+                [
+                    f"file:{self.tr_table.trade_report_file}",
+                    f"file:{self.tr_table.get_prob_file()}",
+                ],
+                [],
+                [self.tr_table.name],
+                self.create_trade_report_table,
+            ),
+            Stage(
+                "bank_statement",
+                [f"file:{self.bnk_table.bank_statement_file}"],
+                [],
+                [self.bnk_table.name],
+                self.create_bank_statment_table,
+            ),
+            Stage(
+                "price_coverage",
+                [
+                    "prices:",
+                    f"file:{get_ticker_map().map_yaml}",
+                    f"table:{Index(SESSION_TICKER).name}",
+                ],
+                ["index_prices", "trade_report"],
+                [],
+                self.verify_price_coverage,
+            ),
+            Stage(
+                "portfolio_report",
+                [f"table:{Index(SESSION_TICKER).name}"],
+                ["index_prices", "trade_report", "price_coverage"],
+                [self.pft_table.name],
+                self.create_portfolio_table,
+            ),
+            Stage(
+                "prices",
+                ["prices:", f"file:{get_ticker_map().map_yaml}"],
+                ["portfolio_report"],
+                [self.prices_table.name],
+                self.create_prices_table,
+            ),
+            Stage(
+                "portfolio_nav",
+                [],
+                ["portfolio_report", "prices"],
+                [self.pft_nav_table.name],
+                self.create_portfolio_nav_table_sql,
+            ),
+            Stage(
+                "positions",
+                [],
+                ["portfolio_report", "prices"],
+                [self.positions_table.name],
+                self.create_positions_table,
+            ),
+            Stage(
+                "index_nav",
+                index_prices,
+                ["index_prices", "bank_statement"],
+                index_navs,
+                lambda: self.create_index_nav_tables(tickers),
+            ),
+            Stage(
+                "rollups",
+                [],
+                ["portfolio_nav", "index_nav"],
+                [NAVRollup().name],
+                lambda: self.create_rollup_tables(tickers, full=True),
+            ),
+            Stage(
+                "twr",
+                [],
+                ["positions", "index_nav"],
+                [self.twr_table.name],
+                lambda: self.create_twr_tables(tickers),
+            ),
+            Stage(
+                "drawdowns",
+                [],
+                ["twr"],
+                [
+                    Underwater().name,
+                    DrawdownEpisodes().name,
+                    DrawdownState().name,
+                ],
+                lambda: self.create_drawdown_tables(tickers),
+            ),
+            Stage(
+                "relative_risk",
+                index_prices,
+                ["twr"],
+                [self.relative_risk_table.name],
+                lambda: self.create_relative_risk_table(tickers),
+            ),
+            Stage(
+                "xirr",
+                [],
+                [
+                    "bank_statement",
+                    "trade_report",
+                    "portfolio_nav",
+                    "index_nav",
+                ],
+                [self.xirr_table.name],
+                lambda: self.create_xirr_table(tickers),
+            ),
+            Stage(
+                "montecarlo",
+                ["prices:"],
+                ["portfolio_report", "prices"],
+                [self.mc_bands_table.name, self.mc_risk_table.name],
+                self.create_montecarlo_tables,
+            ),
+            Stage(
+                "optimizer",
+                [],
+                ["portfolio_report", "prices"],
+                [
+                    self.optimal_weights_table.name,
+                    ReturnWindow().name,
+                    MomentState().name,
+                ],
+                self.create_optimal_weights_table,
+            ),
+            Stage(
+                "tax_lots",
+                ["prices:"],
+                ["trade_report", "price_coverage"],
+                [self.realized_gains_table.name, self.open_lots_table.name],
+                self.create_tax_lot_tables,
+            ),
+        ]
+
+    def check_price_coverage(
+        self, session_ticker: str = SESSION_TICKER, fetch: bool = False
+    ) -> PriceCoverage:
+        """
+        - Work out the closes a nav build reads from the trade_report
+          holdings
+        - Match them against the price store in one pass, without running
+          any stage (see coverage.py)
+        fetch :parameter: download the missing FY files now
+        """
+        return analyze_coverage(
+            self.conn, self.tr_table, session_ticker, fetch
+        )
+
+    def verify_price_coverage(self) -> None:
+        """
+        - Check the price coverage of the trade report before the holdings
+          and nav stages, the missing FY files are downloaded now
+        - Raise PriceCoverageError on price gaps or unresolvable securities
+        """
+        coverage = self.check_price_coverage(SESSION_TICKER, fetch=True)
+        if not coverage.ok:
+            raise errors.PriceCoverageError(coverage)
+
+    def build(
+        self,
+        tickers: list[str],
+        force: bool = False,
+        start: str = "",
+        price_db: typing.Optional[str] = None,
+    ) -> list[str]:
+        """
+        Run the stages whose fingerprint changed since the last build,
+        force reruns every stage
+        start, price_db :parameter: see create_index_tables
+
+        Returns:
+            names of the stages that ran
+        """
+        manifest = BuildManifest(self.conn)
+        ran = []
+
+        for stage in self.stages(tickers, start, price_db):
+            if not force and manifest.is_current(stage):
+                continue
+
+            stage.fn()
+            manifest.record(stage)
+            ran.append(stage.name)
+
+        return ran
+
+    def update_from_reports(
+        self, tickers: list[str]
+    ) -> typing.Optional[datetime.datetime]:
+        """
+        - Diff the trade report and bank statement files against the stored
+          tables, replace the tables that changed
+        - Resume the ledger from the holdings snapshot and index nav rows
+          before the earliest changed date (see ledger.py)
+        - Rewrite portfolio report, portfolio nav and index nav rows after
+          them, and the rollup periods from there
+        - Record the refreshed stages in the build manifest
+
+        Returns:
+            earliest changed date, None when nothing changed
+        """
+        trade_since = self.__replace_report(self.tr_table)
+        bank_since = self.__replace_report(self.bnk_table)
+        if trade_since is None and bank_since is None:
+            return None
+
+        ledger = Ledger(self.bnk_table, self.tr_table)
+        state = ledger.restore(self.conn, tickers, trade_since, bank_since)
+        ledger.run(self.conn, tickers, resume=state)
+
+        tables: list[tuple] = [
+            (self.pft_table, state.pft_since, ledger.portfolio_rows),
+            (self.pft_nav_table, state.pft_since, ledger.portfolio_nav_rows),
+        ]
+        for ticker in tickers:
+            tables.append(
+                (
+                    IndexNAV(ticker),
+                    state.nav_since[ticker],
+                    ledger.index_nav_rows[ticker],
+                )
+            )
+
+        for [table, since, rows] in tables:
+            self.__truncate_after(table, since)
+            table.insert_tuples(self.conn, table.columns, rows, commit=False)
+        self.conn.commit()
+
+        lot_tables = [self.realized_gains_table, self.open_lots_table]
+        if trade_since is not None and all(
+            table_exists(self.conn, table.name) for table in lot_tables
+        ):
+            self.update_tax_lot_tables(trade_since)
+
+        if table_exists(self.conn, NAVRollup().name):
+            # portfolio rollups also hold the bank statement cash flows
+            pft_since = state.pft_since
+            if bank_since is not None and pft_since is not None:
+                pft_since = min(pft_since, bank_since)
+
+            self.__update_rollups_after(
+                self.pft_nav_table.name,
+                pft_since,
+                flows=daily_net_flows(self.bnk_table.get_all(self.conn)),
+            )
+            for ticker in tickers:
+                self.__update_rollups_after(
+                    IndexNAV(ticker).name,
+                    state.nav_since[ticker],
+                    "day_payin - day_payout",
+                )
+
+        if table_exists(self.conn, BuildManifest._table):
+            # prices and positions are left to the next build
+            refreshed = [
+                "trade_report",
+                "bank_statement",
+                "portfolio_report",
+                "portfolio_nav",
+                "index_nav",
+                "rollups",
+                "tax_lots",
+            ]
+            manifest = BuildManifest(self.conn)
+            for stage in self.stages(tickers):
+                if stage.name not in refreshed or not all(
+                    table_exists(self.conn, table) for table in stage.outputs
+                ):
+                    manifest.is_current(stage)
+                else:
+                    manifest.record(stage)
+
+        return min(
+            date for date in (trade_since, bank_since) if date is not None
+        )
+
     def change_index_table(self, ticker: str, start="", end="") -> None:
         self.index_table = Index(ticker, start, end)
 
@@ -88,13 +501,63 @@ class Database:
         self.change_index_table(ticker, start, end_str)
 
         if self.index_table is not None:
-            self.index_table.create_new_table(self.conn)
+            # the shadow is filled with the downloaded prices on creation
+            with self.index_table.shadow_build(self.conn):
+                cursor = self.conn.cursor()
+                cursor.execute(f"SELECT COUNT(*) FROM {self.index_table.name}")
+                # a failed download keeps the live table
+                if cursor.fetchone()[0] == 0:
+                    raise Exception(
+                        f"{str(datetime.datetime.now())}: "
+                        f"db:create_index_table: no prices downloaded for "
+                        f"{ticker} from {start} to {end_str}"
+                    )
+
+    def create_index_tables(
+        self,
+        tickers: list[str],
+        start: str = "",
+        price_db: typing.Optional[str] = None,
+    ) -> None:
+        """
+        - Download the price table of every index
+        start :parameter: download start (YYYY-MM-DD), defaults to the
+        first date in the trade report and bank statement files
+        price_db :parameter: database to copy the index price tables from
+        instead of downloading them
+        """
+        if start == "" and price_db is None:
+            first = min(
+                self.tr_table.read_file().index.min(),
+                self.bnk_table.read_file().index.min(),
+            )
+            start = first.strftime("%Y-%m-%d")
+
+        for ticker in tickers:
+            if price_db is not None:
+                self.copy_index_table(ticker, price_db)
+            else:
+                self.create_index_table(ticker, start)
+
+    def copy_index_table(self, ticker: str, src_db: str) -> None:
+        """
+        :parameter ticker: zerodha ticker
+        :parameter src_db: database holding an up to date price table
+        """
+        self.change_index_table(ticker)
+
+        if self.index_table is not None:
+            self.index_table.copy_table(self.conn, src_db)
 
     def create_bank_statment_table(self) -> None:
-        self.bnk_table.create_new_table(self.conn)
+        # the shadow is filled from the statement file on creation
+        with self.bnk_table.shadow_build(self.conn):
+            pass
 
     def create_trade_report_table(self) -> None:
-        self.tr_table.create_new_table(self.conn)
+        # the shadow is filled from the trade report file on creation
+        with self.tr_table.shadow_build(self.conn):
+            pass
 
     def create_index_nav_table(self, ticker: str) -> None:
         """
@@ -105,25 +568,50 @@ class Database:
         self.change_index_nav_table(ticker)
 
         if self.index_nav_table is not None:
-            # create new table
-            self.index_nav_table.create_new_table(self.conn)
-            self.index_nav_table.create_index(self.conn)
+            with self.index_nav_table.shadow_build(self.conn):
+                self.index_nav_table.create_index(self.conn)
 
-            date = self.bnk_table.get_day_zero_date(self.conn)
-            date = time.convert_date_to_strf(date)
+                date = self.bnk_table.get_day_zero_date(self.conn)
+                date = time.convert_date_to_strf(date)
 
-            row_index_nav = IndexNAVRow(
-                date, self.index_nav_table.ticker, 0.0, 0.0, 0.0, 0.0, 0.0
-            )
+                row_index_nav = IndexNAVRow(
+                    date, self.index_nav_table.ticker, 0.0, 0.0, 0.0, 0.0, 0.0
+                )
 
-            # add day zero bank statements to nav
-            self.__add_day_zero_bnk_statements_to_index_nav(row_index_nav)
+                # add day zero bank statements to nav
+                self.__add_day_zero_bnk_statements_to_index_nav(row_index_nav)
 
-            # add nav from day one to current date to the index nav
-            start_date = row_index_nav.date + datetime.timedelta(days=1)
-            self.__add_interval_bnk_statements_to_index_nav(
-                start_date, cur_date, row_index_nav
-            )
+                # add nav from day one to current date to the index nav
+                start_date = row_index_nav.date + datetime.timedelta(days=1)
+                self.__add_interval_bnk_statements_to_index_nav(
+                    start_date, cur_date, row_index_nav
+                )
+
+    def create_index_nav_tables(self, tickers: list[str]) -> None:
+        """
+        - Read bank statements and every index price table once
+        - Compute the nav of all indexes together (see benchmarks.py)
+        - Write every {ticker}_index_nav table in one transaction
+        """
+        cur_date = time.get_current_date()
+        closes = {
+            ticker: Index(ticker).get_all(self.conn) for ticker in tickers
+        }
+        index_navs = compute_index_navs(
+            self.bnk_table.get_all(self.conn), closes, cur_date
+        )
+
+        tables = [IndexNAV(ticker) for ticker in tickers]
+        with contextlib.ExitStack() as stack:
+            for table in tables:
+                stack.enter_context(table.shadow_build(self.conn))
+                table.create_index(self.conn)
+
+            for table in tables:
+                table.insert_tuples(
+                    self.conn, table.columns, index_navs[table.ticker], False
+                )
+            self.conn.commit()
 
     def create_portfolio_table(self) -> None:
         """
@@ -133,25 +621,26 @@ class Database:
         cur_date = time.get_current_date()
         start_date = None
 
-        # create portfolio table
-        self.pft_table.create_new_table(self.conn)
-        self.pft_table.create_index(self.conn)
+        with self.pft_table.shadow_build(self.conn):
+            self.pft_table.create_index(self.conn)
 
-        # day zero trades
-        trades: list[TradeReportRow] = self.tr_table.get_day_zero(self.conn)
-        start_date = trades[0].date
+            # day zero trades
+            trades: list[TradeReportRow] = self.tr_table.get_day_zero(
+                self.conn
+            )
+            start_date = trades[0].date
 
-        for trade in trades:
-            self.pft_table.add_to_portfolio(trade)
+            for trade in trades:
+                self.pft_table.add_to_portfolio(trade)
 
-        # add day zero portfolio
-        self.pft_table.insert_all(
-            self.conn, time.convert_date_to_strf(start_date)
-        )
-        start_date += datetime.timedelta(1)
+            # add day zero portfolio
+            self.pft_table.insert_all(
+                self.conn, time.convert_date_to_strf(start_date)
+            )
+            start_date += datetime.timedelta(1)
 
-        # add trades to portfolio from day 1 to current date
-        self.__add_interval_trades_to_portfolio(start_date, cur_date)
+            # add trades to portfolio from day 1 to current date
+            self.__add_interval_trades_to_portfolio(start_date, cur_date)
 
     def create_portfolio_nav_table(self) -> None:
         """
@@ -160,28 +649,587 @@ class Database:
         """
 
         cur_date = time.get_current_date()
-        self.pft_nav_table.create_new_table(self.conn)
-        self.pft_nav_table.create_index(self.conn)
+        with self.pft_nav_table.shadow_build(self.conn):
+            self.pft_nav_table.create_index(self.conn)
+
+            # day zero portfolio sec
+            day_zero = self.pft_table.get_day_zero_date(self.conn)
+            pft_secs: list[PortfolioRow] = self.pft_table.get(
+                self.conn, day_zero
+            )
+
+            portfolio_nav_row = PortfolioNAVRow(
+                time.convert_date_to_strf(day_zero), 0
+            )
+
+            # add to nav on day zero
+            for sec in pft_secs:
+                portfolio_nav_row.add_to_nav(sec)
+            self.pft_nav_table.insert(self.conn, portfolio_nav_row)
+
+            start_date = day_zero + datetime.timedelta(days=1)
+            # add nav rows using interval
+            self.__add_interval_nav_to_portfolio_nav(
+                start_date, cur_date, portfolio_nav_row
+            )
+
+    def create_portfolio_nav_table_parallel(
+        self, processes: typing.Optional[int] = None
+    ) -> None:
+        """
+        - Create portfolio nav table
+        - Split the portfolio report into FY partitions (same as the csv
+          database files), value each partition in a worker process
+        - Merge partitions in order and write them to the nav table
+        """
+        with self.pft_nav_table.shadow_build(self.conn):
+            self.pft_nav_table.create_index(self.conn)
+
+            day_zero = self.pft_table.get_day_zero_date(self.conn)
+            partitions: dict[int, list[tuple[str, str, str, float]]] = {}
+            for row in self.pft_table.get_all(self.conn):
+                partitions.setdefault(time.date_fy(row.date), []).append(
+                    (
+                        time.convert_date_to_strf(row.date),
+                        row.ticker,
+                        row.isin,
+                        row.quantity,
+                    )
+                )
+
+            with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+                results = pool.map(
+                    _value_portfolio_partition,
+                    [partitions[fy] for fy in sorted(partitions)],
+                )
+
+                # day zero is always written, other days only with a
+                # positive nav
+                day_zero_str = time.convert_date_to_strf(day_zero)
+                nav_rows = [
+                    (date, nav)
+                    for [date, nav] in itertools.chain.from_iterable(results)
+                    if nav > 0 or date == day_zero_str
+                ]
+
+            self.pft_nav_table.insert_tuples(
+                self.conn, self.pft_nav_table.columns, nav_rows
+            )
+
+    def create_ledger_tables(self, tickers: list[str]) -> None:
+        """
+        - Replay bank statements and trades in one merged pass
+        - Write portfolio report, portfolio nav and the index nav of every
+          ticker without re-reading the portfolio report
+        """
+        ledger = Ledger(self.bnk_table, self.tr_table)
+        ledger.run(self.conn, tickers)
+
+        with self.pft_table.shadow_build(self.conn):
+            self.pft_table.create_index(self.conn)
+            self.pft_table.insert_tuples(
+                self.conn, self.pft_table.columns, ledger.portfolio_rows
+            )
+
+        with self.pft_nav_table.shadow_build(self.conn):
+            self.pft_nav_table.create_index(self.conn)
+            self.pft_nav_table.insert_tuples(
+                self.conn,
+                self.pft_nav_table.columns,
+                ledger.portfolio_nav_rows,
+            )
+
+        for ticker in tickers:
+            self.change_index_nav_table(ticker)
+            if self.index_nav_table is not None:
+                with self.index_nav_table.shadow_build(self.conn):
+                    self.index_nav_table.create_index(self.conn)
+                    self.index_nav_table.insert_tuples(
+                        self.conn,
+                        self.index_nav_table.columns,
+                        ledger.index_nav_rows[ticker],
+                    )
+
+    def create_rollup_tables(
+        self, tickers: list[str], full: bool = False
+    ) -> None:
+        """
+        - Rollup portfolio nav, with bank statement cash flows
+        - Rollup every {ticker}_index_nav, with its payin and payout
+        - Only periods from the last stored one onwards are recomputed,
+          unless full is set
+        """
+        flows = daily_net_flows(self.bnk_table.get_all(self.conn))
+        update_rollups(
+            self.conn, self.pft_nav_table.name, flows=flows, full=full
+        )
+
+        for ticker in tickers:
+            update_rollups(
+                self.conn,
+                IndexNAV(ticker).name,
+                "day_payin - day_payout",
+                full=full,
+            )
+
+    def create_prices_table(self) -> None:
+        """
+        - Create prices table
+        - Load the FY price arrays covering each security's holding interval
+        - Bulk insert the closes, keyed by isin
+        - Every security is committed with its checkpoint, an interrupted
+          build resumes after the last committed security
+        """
+        cur_date = time.get_current_date()
+        checkpoints = BuildCheckpoints()
+
+        # closes upto 5 days after the last holding day can be used
+        secs = [
+            (
+                isin,
+                ticker,
+                start,
+                min(end + datetime.timedelta(days=5), cur_date),
+            )
+            for [isin, ticker, start, end] in self.pft_table.get_securities(
+                self.conn
+            )
+        ]
+        keys = {
+            sec[0]: f"{sec[0]}|{time.convert_date_to_strf(sec[2])}|"
+            f"{time.convert_date_to_strf(sec[3])}"
+            for sec in secs
+        }
+
+        with self.prices_table.shadow_build(self.conn, resume=True) as done:
+            # securities whose holding interval changed since the checkpoint
+            stale = done - set(keys.values())
+            self.prices_table.delete_securities(
+                self.conn, [key.split("|")[0] for key in stale]
+            )
+            checkpoints.delete_keys(self.conn, self.prices_table.name, stale)
+
+            for [isin, ticker, start, end] in tqdm.tqdm(
+                [sec for sec in secs if keys[sec[0]] not in done],
+                desc="writing prices table",
+                leave=False,
+            ):
+                arrs = [
+                    get_db_csv().read_fy(isin, fy, ticker)
+                    for fy in range(time.date_fy(start), time.date_fy(end) + 1)
+                ]
 
-        # day zero portfolio sec
-        day_zero = self.pft_table.get_day_zero_date(self.conn)
-        pft_secs: list[PortfolioRow] = self.pft_table.get(self.conn, day_zero)
+                # FY files overlap by a few days
+                [dates, first] = np.unique(
+                    np.concatenate([arr.dates for arr in arrs]),
+                    return_index=True,
+                )
+                closes = np.concatenate([arr.column("Close") for arr in arrs])
+                dates_str = time.convert_datetime64_to_strf(dates)
 
-        portfolio_nav_row = PortfolioNAVRow(
-            time.convert_date_to_strf(day_zero), 0
+                self.prices_table.insert_prices(
+                    self.conn,
+                    [
+                        (date, isin, float(close))
+                        for [date, close] in zip(dates_str, closes[first])
+                    ],
+                    commit=False,
+                )
+                checkpoints.add_key(
+                    self.conn, self.prices_table.name, keys[isin]
+                )
+                self.conn.commit()
+
+            self.prices_table.create_index(self.conn)
+
+    def create_portfolio_nav_table_sql(self) -> None:
+        """
+        - Create portfolio nav table
+        - Value the whole portfolio report in a single holdings x prices
+          aggregate join (prices table should be created first)
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(
+            self.prices_table.missing_prices_query(self.pft_table.name)
+            + " LIMIT 1"
+        )
+        missing = cursor.fetchall()
+        if len(missing) != 0:
+            raise Exception(
+                f"{str(datetime.datetime.now())}: "
+                "db:create_portfolio_nav_table_sql: no price for "
+                f"{missing[0]}"
+            )
+
+        with self.pft_nav_table.shadow_build(self.conn):
+            self.pft_nav_table.create_index(self.conn)
+
+            # day zero is always written, other days only with a positive nav
+            day_zero = time.convert_date_to_strf(
+                self.pft_table.get_day_zero_date(self.conn)
+            )
+            cursor.execute(
+                f"INSERT INTO {self.pft_nav_table.name} (Date, nav) "
+                + self.prices_table.nav_select_query(
+                    self.pft_table.name,
+                    having=f"HAVING nav > 0 OR p.Date = '{day_zero}'",
+                )
+            )
+            self.conn.commit()
+
+    def create_positions_table(self) -> None:
+        """
+        - Create portfolio positions table
+        - Value every holding of the portfolio report with the prices table
+          and derive its weight and pnl (prices table should be created
+          first)
+        - A fully sold security gets a zero quantity row on the snapshot
+          after its sale, valued at that day's close, for its last pnl
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(
+            self.prices_table.holdings_select_query(self.pft_table.name)
+        )
+        holdings = cursor.fetchall()
+        missing = [row for row in holdings if row[-1] is None]
+        if len(missing) != 0:
+            raise Exception(
+                f"{str(datetime.datetime.now())}: "
+                f"db:create_positions_table: no price for {missing[0]}"
+            )
+
+        exits = [
+            (
+                date,
+                ticker,
+                isin,
+                0.0,
+                get_db_csv().read_price(
+                    isin, time.convert_date_strf_to_strp(date), ticker
+                ),
+            )
+            for [date, ticker, isin] in exit_rows(holdings)
+        ]
+        # stable sort, exits go after the holdings of their snapshot
+        rows = compute_positions(
+            sorted(holdings + exits, key=lambda row: row[0])
+        )
+
+        with self.positions_table.shadow_build(self.conn):
+            self.positions_table.insert_tuples(
+                self.conn, self.positions_table.columns, rows
+            )
+            self.positions_table.create_index(self.conn)
+
+    def create_twr_tables(self, tickers: list[str]) -> None:
+        """
+        - Create twr index table
+        - Cumulate the daily log returns of the portfolio positions and of
+          every {ticker}_index_nav (positions and index nav tables should
+          be created first)
+        """
+        with self.twr_table.shadow_build(self.conn):
+            self.twr_table.insert_tuples(
+                self.conn,
+                self.twr_table.columns,
+                portfolio_twr_rows(self.conn),
+                commit=False,
+            )
+            for ticker in tickers:
+                self.twr_table.insert_tuples(
+                    self.conn,
+                    self.twr_table.columns,
+                    index_twr_rows(self.conn, IndexNAV(ticker).name),
+                    commit=False,
+                )
+
+            self.conn.commit()
+            self.twr_table.create_index(self.conn)
+
+    def create_drawdown_tables(
+        self, tickers: list[str], full: bool = False
+    ) -> None:
+        """
+        - Update the underwater curve, drawdown episodes and running peak
+          state of the portfolio and every {ticker}_index_nav (twr index
+          table should be created first)
+        - Only days after the stored state are processed, unless full is
+          set
+        """
+        series = [IndexNAV(ticker).name for ticker in tickers]
+        for name in [self.pft_nav_table.name, *series]:
+            update_drawdowns(self.conn, name, full=full)
+
+    def create_relative_risk_table(
+        self, tickers: list[str], windows: tuple[int, ...] = (21, 63, 126, 252)
+    ) -> None:
+        """
+        - Create relative risk table
+        - Align the portfolio returns of the twr index table with the
+          closes of every {ticker}_price table and compute every window
+          and benchmark in one pass (twr index table should be created
+          first)
+        windows :parameter: rolling window lengths in days
+        """
+        [dates, portfolio, benchmarks] = aligned_returns(
+            self.conn, tickers, self.pft_nav_table.name
         )
+        stats = rolling_relative_risk(portfolio, benchmarks, list(windows))
 
-        # add to nav on day zero
-        for sec in pft_secs:
-            portfolio_nav_row.add_to_nav(sec)
-        self.pft_nav_table.insert(self.conn, portfolio_nav_row)
+        with self.relative_risk_table.shadow_build(self.conn):
+            self.relative_risk_table.insert_tuples(
+                self.conn,
+                self.relative_risk_table.columns,
+                relative_risk_rows(dates, tickers, list(windows), stats),
+            )
+            self.relative_risk_table.create_index(self.conn)
 
-        start_date = day_zero + datetime.timedelta(days=1)
-        # add nav rows using interval
-        self.__add_interval_nav_to_portfolio_nav(
-            start_date, cur_date, portfolio_nav_row
+    def create_xirr_table(
+        self,
+        tickers: list[str],
+        windows: tuple[int, ...] = (0, 30, 91, 182, 365, 1095, 1825),
+    ) -> None:
+        """
+        - Create xirr table
+        - Solve the money weighted return of the bank statement cash flows
+          against the portfolio nav with its uninvested cash and every
+          index nav, for every window at once (bank statement, trade
+          report, portfolio nav and index nav tables should be created
+          first)
+        windows :parameter: trailing windows in calendar days, 0 since the
+        first cash flow
+        """
+        with self.xirr_table.shadow_build(self.conn):
+            self.xirr_table.insert_tuples(
+                self.conn,
+                self.xirr_table.columns,
+                xirr_rows(
+                    self.conn, self.bnk_table, self.tr_table, tickers, windows
+                ),
+            )
+
+    def create_montecarlo_tables(
+        self,
+        paths: int = 10000,
+        horizon: int = 252,
+        block: int = 5,
+        lookback: int = 1095,
+        seed: int = 0,
+        processes: int = 4,
+    ) -> None:
+        """
+        - Create monte carlo bands and risk tables
+        - Bootstrap joint daily returns of the latest holdings from the
+          csv price store and project their nav (portfolio report and
+          prices tables should be created first)
+        paths :parameter: number of simulated paths
+        horizon :parameter: projected days
+        block :parameter: length of the resampled blocks of days
+        lookback :parameter: calendar days sampled from
+        seed :parameter: seed of the simulation, same seed same tables
+        """
+        [date, tickers, isins, values] = montecarlo.latest_holdings(
+            self.conn
+        )
+        returns = montecarlo.lookback_returns(tickers, isins, date, lookback)
+        navs = montecarlo.simulate(
+            returns,
+            values,
+            paths=paths,
+            horizon=horizon,
+            block=block,
+            seed=seed,
+            processes=processes,
         )
 
+        with self.mc_bands_table.shadow_build(self.conn):
+            self.mc_bands_table.insert_tuples(
+                self.conn,
+                self.mc_bands_table.columns,
+                montecarlo.percentile_bands(date, navs),
+            )
+        with self.mc_risk_table.shadow_build(self.conn):
+            self.mc_risk_table.insert_tuples(
+                self.conn,
+                self.mc_risk_table.columns,
+                montecarlo.value_at_risk(date, float(values.sum()), navs),
+            )
+
+    def create_optimal_weights_table(self, rf: float = 0.0) -> None:
+        """
+        - Create optimal weights table
+        - Min variance and max sharpe weights of the latest holdings from
+          the persisted window of returns (portfolio report table
+          should be created first)
+        rf :parameter: annualised risk free rate
+        """
+        optimizer = PortfolioOptimizer(self.conn)
+        optimizer.refresh()
+
+        with self.optimal_weights_table.shadow_build(self.conn):
+            self.optimal_weights_table.insert_tuples(
+                self.conn,
+                self.optimal_weights_table.columns,
+                optimizer.weight_rows(rf),
+            )
+
+    def create_tax_lot_tables(self) -> None:
+        """
+        - Create realized gains and open lots tables
+        - Replay the trade report once through FIFO tax lots (see lots.py)
+        - Value the open lots at the last close in the price store
+        """
+        book = LotBook()
+        book.replay(read_trades(self.conn, self.tr_table))
+
+        with self.realized_gains_table.shadow_build(self.conn):
+            self.realized_gains_table.create_index(self.conn)
+            self.realized_gains_table.insert_tuples(
+                self.conn,
+                self.realized_gains_table.columns,
+                realized_rows(book.closed),
+            )
+        with self.open_lots_table.shadow_build(self.conn):
+            self.open_lots_table.insert_tuples(
+                self.conn,
+                self.open_lots_table.columns,
+                open_lot_rows(book.open_lots()),
+            )
+
+    def update_tax_lot_tables(self, since: datetime.datetime) -> None:
+        """
+        - Restore the open lots before since from the stored tables
+        - Replay only the trades from since on, replace the realized gains
+          from since and the open lots
+        """
+        since_str = time.convert_date_to_strf(since)
+        book = LotBook.restore(self.conn, self.tr_table, since_str)
+        book.replay(read_trades(self.conn, self.tr_table, since_str))
+
+        cursor = self.conn.cursor()
+        cursor.execute(
+            f"DELETE FROM {self.realized_gains_table.name} WHERE Date >= ?",
+            (since_str,),
+        )
+        self.realized_gains_table.insert_tuples(
+            self.conn,
+            self.realized_gains_table.columns,
+            realized_rows(book.closed),
+            commit=False,
+        )
+        cursor.execute(f"DELETE FROM {self.open_lots_table.name}")
+        self.open_lots_table.insert_tuples(
+            self.conn,
+            self.open_lots_table.columns,
+            open_lot_rows(book.open_lots()),
+        )
+
+    def get_scenario_engine(
+        self, session_ticker: str = "nifty50"
+    ) -> ScenarioEngine:
+        """
+        Scenario engine on the stored tables (portfolio report, portfolio
+        nav and prices tables should be created first)
+        """
+        return ScenarioEngine(self.conn, self.tr_table, session_ticker)
+
+    def get_portfolio_nav_sql(
+        self, start: datetime.datetime, end: datetime.datetime
+    ) -> list[PortfolioNAVRow]:
+        """
+        Ad-hoc portfolio valuation between two dates using the prices table
+        """
+        start_str = time.convert_date_to_strf(start)
+        end_str = time.convert_date_to_strf(end)
+
+        cursor = self.conn.cursor()
+        cursor.execute(
+            self.prices_table.nav_select_query(
+                self.pft_table.name,
+                where=f"WHERE p.Date BETWEEN '{start_str}' AND '{end_str}'",
+            )
+        )
+        return [PortfolioNAVRow(*row) for row in cursor.fetchall()]
+
+    def __replace_report(
+        self, table: BNK | TradeReport
+    ) -> typing.Optional[datetime.datetime]:
+        """
+        Diff the report file against its stored table, the table is
+        rewritten only when they differ
+
+        Returns:
+            earliest date with a changed row, None when unchanged
+        """
+        import pandas as pd
+
+        df = table.read_file()
+        incoming = f"{table.name}_incoming"
+        df.to_sql(
+            incoming,
+            self.conn,
+            index=True,
+            if_exists="replace",
+            index_label="Date",
+        )
+
+        new = pd.read_sql(f"SELECT * FROM {incoming}", self.conn)
+        if table_exists(self.conn, table.name):
+            old = pd.read_sql(f"SELECT * FROM {table.name}", self.conn)
+            since = _earliest_change(old, new)
+        else:
+            since = new["Date"].min() if len(new) != 0 else None
+
+        cursor = self.conn.cursor()
+        cursor.execute(f"DROP TABLE {incoming}")
+        self.conn.commit()
+
+        if since is None:
+            return None
+
+        df.to_sql(
+            table.name,
+            self.conn,
+            index=True,
+            if_exists="replace",
+            index_label="Date",
+        )
+        WriteVersions().bump(self.conn, [table.name])
+        self.conn.commit()
+        return time.convert_date_strf_to_strp(since)
+
+    def __truncate_after(
+        self, table: Table, since: typing.Optional[datetime.datetime]
+    ) -> None:
+        """
+        Delete the rows after since, every row when since is None
+        """
+        if not table_exists(self.conn, table.name):
+            table.create_new_table(self.conn)
+            table.create_index(self.conn)
+            return
+
+        cursor = self.conn.cursor()
+        if since is None:
+            cursor.execute(f"DELETE FROM {table.name}")
+        else:
+            cursor.execute(
+                f"DELETE FROM {table.name} WHERE Date > ?",
+                (time.convert_date_to_strf(since),),
+            )
+
+    def __update_rollups_after(
+        self,
+        series: str,
+        since: typing.Optional[datetime.datetime],
+        flow_column: typing.Optional[str] = None,
+        flows: typing.Optional[dict[datetime.datetime, float]] = None,
+    ) -> None:
+        if since is not None:
+            since_str = time.convert_date_to_strf(since)
+            truncate_rollups(self.conn, series, since_str)
+        update_rollups(self.conn, series, flow_column, flows, since is None)
+
     def __add_day_zero_bnk_statements_to_index_nav(
         self, row_index_nav: IndexNAVRow
     ) -> None:
@@ -306,7 +1354,7 @@ class Database:
 
                 # write to table
                 # only write to table if prices exist on that day
-                self.change_index_table("nifty50")
+                self.change_index_table(SESSION_TICKER)
                 if self.index_table is not None:
                     rows: list[IndexRow] = self.index_table.get(self.conn, day)
 
@@ -350,3 +1398,46 @@ class Database:
                     self.pft_nav_table.insert(self.conn, pft_nav_row)
 
                 pbar.update(1)
+
+
+def _value_portfolio_partition(
+    rows: list[tuple[str, str, str, float]],
+) -> list[tuple[str, float]]:
+    """
+    Worker: value date ordered (Date, ticker, isin, quantity) portfolio
+    report rows, only the partition's FY prices get loaded
+
+    Returns:
+        list[(Date, nav)]
+    """
+    ret = []
+    for [date, secs] in itertools.groupby(rows, key=lambda row: row[0]):
+        pft_nav_row = PortfolioNAVRow(date, 0)
+        for sec in secs:
+            pft_nav_row.add_to_nav(PortfolioRow(*sec))
+        ret.append((date, pft_nav_row.nav))
+
+    return ret
+
+
+def _earliest_change(
+    old: "pd.DataFrame", new: "pd.DataFrame"
+) -> typing.Optional[str]:
+    """
+    Rows are compared as multisets, so reordered rows are not a change
+
+    Returns:
+        earliest Date of a row found in only one of the frames, None when
+        both hold the same rows
+    """
+    if list(old.columns) != list(new.columns):
+        return min([*old["Date"], *new["Date"]])
+
+    counts = old.value_counts(dropna=False).sub(
+        new.value_counts(dropna=False), fill_value=0
+    )
+    changed = counts[counts != 0]
+    if len(changed) == 0:
+        return None
+
+    return min(changed.index.get_level_values("Date"))
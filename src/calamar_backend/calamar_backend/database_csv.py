@@ -2,22 +2,41 @@
 CSV Database
     Read:
         - read from CSV Dir
-        - read from LRU
+        - read from LRU, the LRU is guarded by a lock so that the shared
+          database can be read from several threads (pipeline stages)
         - read from yahoo finance
+        - check whether a FY file is present without downloading it
+        - closes of several securities over a date range, aligned on the
+          union of their price days
+
+    Memory:
+        - frames are cached as PriceArray objects, optionally projected to a
+          subset of columns (e.g. Close) and downcast (e.g. float32)
+
+    Shared database:
+        - get_db_csv builds it from $CALAMAR_CSV_DB on first use, so
+          importing this module reads no configuration
+        - with $CALAMAR_PRICE_SHM set it reads from that shared memory
+          price store first (see price_cache.py)
 """
 import datetime
-import pandas as pd
+import numpy as np
 import os
 import pathlib
 import enum
+import threading
 import typing
 
 import calamar_backend.time as time
-from calamar_backend.maps import calamar_ticker_map
+from calamar_backend.maps import get_ticker_map
 from calamar_backend.price import download_price as yf_download_price
 import calamar_backend.utils as ut
 import calamar_backend.errors as er
 
+if typing.TYPE_CHECKING:
+    import pandas as pd
+    from calamar_backend.price_cache import SharedPriceStore
+
 
 class TickerType(enum.Enum):
     isin = 0
@@ -26,6 +45,83 @@ class TickerType(enum.Enum):
     nan = 3
 
 
+class PriceArray:
+    """
+    Compact in-memory copy of a FY price frame
+        - dates: sorted datetime64[s] array
+        - columns: names of the projected columns
+        - values: 2d array (dates x columns)
+    """
+
+    def __init__(
+        self, dates: np.ndarray, columns: tuple[str, ...], values: np.ndarray
+    ) -> None:
+        self.dates = dates
+        self.columns = columns
+        self.values = values
+
+    @classmethod
+    def from_dataframe(
+        cls,
+        df: "pd.DataFrame",
+        columns: typing.Optional[typing.Sequence[str]] = None,
+        dtype: str = "float64",
+    ) -> "PriceArray":
+        """
+        df :parameter: yfinance frame with a DatetimeIndex
+        columns :parameter: columns to keep, None keeps every column
+        dtype :parameter: dtype of the value array
+        """
+        if columns is not None:
+            df = df[list(columns)]
+
+        dates = df.index.values.astype("datetime64[s]")
+        order = np.argsort(dates, kind="stable")
+        values = df.to_numpy(dtype=dtype)[order]
+        return cls(dates[order], tuple(df.columns), values)
+
+    @property
+    def nbytes(self) -> int:
+        return self.dates.nbytes + self.values.nbytes
+
+    def locate(self, date: datetime.datetime) -> int:
+        """
+        Returns:
+            row position of date
+
+        Raises:
+            KeyError if date is not present
+        """
+        key = np.datetime64(date, "s")
+        pos = int(np.searchsorted(self.dates, key))
+
+        if pos == len(self.dates) or self.dates[pos] != key:
+            raise KeyError(str(date))
+
+        return pos
+
+    def column(self, column: str = "Close") -> np.ndarray:
+        return self.values[:, self.columns.index(column)]
+
+    def get(self, pos: int, column: str = "Close") -> float:
+        return float(self.values[pos, self.columns.index(column)])
+
+    def row(self, pos: int) -> "pd.Series":
+        import pandas as pd
+
+        return pd.Series(
+            self.values[pos],
+            index=list(self.columns),
+            name=pd.Timestamp(self.dates[pos]),
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f"(PriceArray rows:{len(self.dates)} columns:{self.columns} "
+            f"dtype:{self.values.dtype})"
+        )
+
+
 class DatabaseCSV:
     """
     Reads and writes FY equity price csv data
@@ -33,8 +129,26 @@ class DatabaseCSV:
 
     csv_dir_path = None
 
-    def __init__(self, mem_slots: int) -> None:
-        DatabaseCSV.csv_dir_path = os.getenv("CALAMAR_CSV_DB")
+    def __init__(
+        self,
+        mem_slots: int,
+        columns: typing.Optional[typing.Sequence[str]] = None,
+        dtype: str = "float64",
+        csv_dir: typing.Optional[str] = None,
+        shared: typing.Optional["SharedPriceStore"] = None,
+    ) -> None:
+        """
+        mem_slots :parameter: number of FY frames kept in memory
+        columns :parameter: columns kept in memory, None keeps every column
+        dtype :parameter: dtype of the in-memory price values
+        csv_dir :parameter: csv database directory, defaults to
+        $CALAMAR_CSV_DB
+        shared :parameter: shared memory price store read before the LRU
+        and the csv directory
+        """
+        if csv_dir is None:
+            csv_dir = os.getenv("CALAMAR_CSV_DB")
+        DatabaseCSV.csv_dir_path = csv_dir
 
         if DatabaseCSV.csv_dir_path is None:
             raise Exception(
@@ -43,7 +157,12 @@ class DatabaseCSV:
             )
 
         self.mem_slots = mem_slots
-        self.lru: list[tuple[str, int, pd.DataFrame]] = []
+        self.columns = tuple(columns) if columns is not None else None
+        self.dtype = dtype
+        self.lru: list[tuple[str, int, PriceArray]] = []
+        # an LRU location is only valid while the lock is held
+        self.lru_lock = threading.RLock()
+        self.shared = shared
 
     @classmethod
     def get_csv_file_path(cls, isin: str, fy: int) -> str:
@@ -98,27 +217,31 @@ class DatabaseCSV:
 
         return -1
 
-    def lru_append_data(self, isin: str, fy: int, df: pd.DataFrame) -> None:
+    def lru_append_data(self, isin: str, fy: int, df: PriceArray) -> None:
         """
-        Implements an LRU memory storage using pandas
+        Implements an LRU memory storage using price arrays
         Only a certain amount of df's are kept in memory
 
         :parameter isin: can be isin, ticker or map_
         """
-        mem_loc = self.__lru_find_dataframe(isin, fy)
+        with self.lru_lock:
+            mem_loc = self.__lru_find_dataframe(isin, fy)
 
-        if mem_loc == -1:
-            if len(self.lru) == self.mem_slots:
-                self.lru.pop(0)
-                self.lru.append((isin, fy, df))
+            if mem_loc == -1:
+                if len(self.lru) == self.mem_slots:
+                    self.lru.pop(0)
+                    self.lru.append((isin, fy, df))
 
+                else:
+                    self.lru.append((isin, fy, df))
             else:
+                self.lru.pop(mem_loc)
                 self.lru.append((isin, fy, df))
-        else:
-            self.lru.pop(mem_loc)
-            self.lru.append((isin, fy, df))
 
-    def __read_df_from_lru(self, loc: int) -> pd.DataFrame:
+    def __to_price_array(self, df: "pd.DataFrame") -> PriceArray:
+        return PriceArray.from_dataframe(df, self.columns, self.dtype)
+
+    def __read_df_from_lru(self, loc: int) -> PriceArray:
         """
         Read from LRU
         """
@@ -127,19 +250,27 @@ class DatabaseCSV:
         self.lru_append_data(isin, fy, df)
         return df
 
-    def __read_df_from_csv_dir(self, isin: str, fy: int) -> pd.DataFrame:
+    def __read_df_from_csv_dir(self, isin: str, fy: int) -> PriceArray:
         """
         Read data from CSV directory
+        Only the projected columns are parsed
         """
-        df = pd.read_csv(self.get_csv_file_path(isin, fy))
+        import pandas as pd
+
+        usecols = None
+        if self.columns is not None:
+            usecols = ["Date", *self.columns]
+
+        df = pd.read_csv(self.get_csv_file_path(isin, fy), usecols=usecols)
         df["Date"] = pd.to_datetime(df["Date"])
         df = df.set_index("Date")
-        self.lru_append_data(isin, fy, df)
-        return df
+        arr = self.__to_price_array(df)
+        self.lru_append_data(isin, fy, arr)
+        return arr
 
     def __read_df_from_yf(
         self, isin: str, fy: int, ticker: str, map_: str = ""
-    ) -> pd.DataFrame:
+    ) -> PriceArray:
         """
         Read data from yahoo finance
         ticker :parameter: unique isin number
@@ -168,12 +299,13 @@ class DatabaseCSV:
             index_label="Date",
         )
 
-        self.lru_append_data(isin, fy, df)
-        return df
+        arr = self.__to_price_array(df)
+        self.lru_append_data(isin, fy, arr)
+        return arr
 
     def read(
         self, isin: str, date: datetime.datetime, ticker: str = ""
-    ) -> tuple[int, pd.Series | None]:
+    ) -> tuple[int, "pd.Series | None"]:
         """
         - get fy year
         - check if file exists
@@ -185,48 +317,168 @@ class DatabaseCSV:
         [int, pd.Series| None]
         the integer variable is the location of df in LRU
         """
+        [loc, arr, pos] = self.__locate(isin, date, ticker)
+        return (loc, arr.row(pos))
 
-        loc: int = -1  # location of DF in LRU
-        fy = time.date_fy(date)
-        ret = None
-        df = None
-        dt = time.convert_date_to_strf(date)
-        count = 5
-        file_exists = False
+    def read_price(
+        self,
+        isin: str,
+        date: datetime.datetime,
+        ticker: str = "",
+        column: str = "Close",
+    ) -> float:
+        """
+        Same lookup as read, but returns a single column value
+        without building a pd.Series
+        """
+        [_, arr, pos] = self.__locate(isin, date, ticker)
+        return arr.get(pos, column)
+
+    def read_fy(self, isin: str, fy: int, ticker: str = "") -> PriceArray:
+        """
+        Returns the whole FY price array of a security
+        """
+        [map_, ticker] = self.__resolve_ticker(ticker)
+        return self.__load_fy(isin, fy, ticker, map_)[-1]
 
+    def has_fy(self, isin: str, fy: int, ticker: str = "") -> bool:
+        """
+        Whether the FY price array is in the shared store or the csv
+        directory, without downloading it
+        """
+        [map_, ticker] = self.__resolve_ticker(ticker)
+        if self.shared is not None:
+            for key in (isin, ticker, map_):
+                if key != "" and self.shared.get(key, fy) is not None:
+                    return True
+
+        return self.file_exists(isin, fy, ticker, map_)[0]
+
+    def read_closes(
+        self,
+        securities: list[tuple[str, str, datetime.datetime]],
+        start: datetime.datetime,
+        end: datetime.datetime,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        securities :parameter: (isin, ticker, first day to read) of every
+        column
+
+        FYs before the first one in the store are not downloaded, a
+        security listed after start has no closes before its listing
+
+        Returns:
+            [days, closes]
+            union of the price days in [start, end] and the (days x
+            securities) closes, NaN where a security has no close
+        """
+        [dates, cols, values] = [[], [], []]
+        for [col, [isin, ticker, first]] in enumerate(securities):
+            first = max(first, start)
+            fys = range(time.date_fy(first), time.date_fy(end) + 1)
+            stored = [fy for fy in fys if self.has_fy(isin, fy, ticker)]
+            first_fy = stored[0] if len(stored) != 0 else fys[-1]
+            for fy in range(first_fy, fys[-1] + 1):
+                arr = self.read_fy(isin, fy, ticker)
+                keep = (arr.dates >= np.datetime64(first, "s")) & (
+                    arr.dates <= np.datetime64(end, "s")
+                )
+                dates.append(arr.dates[keep])
+                cols.append(np.full(int(keep.sum()), col))
+                values.append(arr.column("Close")[keep])
+
+        if sum(len(d) for d in dates) == 0:
+            return (
+                np.array([], "datetime64[s]"),
+                np.zeros((0, len(securities))),
+            )
+
+        all_dates = np.concatenate(dates)
+        days = np.unique(all_dates)
+        closes = np.full((len(days), len(securities)), np.nan)
+        # FY files overlap by a few days, the same close is written twice
+        closes[np.searchsorted(days, all_dates), np.concatenate(cols)] = (
+            np.concatenate(values)
+        )
+        return (days, closes)
+
+    def __resolve_ticker(self, ticker: str) -> tuple[str, str]:
+        """
+        Returns:
+        [str, str]
+        ticker map entry (or "") and the yahoo ticker
+        """
         try:
-            map_ = calamar_ticker_map.get(ticker)
+            map_ = get_ticker_map().get(ticker)
         except er.NoTickerMappingError:
             map_ = ""
 
-        ticker = ut.ticker_to_yf_ticker(ticker)
+        return (map_, ut.ticker_to_yf_ticker(ticker))
 
-        # loop until price is found
-        while True:
-            try:
-                [file_exists, file_type] = self.file_exists(
-                    isin, fy, ticker, map_
-                )
+    def __load_fy(
+        self, isin: str, fy: int, ticker: str, map_: str
+    ) -> tuple[int, bool, PriceArray]:
+        """
+        Load FY price array from LRU, CSV dir or yahoo finance
+
+        Returns:
+        [int, bool, PriceArray]
+        location of df in LRU, whether the file existed and the price array
+        """
+        loc: int = -1
+
+        # published arrays are views, they are not copied into the LRU
+        if self.shared is not None:
+            for key in (isin, ticker, map_):
+                arr = self.shared.get(key, fy) if key != "" else None
+                if arr is not None:
+                    return (loc, True, arr)
+
+        [file_exists, file_type] = self.file_exists(isin, fy, ticker, map_)
+
+        match file_type:
+            case TickerType.ticker:
+                tmp_isin = ticker
+            case TickerType.map_:
+                tmp_isin = map_
+            case _:
+                tmp_isin = isin  # keep isin as isin
+
+        if file_exists:
+            with self.lru_lock:
+                loc = self.__lru_find_dataframe(tmp_isin, fy)
+                if loc != -1:
+                    df = self.__read_df_from_lru(loc)
+            if loc == -1:
+                df = self.__read_df_from_csv_dir(tmp_isin, fy)
 
-                match file_type:
-                    case TickerType.ticker:
-                        tmp_isin = ticker
-                    case TickerType.map_:
-                        tmp_isin = map_
-                    case _:
-                        tmp_isin = isin  # keep isin as isin
-
-                if file_exists:
-                    loc = self.__lru_find_dataframe(tmp_isin, fy)
-                    if loc != -1:
-                        df = self.__read_df_from_lru(loc)
-                    else:
-                        df = self.__read_df_from_csv_dir(tmp_isin, fy)
+        else:
+            df = self.__read_df_from_yf(isin, fy, ticker, map_)
 
-                else:
-                    df = self.__read_df_from_yf(isin, fy, ticker, map_)
+        return (loc, file_exists, df)
 
-                ret = df.loc[dt]
+    def __locate(
+        self, isin: str, date: datetime.datetime, ticker: str = ""
+    ) -> tuple[int, PriceArray, int]:
+        """
+        Returns:
+        [int, PriceArray, int]
+        location of df in LRU, the price array and the row position of date
+        """
+
+        loc: int = -1  # location of DF in LRU
+        fy = time.date_fy(date)
+        pos = -1
+        count = 5
+        file_exists = False
+
+        [map_, ticker] = self.__resolve_ticker(ticker)
+
+        # loop until price is found
+        while True:
+            try:
+                [loc, file_exists, df] = self.__load_fy(isin, fy, ticker, map_)
+                pos = df.locate(date)
                 break
 
             except KeyError:
@@ -236,16 +488,51 @@ class DatabaseCSV:
                         f"{str(datetime.datetime.now())}: "
                         "something went wrong, can't get "
                         f"price for {str(date)} {ticker} - {isin} "
-                        f"file_exists: {file_exists}, loc:{self.lru[loc]}"
+                        f"file_exists: {file_exists}, loc:{loc}"
                     )
 
                 count -= 1
                 date += datetime.timedelta(days=1)
                 fy = time.date_fy(date)
-                dt = time.convert_date_to_strf(date)
                 continue
 
-        return (loc, ret)
+        return (loc, df, pos)
+
+
+_db_csv: typing.Optional[DatabaseCSV] = None
+
+
+def get_db_csv() -> DatabaseCSV:
+    """
+    Shared csv database, built on first use unless one was set with
+    set_db_csv
+    """
+    global _db_csv
+    if _db_csv is None:
+        shared = None
+        shm_name = os.getenv("CALAMAR_PRICE_SHM")
+        if shm_name is not None:
+            from calamar_backend.price_cache import SharedPriceStore
+
+            shared = SharedPriceStore.attach(shm_name)
+
+        # only Close is read when building navs
+        _db_csv = DatabaseCSV(
+            50, columns=("Close",), dtype="float32", shared=shared
+        )
+    return _db_csv
+
+
+def set_db_csv(db: typing.Optional[DatabaseCSV]) -> None:
+    """
+    Replace the shared csv database, None rebuilds it on next use
+    """
+    global _db_csv
+    _db_csv = db
 
 
-db_csv = DatabaseCSV(50)
+def __getattr__(name: str) -> typing.Any:
+    # db_csv is built on first access instead of on import
+    if name == "db_csv":
+        return get_db_csv()
+    raise AttributeError(f"module {__name__} has no attribute {name}")
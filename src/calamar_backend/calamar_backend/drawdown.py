@@ -0,0 +1,180 @@
+"""
+Drawdowns
+    - underwater curve and drawdown episodes (peak, trough, recovery,
+      depth) of the cash flow adjusted nav series, from the cumulative log
+      returns of twr_index (see twr.py)
+    - one pass over a series: running peak with np.maximum.accumulate,
+      episodes are the stretches between two days at the peak
+    - a running peak state (drawdown_state) is kept for every series, a
+      daily update only processes the days after it
+    - max drawdown of any log wealth array (calmar ratio)
+"""
+import sqlite3
+import typing
+import numpy as np
+
+import calamar_backend.time as time
+from calamar_backend.table_interface import (
+    DrawdownEpisodes,
+    DrawdownState,
+    TWR,
+    Underwater,
+)
+from calamar_backend.table_row_interface import DrawdownStateRow
+
+# tolerance when checking that the series did not change before the state
+STATE_TOLERANCE = 1e-9
+
+
+def max_drawdown(log_wealth: np.ndarray) -> float:
+    """
+    Returns:
+        deepest fall below the running peak (<= 0), 0 for an empty array
+    """
+    if len(log_wealth) == 0:
+        return 0.0
+    return float(
+        np.expm1(np.min(log_wealth - np.maximum.accumulate(log_wealth)))
+    )
+
+
+def compute_drawdowns(
+    series: str,
+    dates: typing.Sequence[str],
+    log_wealth: np.ndarray,
+    state: typing.Optional[DrawdownStateRow] = None,
+) -> tuple[list[tuple], list[tuple], tuple]:
+    """
+    dates, log_wealth :parameter: date ordered cumulative log returns
+    state :parameter: running peak state of the days before dates
+
+    Returns:
+        [underwater, episodes, state]
+        rows in Underwater, DrawdownEpisodes and DrawdownState column order,
+        episodes start from the state's peak or later
+    """
+    # the state is replayed as its peak and trough days in front of the
+    # new days, so that an open episode continues
+    head: list[tuple[str, float]] = []
+    if state is not None:
+        head.append((time.convert_date_to_strf(state.peak_date), state.peak))
+        if state.trough < state.peak:
+            head.append(
+                (time.convert_date_to_strf(state.trough_date), state.trough)
+            )
+
+    all_dates = [item[0] for item in head] + list(dates)
+    wealth = np.r_[[item[1] for item in head], log_wealth]
+    new = slice(len(head), len(wealth))
+
+    peak = np.maximum.accumulate(wealth)
+    depth = np.expm1(wealth - peak)
+    underwater = [
+        (date, series, float(value))
+        for [date, value] in zip(dates, depth[new])
+    ]
+
+    # segment k runs from the k-th day at the peak to the next one, its
+    # first lowest day is the trough
+    at_peak = wealth >= peak
+    peaks = np.flatnonzero(at_peak)
+    segment = np.cumsum(at_peak) - 1
+    order = np.lexsort((np.arange(len(wealth)), wealth, segment))
+    first = np.r_[True, segment[order][1:] != segment[order][:-1]]
+    troughs = order[first]
+
+    episodes = []
+    for k in np.flatnonzero(wealth[troughs] < wealth[peaks]):
+        recovery = all_dates[peaks[k + 1]] if k + 1 < len(peaks) else None
+        episodes.append(
+            (
+                all_dates[peaks[k]],
+                series,
+                all_dates[troughs[k]],
+                recovery,
+                float(np.expm1(wealth[troughs[k]] - wealth[peaks[k]])),
+            )
+        )
+
+    last_state = (
+        all_dates[-1],
+        series,
+        float(wealth[-1]),
+        float(wealth[peaks[-1]]),
+        all_dates[peaks[-1]],
+        float(wealth[troughs[-1]]),
+        all_dates[troughs[-1]],
+    )
+    return (underwater, episodes, last_state)
+
+
+def update_drawdowns(
+    conn: sqlite3.Connection, series: str, full: bool = False
+) -> None:
+    """
+    series :parameter: twr_index series (portfolio_nav, {ticker}_index_nav)
+    full :parameter: drop the stored rows of the series and recompute
+
+    Only the days after the stored state are processed, the series is
+    recomputed when its value on the state day changed (rebuilt history)
+    """
+    [curve, episodes, states] = [
+        Underwater(),
+        DrawdownEpisodes(),
+        DrawdownState(),
+    ]
+    for table in (curve, episodes, states):
+        table.ensure_table(conn)
+
+    cursor = conn.cursor()
+    state = None if full else states.get_series(conn, series)
+    if state is not None:
+        cursor.execute(
+            f"SELECT cum_log_return FROM {TWR().name} "
+            "WHERE series = ? AND Date = ?",
+            (series, time.convert_date_to_strf(state.date)),
+        )
+        stored = cursor.fetchone()
+        if (
+            stored is None
+            or abs(stored[0] - state.cum_log_return) > STATE_TOLERANCE
+        ):
+            state = None
+
+    since = ""
+    if state is not None:
+        since = time.convert_date_to_strf(state.date)
+
+    cursor.execute(
+        f"SELECT Date, cum_log_return FROM {TWR().name} "
+        "WHERE series = ? AND Date > ? ORDER BY Date",
+        (series, since),
+    )
+    rows = cursor.fetchall()
+    if state is not None and len(rows) == 0:
+        return
+
+    if state is None:
+        states.delete_series(conn, [curve, episodes], series)
+    else:
+        episodes.delete_open(conn, series)
+
+    if len(rows) != 0:
+        [underwater, new_episodes, new_state] = compute_drawdowns(
+            series,
+            [row[0] for row in rows],
+            np.array([row[1] for row in rows], dtype="float64"),
+            state,
+        )
+        curve.insert_tuples(conn, curve.columns, underwater, commit=False)
+        episodes.insert_tuples(
+            conn, episodes.columns, new_episodes, commit=False
+        )
+        cursor.execute(
+            f"INSERT OR REPLACE INTO {states.name} "
+            f"({', '.join(states.columns)}) VALUES "
+            f"({', '.join('?' * len(states.columns))})",
+            new_state,
+        )
+
+    conn.commit()
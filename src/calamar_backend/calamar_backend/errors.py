@@ -14,3 +14,14 @@ class NoTickerMappingError(Exception):
 class DayBankStatementNotFoundError(Exception):
     def __init__(self):
         Exception.__init__(self)
+
+
+class PriceCoverageError(Exception):
+    """
+    coverage :parameter: preflight report with the price gaps and the
+    unresolvable securities (see coverage.py)
+    """
+
+    def __init__(self, coverage):
+        Exception.__init__(self, str(coverage))
+        self.coverage = coverage
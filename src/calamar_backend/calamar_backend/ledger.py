@@ -0,0 +1,244 @@
+"""
+Ledger
+    - a single pass over the trade report and trading sessions builds
+      holdings and portfolio nav
+    - the index nav of any number of benchmarks is computed from the bank
+      statements in the same run (see benchmarks.compute_index_navs)
+    - the replay can resume from the stored holdings snapshot and index
+      nav rows before a date, only rows after them are rebuilt
+
+    Note: bank statements on a day without an index close are carried to
+    the next day with a close, instead of failing the build
+"""
+import datetime
+import sqlite3
+import typing
+import tqdm
+
+import calamar_backend.time as time
+from calamar_backend.benchmarks import compute_index_navs
+from calamar_backend.database_csv import get_db_csv
+from calamar_backend.table_interface import (
+    BankStatement as BNK,
+    Index,
+    IndexNAV,
+    Portfolio,
+    TradeReport,
+    table_exists,
+)
+from calamar_backend.table_row_interface import (
+    IndexNAVRow,
+    TradeReportRow,
+)
+
+
+class LedgerState:
+    """
+    Replay state restored from the stored tables
+    Events and days up to a component's since date are already accounted
+    for, None replays the component from the start
+    """
+
+    def __init__(
+        self,
+        pft_since: typing.Optional[datetime.datetime] = None,
+        portfolio: typing.Optional[dict[str, TradeReportRow]] = None,
+        pft_day_zero: typing.Optional[datetime.datetime] = None,
+        nav_since: typing.Optional[
+            dict[str, typing.Optional[datetime.datetime]]
+        ] = None,
+        index_navs: typing.Optional[dict[str, IndexNAVRow]] = None,
+    ):
+        self.pft_since = pft_since
+        self.portfolio = portfolio if portfolio is not None else {}
+        self.pft_day_zero = pft_day_zero
+        self.nav_since = nav_since if nav_since is not None else {}
+        self.index_navs = index_navs if index_navs is not None else {}
+
+    def __str__(self) -> str:
+        return f"(pft_since:{self.pft_since} nav_since:{self.nav_since})"
+
+
+class Ledger:
+    """
+    Replay of bank statements and trades
+    """
+
+    def __init__(self, bnk_table: BNK, tr_table: TradeReport):
+        self.bnk_table = bnk_table
+        self.tr_table = tr_table
+
+        # outputs of the last run
+        self.portfolio_rows: list[tuple[str, str, str, float]] = []
+        self.portfolio_nav_rows: list[tuple[str, float]] = []
+        self.index_nav_rows: dict[str, list[tuple]] = {}
+
+    def restore(
+        self,
+        conn: sqlite3.Connection,
+        tickers: list[str],
+        trade_since: typing.Optional[datetime.datetime],
+        bank_since: typing.Optional[datetime.datetime],
+    ) -> LedgerState:
+        """
+        trade_since :parameter: earliest changed trade date, None when the
+        trades did not change
+        bank_since :parameter: earliest changed bank statement date, None
+        when the bank statements did not change
+
+        Returns:
+            state from the last holdings snapshot before trade_since and the
+            last index nav rows before bank_since
+        """
+        cur_date = time.get_current_date()
+        cursor = conn.cursor()
+        state = LedgerState(pft_since=cur_date)
+
+        pft_table = Portfolio()
+        if trade_since is not None:
+            state.pft_since = None
+            snapshot = self.__last_before(conn, pft_table.name, trade_since)
+            if snapshot is not None:
+                cursor.execute(f"SELECT MIN(Date) FROM {pft_table.name}")
+                state.pft_day_zero = time.convert_date_strf_to_strp(
+                    cursor.fetchone()[0]
+                )
+                state.pft_since = time.convert_date_strf_to_strp(snapshot)
+                for sec in pft_table.get(conn, state.pft_since):
+                    state.portfolio[sec.ticker] = TradeReportRow(
+                        snapshot, sec.ticker, sec.isin, "buy", sec.quantity
+                    )
+
+        for ticker in tickers:
+            state.nav_since[ticker] = cur_date
+            if bank_since is None:
+                continue
+
+            table = IndexNAV(ticker)
+            state.nav_since[ticker] = None
+            last = self.__last_before(conn, table.name, bank_since)
+            if last is not None:
+                rows = table.get(conn, time.convert_date_strf_to_strp(last))
+                row = rows[-1]
+                row.reset()
+                state.nav_since[ticker] = row.date
+                state.index_navs[ticker] = row
+
+        return state
+
+    def __last_before(
+        self, conn: sqlite3.Connection, table: str, date: datetime.datetime
+    ) -> typing.Optional[str]:
+        """
+        Returns:
+            last Date in table before date, None when there is none or the
+            table does not exist
+        """
+        if not table_exists(conn, table):
+            return None
+
+        cursor = conn.cursor()
+        cursor.execute(
+            f"SELECT MAX(Date) FROM {table} WHERE Date < ?",
+            (time.convert_date_to_strf(date),),
+        )
+        return cursor.fetchone()[0]
+
+    def run(
+        self,
+        conn: sqlite3.Connection,
+        tickers: list[str],
+        session_ticker: str = "nifty50",
+        resume: typing.Optional[LedgerState] = None,
+    ) -> None:
+        """
+        tickers :parameter: benchmark tickers (from the ticker map)
+        session_ticker :parameter: index whose closes mark portfolio sessions
+        resume :parameter: state to resume from (see restore), only rows
+        after its since dates are produced
+
+        - holdings are snapshotted on trade day zero and every session
+        - portfolio nav is written for snapshots with a positive nav
+        - index nav is written for every day the index has a close
+        """
+        if resume is None:
+            resume = LedgerState()
+
+        def is_new(
+            date: datetime.datetime, since: typing.Optional[datetime.datetime]
+        ) -> bool:
+            return since is None or date > since
+
+        cur_date = time.get_current_date()
+        closes = {ticker: Index(ticker).get_all(conn) for ticker in tickers}
+        sessions = {row.date for row in Index(session_ticker).get_all(conn)}
+
+        # benchmarks
+        self.index_nav_rows = compute_index_navs(
+            self.bnk_table.get_all(conn),
+            closes,
+            cur_date,
+            {ticker: resume.nav_since.get(ticker) for ticker in tickers},
+            resume.index_navs,
+        )
+
+        # holdings and portfolio nav
+        pft = Portfolio()
+        pft.portfolio = resume.portfolio
+        self.portfolio_rows = []
+        self.portfolio_nav_rows = []
+
+        trades = self.tr_table.get_all(conn)
+        if len(trades) == 0:
+            return
+
+        pft_day_zero = resume.pft_day_zero
+        days = sorted(
+            {
+                day
+                for day in sessions
+                if trades[0].date <= day <= cur_date
+            }.union({trades[0].date})
+        )
+
+        pos = 0
+        for day in tqdm.tqdm(days, desc="replaying ledger", leave=False):
+            # apply every trade up to and including day
+            while pos < len(trades) and trades[pos].date <= day:
+                trade = trades[pos]
+                if is_new(trade.date, resume.pft_since):
+                    if pft_day_zero is None:
+                        pft_day_zero = trade.date
+                    pft.add_to_portfolio(trade)
+                pos += 1
+
+            if (
+                pft_day_zero is not None
+                and is_new(day, resume.pft_since)
+                and (day in sessions or day == pft_day_zero)
+            ):
+                self.__snapshot_portfolio(pft, day, day == pft_day_zero)
+
+    def __snapshot_portfolio(
+        self, pft: Portfolio, day: datetime.datetime, is_day_zero: bool
+    ) -> None:
+        """
+        Record holdings and value them on day
+        """
+        pft.remove_ne_quantity()
+        date_str = time.convert_date_to_strf(day)
+        nav = 0.0
+
+        db_csv = get_db_csv()
+
+        for trade in pft.portfolio.values():
+            self.portfolio_rows.append(
+                (date_str, trade.ticker, trade.isin, trade.quantity)
+            )
+            nav += (
+                db_csv.read_price(trade.isin, day, trade.ticker)
+                * trade.quantity
+            )
+
+        if nav > 0 or is_day_zero:
+            self.portfolio_nav_rows.append((date_str, nav))
@@ -0,0 +1,252 @@
+"""
+Tax lots
+    - every buy of the trade report opens a lot numbered in trade order,
+      sells close the oldest open lots of the ticker first (FIFO); a sell
+      larger than the open lots only closes what is open, same as the
+      ledger dropping negative holdings
+    - every closed part of a lot is a realized gain: quantity x (sell
+      price - buy price), the days it was held and its term, long when
+      held for more than LONG_TERM_DAYS
+    - open lots are valued at the last close upto the current date in the
+      price store (unrealized pnl)
+    - the replay keeps one deque of open lots per ticker, holding days,
+      gains and terms are computed afterwards on whole arrays
+    - incremental: the open lots before a date are the stored open lots
+      bought before it and the parts of them closed on or after it
+      (realized rows carry their lot number); only the trades from the
+      date on are replayed on them
+"""
+import collections
+import datetime
+import sqlite3
+import typing
+import numpy as np
+
+import calamar_backend.time as time
+from calamar_backend.database_csv import get_db_csv
+from calamar_backend.table_interface import (
+    OpenLots,
+    RealizedGains,
+    TradeReport,
+)
+
+LONG_TERM_DAYS = 365
+
+
+def read_trades(
+    conn: sqlite3.Connection,
+    tr_table: TradeReport,
+    since: typing.Optional[str] = None,
+) -> list[tuple[str, str, str, str, float, float]]:
+    """
+    since :parameter: first trade date read, None reads every trade
+
+    Returns:
+        date ordered (Date, symbol, isin, trade_type, quantity, price)
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT Date, symbol, isin, trade_type, quantity, price "
+        f"FROM {tr_table.name} WHERE Date >= ? ORDER BY Date, rowid",
+        (since if since is not None else "",),
+    )
+    return cursor.fetchall()
+
+
+class LotBook:
+    """
+    Open lots of every ticker and the lot parts closed by the replayed
+    sells
+    """
+
+    def __init__(self, next_lot: int = 0):
+        """
+        next_lot :parameter: number of the next lot opened
+        """
+        # ticker -> [lot, buy date, isin, quantity, buy price]
+        self.lots: dict[str, collections.deque[list]] = {}
+        self.next_lot = next_lot
+        # (sell date, ticker, isin, lot, buy date, quantity, buy price,
+        # sell price)
+        self.closed: list[tuple] = []
+
+    def replay(
+        self, trades: typing.Iterable[tuple[str, str, str, str, float, float]]
+    ) -> None:
+        """
+        trades :parameter: date ordered (Date, symbol, isin, trade_type,
+        quantity, price) after the ones already replayed
+        """
+        for [date, ticker, isin, type_, quantity, price] in trades:
+            lots = self.lots.setdefault(ticker, collections.deque())
+            if type_ == "buy":
+                lots.append([self.next_lot, date, isin, quantity, price])
+                self.next_lot += 1
+                continue
+
+            while quantity > 0 and len(lots) != 0:
+                lot = lots[0]
+                used = min(quantity, lot[3])
+                self.closed.append(
+                    (date, ticker, lot[2], lot[0], lot[1], used, lot[4], price)
+                )
+                lot[3] -= used
+                quantity -= used
+                if lot[3] <= 0:
+                    lots.popleft()
+
+    def open_lots(self) -> list[tuple[str, str, str, int, float, float]]:
+        """
+        Returns:
+            (buy date, ticker, isin, lot, quantity, buy price) in lot order
+        """
+        rows = [
+            (date, ticker, isin, lot, quantity, price)
+            for [ticker, lots] in self.lots.items()
+            for [lot, date, isin, quantity, price] in lots
+        ]
+        return sorted(rows, key=lambda row: row[3])
+
+    @classmethod
+    def restore(
+        cls, conn: sqlite3.Connection, tr_table: TradeReport, since: str
+    ) -> "LotBook":
+        """
+        Open lots after replaying the trades before since, from the stored
+        open lots and realized gains
+        """
+        cursor = conn.cursor()
+        cursor.execute(
+            f"SELECT COUNT(*) FROM {tr_table.name} "
+            "WHERE trade_type = 'buy' AND Date < ?",
+            (since,),
+        )
+        book = cls(cursor.fetchone()[0])
+
+        cursor.execute(
+            "SELECT lot, Date, ticker, isin, quantity, buy_price "
+            f"FROM {OpenLots().name} WHERE Date < ?",
+            (since,),
+        )
+        parts = cursor.fetchall()
+        cursor.execute(
+            "SELECT lot, buy_date, ticker, isin, quantity, buy_price "
+            f"FROM {RealizedGains().name} WHERE Date >= ? AND buy_date < ?",
+            (since, since),
+        )
+        parts += cursor.fetchall()
+
+        merged: dict[int, list] = {}
+        for [lot, date, ticker, isin, quantity, price] in parts:
+            if lot in merged:
+                merged[lot][4] += quantity
+            else:
+                merged[lot] = [ticker, lot, date, isin, quantity, price]
+
+        for lot in sorted(merged):
+            [ticker, *row] = merged[lot]
+            book.lots.setdefault(ticker, collections.deque()).append(row)
+        return book
+
+
+def holding_days(
+    buy_dates: typing.Sequence[str], end_dates: typing.Sequence[str]
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns:
+        [days, terms] calendar days from every buy to its end and "long"
+        or "short"
+    """
+    days = (
+        np.array([date[:10] for date in end_dates], dtype="datetime64[D]")
+        - np.array([date[:10] for date in buy_dates], dtype="datetime64[D]")
+    ).astype(np.int64)
+    return (days, np.where(days > LONG_TERM_DAYS, "long", "short"))
+
+
+def realized_rows(
+    closed: list[tuple[str, str, str, int, str, float, float, float]],
+) -> list[tuple]:
+    """
+    Returns:
+        rows in RealizedGains column order
+    """
+    if len(closed) == 0:
+        return []
+
+    [sell_dates, _, _, _, buy_dates, quantity, buy_price, sell_price] = (
+        np.array(column) for column in zip(*closed)
+    )
+    gains = quantity.astype("float64") * (
+        sell_price.astype("float64") - buy_price.astype("float64")
+    )
+    [days, terms] = holding_days(buy_dates, sell_dates)
+    return [
+        (*part, float(gain), int(held), str(term))
+        for [part, gain, held, term] in zip(closed, gains, days, terms)
+    ]
+
+
+def last_close(
+    isin: str, ticker: str, date: datetime.datetime
+) -> typing.Optional[tuple[str, float]]:
+    """
+    Returns:
+        [date, close] of the last close on or before date, from the FY of
+        date or the one before it
+    """
+    db_csv = get_db_csv()
+    for fy in (time.date_fy(date), time.date_fy(date) - 1):
+        arr = db_csv.read_fy(isin, fy, ticker)
+        before = np.flatnonzero(arr.dates <= np.datetime64(date, "s"))
+        if len(before) != 0:
+            pos = before[-1]
+            day = str(time.convert_datetime64_to_strf(arr.dates[pos]))
+            return (day, float(arr.column("Close")[pos]))
+    return None
+
+
+def open_lot_rows(
+    lots: list[tuple[str, str, str, int, float, float]],
+) -> list[tuple]:
+    """
+    lots :parameter: LotBook.open_lots
+
+    Returns:
+        rows in OpenLots column order, held upto the close they are valued
+        at, NULL close and pnl without one
+    """
+    if len(lots) == 0:
+        return []
+
+    cur_date = time.get_current_date()
+    closes = {
+        (isin, ticker): last_close(isin, ticker, cur_date)
+        for [_, ticker, isin, _, _, _] in lots
+    }
+    valued = [closes[(lot[2], lot[1])] for lot in lots]
+    close_dates = [
+        close[0] if close is not None else time.convert_date_to_strf(cur_date)
+        for close in valued
+    ]
+    close = np.array(
+        [close[1] if close is not None else np.nan for close in valued]
+    )
+    quantity = np.array([lot[4] for lot in lots], dtype="float64")
+    buy_price = np.array([lot[5] for lot in lots], dtype="float64")
+    pnl = quantity * (close - buy_price)
+    [days, terms] = holding_days([lot[0] for lot in lots], close_dates)
+
+    return [
+        (
+            *lot,
+            date,
+            None if np.isnan(price) else float(price),
+            None if np.isnan(gain) else float(gain),
+            int(held),
+            str(term),
+        )
+        for [lot, date, price, gain, held, term] in zip(
+            lots, close_dates, close, pnl, days, terms
+        )
+    ]
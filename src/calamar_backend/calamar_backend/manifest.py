@@ -0,0 +1,189 @@
+"""
+Build manifest
+    - Stage: a build step, its inputs, upstream stages and output tables
+    - BuildManifest: stored in the database, records per stage
+        - content hashes of every input file
+        - versions of every input table
+        - the price store version used
+        - the stage fingerprint (inputs + upstream fingerprints)
+
+    A stage whose fingerprint did not change and whose outputs exist is
+    skipped, a changed input reruns the stage and, through the upstream
+    fingerprints, every stage downstream of it
+
+    Input kinds:
+    - file:{path}    sha256 of the file content
+    - table:{name}   (count, max Date, max rowid) of a table
+    - prices:        price store version, file names, sizes and mtimes of
+                     the csv database directory
+    - day:           the current date, reruns a stage once a day (e.g.
+                     downloads)
+"""
+import datetime
+import hashlib
+import json
+import os
+import sqlite3
+import typing
+
+import calamar_backend.time as time
+from calamar_backend.table_interface import WriteVersions, table_exists
+
+
+class Stage:
+    def __init__(
+        self,
+        name: str,
+        inputs: list[str],
+        upstream: list[str],
+        outputs: list[str],
+        fn: typing.Callable[[], None],
+    ):
+        self.name = name
+        self.inputs = inputs
+        self.upstream = upstream
+        self.outputs = outputs
+        self.fn = fn
+
+    def __str__(self) -> str:
+        return f"(stage:{self.name} upstream:{self.upstream})"
+
+
+def file_digest(path: typing.Optional[str]) -> str:
+    if path is None or not os.path.isfile(path):
+        return "missing"
+
+    sha = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def price_store_version(csv_dir: typing.Optional[str]) -> str:
+    """
+    Price files are only ever added or re-downloaded, so names, sizes and
+    mtimes identify a version without reading every file
+    """
+    if csv_dir is None or not os.path.isdir(csv_dir):
+        return "missing"
+
+    sha = hashlib.sha256()
+    with os.scandir(csv_dir) as entries:
+        for entry in sorted(entries, key=lambda entry: entry.name):
+            if entry.is_file():
+                stat = entry.stat()
+                sha.update(
+                    f"{entry.name}:{stat.st_size}:{stat.st_mtime_ns};".encode()
+                )
+    return sha.hexdigest()
+
+
+class BuildManifest:
+    _table = "build_manifest"
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self.current: dict[str, str] = {}
+        self.__digests: dict[str, str] = {}
+
+        cursor = conn.cursor()
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {self._table} "
+            '("stage" TEXT PRIMARY KEY, "fingerprint" TEXT, "inputs" TEXT, '
+            '"price_version" TEXT, "built_at" TEXT)'
+        )
+        conn.commit()
+
+    def input_digest(self, source: str) -> str:
+        if source not in self.__digests:
+            [kind, value] = source.split(":", 1)
+            match kind:
+                case "file":
+                    digest = file_digest(value)
+                case "table":
+                    digest = self.__table_version(value)
+                case "prices":
+                    digest = price_store_version(os.getenv("CALAMAR_CSV_DB"))
+                case "day":
+                    digest = time.convert_date_to_strf(time.get_current_date())
+                case _:
+                    raise Exception(
+                        f"{str(datetime.datetime.now())}: "
+                        f"manifest: unknown input {source}"
+                    )
+            self.__digests[source] = digest
+
+        return self.__digests[source]
+
+    def __table_version(self, table: str) -> str:
+        if not table_exists(self.conn, table):
+            return "missing"
+
+        cursor = self.conn.cursor()
+        cursor.execute(f"SELECT COUNT(*), MAX(Date), MAX(rowid) FROM {table}")
+        return str(cursor.fetchone())
+
+    def fingerprint(self, stage: Stage) -> tuple[str, dict[str, str]]:
+        """
+        Returns:
+            [fingerprint, input digests]
+        """
+        inputs = {source: self.input_digest(source) for source in stage.inputs}
+        upstream = {
+            name: self.current.get(name, "") for name in stage.upstream
+        }
+        fingerprint = hashlib.sha256(
+            json.dumps([inputs, upstream], sort_keys=True).encode()
+        ).hexdigest()
+        return (fingerprint, inputs)
+
+    def get(self, stage: str) -> typing.Optional[str]:
+        cursor = self.conn.cursor()
+        cursor.execute(
+            f"SELECT fingerprint FROM {self._table} WHERE stage = ?",
+            (stage,),
+        )
+        rows = cursor.fetchall()
+        return rows[0][0] if len(rows) != 0 else None
+
+    def is_current(self, stage: Stage) -> bool:
+        """
+        Fingerprint unchanged and every output table present
+        Also registers the fingerprint for downstream stages
+        """
+        [fingerprint, _] = self.fingerprint(stage)
+        self.current[stage.name] = fingerprint
+        return self.get(stage.name) == fingerprint and all(
+            table_exists(self.conn, table) for table in stage.outputs
+        )
+
+    def record(self, stage: Stage) -> None:
+        """
+        Record a stage after it ran, inputs are re-read since the stage may
+        have changed them (e.g. downloaded prices)
+        """
+        self.__digests = {
+            k: v
+            for k, v in self.__digests.items()
+            if not k.startswith("table:") and not k.startswith("prices:")
+        }
+        [fingerprint, inputs] = self.fingerprint(stage)
+        self.current[stage.name] = fingerprint
+
+        cursor = self.conn.cursor()
+        cursor.execute(
+            f"INSERT OR REPLACE INTO {self._table} "
+            "(stage, fingerprint, inputs, price_version, built_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (
+                stage.name,
+                fingerprint,
+                json.dumps(inputs, sort_keys=True),
+                inputs.get("prices:", ""),
+                str(datetime.datetime.now()),
+            ),
+        )
+        # outputs written outside Table.insert_tuples (e.g. to_sql)
+        WriteVersions().bump(self.conn, stage.outputs)
+        self.conn.commit()
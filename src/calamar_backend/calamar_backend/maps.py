@@ -2,6 +2,7 @@
 import yaml
 import datetime
 import os
+import typing
 
 import calamar_backend.errors as er
 
@@ -11,8 +12,13 @@ class TickerMap:
     Converts zerodha tickers to yahoo tickers
     """
 
-    def __init__(self):
-        self.map_yaml = os.getenv("TICKER_MAP")
+    def __init__(self, map_yaml: typing.Optional[str] = None):
+        """
+        map_yaml :parameter: ticker map yaml file, defaults to $TICKER_MAP
+        """
+        if map_yaml is None:
+            map_yaml = os.getenv("TICKER_MAP")
+        self.map_yaml = map_yaml
 
         if self.map_yaml is not None:
             with open(self.map_yaml, "r") as file:
@@ -35,4 +41,30 @@ class TickerMap:
         return yticker
 
 
-calamar_ticker_map = TickerMap()
+_ticker_map: typing.Optional[TickerMap] = None
+
+
+def get_ticker_map() -> TickerMap:
+    """
+    Shared ticker map, read from $TICKER_MAP on first use unless one was
+    set with set_ticker_map
+    """
+    global _ticker_map
+    if _ticker_map is None:
+        _ticker_map = TickerMap()
+    return _ticker_map
+
+
+def set_ticker_map(ticker_map: typing.Optional[TickerMap]) -> None:
+    """
+    Replace the shared ticker map, None rebuilds it on next use
+    """
+    global _ticker_map
+    _ticker_map = ticker_map
+
+
+def __getattr__(name: str) -> typing.Any:
+    # calamar_ticker_map is built on first access instead of on import
+    if name == "calamar_ticker_map":
+        return get_ticker_map()
+    raise AttributeError(f"module {__name__} has no attribute {name}")
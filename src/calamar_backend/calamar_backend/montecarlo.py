@@ -0,0 +1,254 @@
+"""
+Monte Carlo projection
+    - forward nav distribution of the holdings of the latest portfolio
+      report snapshot, held without trading
+    - joint daily returns of the holdings over the lookback from the csv
+      price store (the prices table only covers holding intervals), only
+      days where every holding has a return, so that their co-movement is
+      kept; fewer than MIN_JOINT_DAYS of them is refused
+    - a latest holding without a close fails the projection, same as the
+      positions table
+    - paths resample blocks of consecutive joint days (block bootstrap)
+    - paths are simulated in fixed size chunks on a process pool, every
+      chunk has its own child of one SeedSequence: a seed gives the same
+      result whatever the number of processes
+    - percentile bands of the nav on every horizon day, value at risk and
+      conditional value at risk (expected shortfall) at chosen horizons
+"""
+import concurrent.futures
+import datetime
+import sqlite3
+import typing
+import numpy as np
+
+import calamar_backend.time as time
+from calamar_backend.database_csv import get_db_csv
+from calamar_backend.table_interface import Portfolio, Prices
+
+PERCENTILES = (5, 25, 50, 75, 95)
+# least joint days sampled from, about a year of sessions
+MIN_JOINT_DAYS = 252
+
+# set in every worker by _init_worker
+_returns: typing.Optional[np.ndarray] = None
+_values: typing.Optional[np.ndarray] = None
+
+
+def latest_holdings(
+    conn: sqlite3.Connection,
+) -> tuple[str, list[str], list[str], np.ndarray]:
+    """
+    Returns:
+        [date, tickers, isins, values]
+        latest snapshot date, its securities and their values at the close
+    """
+    pft_table = Portfolio()
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT MAX(Date) FROM {pft_table.name}")
+    date = cursor.fetchone()[0]
+    if date is None:
+        raise Exception(
+            f"{str(datetime.datetime.now())}: "
+            "montecarlo: portfolio report is empty"
+        )
+
+    cursor.execute(
+        Prices().holdings_select_query(pft_table.name, "WHERE p.Date = ?"),
+        (date,),
+    )
+    rows = cursor.fetchall()
+    missing = [row[1] for row in rows if row[-1] is None]
+    if len(missing) != 0:
+        raise Exception(
+            f"{str(datetime.datetime.now())}: "
+            f"montecarlo:latest_holdings: no price on {date} for {missing}"
+        )
+    tickers = [row[1] for row in rows]
+    isins = [row[2] for row in rows]
+    values = np.array([row[3] * row[4] for row in rows], dtype="float64")
+    return (date, tickers, isins, values)
+
+
+def joint_returns(
+    days: np.ndarray, closes: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    closes :parameter: (days x securities) closes, NaN where a security
+    has no close
+
+    Returns:
+        [from_days, returns]
+        the day every return starts from and the daily returns of the days
+        where every security has a close on the day and the day before
+    """
+    returns = closes[1:] / closes[:-1] - 1
+    joint = ~np.isnan(returns).any(axis=1)
+    return (days[:-1][joint], returns[joint])
+
+
+def lookback_returns(
+    tickers: list[str],
+    isins: list[str],
+    date: str,
+    lookback: int = 1095,
+    min_days: int = MIN_JOINT_DAYS,
+) -> np.ndarray:
+    """
+    lookback :parameter: calendar days before date to sample from
+    min_days :parameter: least joint days accepted
+
+    Returns:
+        (days x isins) joint daily returns of the lookback, read from the
+        csv price store
+    """
+    end = time.convert_date_strf_to_strp(date)
+    start = end - datetime.timedelta(days=lookback)
+    [days, closes] = get_db_csv().read_closes(
+        [(isin, ticker, start) for [isin, ticker] in zip(isins, tickers)],
+        start,
+        end,
+    )
+    returns = joint_returns(days, closes)[1]
+    if len(returns) < min_days:
+        raise Exception(
+            f"{str(datetime.datetime.now())}: "
+            f"montecarlo:lookback_returns: {len(returns)} joint days in the "
+            f"lookback, at least {min_days} needed"
+        )
+    return returns
+
+
+def _init_worker(returns: np.ndarray, values: np.ndarray) -> None:
+    """
+    Keep the sampled returns in the worker instead of sending them with
+    every chunk
+    """
+    global _returns, _values
+    _returns = returns
+    _values = values
+
+
+def _simulate_chunk(
+    seed: np.random.SeedSequence, paths: int, horizon: int, block: int
+) -> np.ndarray:
+    """
+    Worker: simulate nav paths of the held values
+
+    Returns:
+        (paths x horizon) float32 navs, day 1 to horizon
+    """
+    if _returns is None or _values is None:
+        raise Exception(
+            f"{str(datetime.datetime.now())}: "
+            "montecarlo: worker not initialised"
+        )
+
+    return simulate_paths(
+        _returns, _values, np.random.default_rng(seed), paths, horizon, block
+    )
+
+
+def simulate_paths(
+    returns: np.ndarray,
+    values: np.ndarray,
+    rng: np.random.Generator,
+    paths: int,
+    horizon: int,
+    block: int = 1,
+) -> np.ndarray:
+    """
+    returns :parameter: (days x securities) joint daily returns
+    values :parameter: (securities,) values held on day 0
+    block :parameter: length of the resampled blocks of consecutive days
+
+    Returns:
+        (paths x horizon) float32 navs, day 1 to horizon
+    """
+    block = max(1, min(block, len(returns)))
+    blocks = -(-horizon // block)
+    starts = rng.integers(0, len(returns) - block + 1, (paths, blocks))
+    days = (starts[:, :, None] + np.arange(block)).reshape(paths, -1)
+    days = days[:, :horizon]
+
+    # growth of every security along the path, valued at day 0 holdings
+    growth = np.exp(np.cumsum(np.log1p(returns)[days], axis=1))
+    return (growth @ values).astype("float32")
+
+
+def simulate(
+    returns: np.ndarray,
+    values: np.ndarray,
+    paths: int = 10000,
+    horizon: int = 252,
+    block: int = 5,
+    seed: int = 0,
+    chunk: int = 1000,
+    processes: int = 4,
+) -> np.ndarray:
+    """
+    Simulate paths in chunks of chunk paths on a process pool
+
+    Returns:
+        (paths x horizon) float32 navs
+    """
+    if len(returns) == 0:
+        raise Exception(
+            f"{str(datetime.datetime.now())}: "
+            "montecarlo: no day with a return for every holding"
+        )
+
+    sizes = [min(chunk, paths - start) for start in range(0, paths, chunk)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    with concurrent.futures.ProcessPoolExecutor(
+        processes, initializer=_init_worker, initargs=(returns, values)
+    ) as pool:
+        chunks = pool.map(
+            _simulate_chunk,
+            seeds,
+            sizes,
+            [horizon] * len(sizes),
+            [block] * len(sizes),
+        )
+        return np.concatenate(list(chunks))
+
+
+def percentile_bands(
+    date: str, navs: np.ndarray
+) -> list[tuple[str, int, float, float, float, float, float]]:
+    """
+    Returns:
+        rows in MonteCarloBands column order, one per horizon day
+    """
+    bands = np.percentile(navs, PERCENTILES, axis=0)
+    return [
+        (date, day + 1, *(float(value) for value in bands[:, day]))
+        for day in range(navs.shape[1])
+    ]
+
+
+def value_at_risk(
+    date: str,
+    nav: float,
+    navs: np.ndarray,
+    horizons: typing.Sequence[int] = (1, 5, 21, 63, 252),
+    confidences: typing.Sequence[float] = (0.95, 0.99),
+) -> list[tuple[str, int, float, float, float]]:
+    """
+    nav :parameter: nav on day 0
+
+    Returns:
+        rows in MonteCarloRisk column order, var and cvar as positive
+        losses
+    """
+    rows = []
+    for horizon in horizons:
+        if horizon > navs.shape[1]:
+            continue
+
+        losses = nav - navs[:, horizon - 1].astype("float64")
+        for confidence in confidences:
+            var = float(np.quantile(losses, confidence))
+            cvar = float(losses[losses >= var].mean())
+            rows.append((date, horizon, confidence, var, cvar))
+    return rows
@@ -0,0 +1,361 @@
+"""
+Portfolio weight optimization
+    - long only min variance and max sharpe weights of the latest
+      portfolio report holdings
+    - joint daily returns of the holdings over the whole window from the
+      csv price store, whatever the holding dates (a new purchase does not
+      shorten the window), only days where every holding has a return;
+      fewer than MIN_JOINT_DAYS of them is refused
+    - the window's mean and covariance are kept as running sums (count,
+      sum and cross product of the returns), persisted per holdings set
+      in moment_state with the window's returns in return_window: a
+      refresh (in any process) only reads the days after the stored ones
+      and evicts the days that left the window, the holdings changing or
+      the stored last close changing rebuilds
+    - both problems are solved with accelerated projected gradient in
+      numpy:
+        - min variance: 1/2 w'Cw on the simplex
+        - max sharpe: 1/2 y'Cy on {y >= 0, (mean - rf)'y = 1}, weights are
+          y / sum(y)
+"""
+import datetime
+import json
+import sqlite3
+import typing
+import numpy as np
+
+import calamar_backend.time as time
+from calamar_backend.database_csv import get_db_csv
+from calamar_backend.montecarlo import (
+    MIN_JOINT_DAYS,
+    joint_returns,
+    latest_holdings,
+)
+from calamar_backend.table_interface import MomentState, ReturnWindow
+
+TRADING_DAYS = 252
+
+
+class ReturnMoments:
+    """
+    Running count, sum and cross product of a window of joint daily
+    returns, rows are added at the end and removed from the start
+    """
+
+    def __init__(self, securities: int):
+        self.count = 0
+        self.sums = np.zeros(securities)
+        self.cross = np.zeros((securities, securities))
+
+    def add(self, returns: np.ndarray) -> None:
+        self.count += len(returns)
+        self.sums += returns.sum(axis=0)
+        self.cross += returns.T @ returns
+
+    def remove(self, returns: np.ndarray) -> None:
+        """
+        Drop returns that were added before
+        """
+        self.count -= len(returns)
+        self.sums -= returns.sum(axis=0)
+        self.cross -= returns.T @ returns
+
+    def mean(self) -> np.ndarray:
+        """
+        Annualised mean daily return
+        """
+        return self.sums / self.count * TRADING_DAYS
+
+    def covariance(self) -> np.ndarray:
+        """
+        Annualised sample covariance of the daily returns
+        """
+        n = self.count
+        cov = (self.cross - np.outer(self.sums, self.sums) / n) / (n - 1)
+        return cov * TRADING_DAYS
+
+
+def project_simplex(v: np.ndarray) -> np.ndarray:
+    """
+    Euclidean projection of v on {w >= 0, sum(w) = 1}
+    """
+    u = np.sort(v)[::-1]
+    cum = np.cumsum(u) - 1
+    k = np.flatnonzero(u - cum / np.arange(1, len(v) + 1) > 0)[-1]
+    return np.maximum(v - cum[k] / (k + 1), 0)
+
+
+def project_budget(v: np.ndarray, a: np.ndarray) -> np.ndarray:
+    """
+    Euclidean projection of v on {y >= 0, a'y = 1}, a must have a positive
+    entry
+
+    The projection is max(v - tau * a, 0), where a'max(v - tau * a, 0) is
+    piecewise linear and non increasing in tau: it is evaluated on every
+    breakpoint v / a at once and solved on the segment crossing 1
+    """
+    nz = a != 0
+    taus = np.sort(v[nz] / a[nz])
+    g = (a * np.maximum(v - taus[:, None] * a, 0)).sum(axis=1)
+
+    k = int(np.searchsorted(-g, -1.0))
+    if k == 0:
+        mid = taus[0] - 1
+    elif k == len(taus):
+        mid = taus[-1] + 1
+    else:
+        mid = (taus[k - 1] + taus[k]) / 2
+
+    active = v - mid * a > 0
+    tau = (a[active] @ v[active] - 1) / (a[active] @ a[active])
+    return np.maximum(v - tau * a, 0)
+
+
+def minimize_quadratic(
+    cov: np.ndarray,
+    project: typing.Callable[[np.ndarray], np.ndarray],
+    tol: float = 1e-12,
+    max_iter: int = 10000,
+) -> np.ndarray:
+    """
+    Accelerated projected gradient (FISTA) on 1/2 x'Cx over a convex set
+
+    project :parameter: euclidean projection on the set
+    """
+    largest = np.linalg.eigvalsh(cov)[-1]
+    step = 1 / largest if largest > 0 else 1.0
+
+    x = project(np.ones(len(cov)) / len(cov))
+    y = x
+    t = 1.0
+    for _ in range(max_iter):
+        x_next = project(y - step * (cov @ y))
+        if np.abs(x_next - x).max() <= tol * max(1.0, np.abs(x).max()):
+            return x_next
+
+        t_next = (1 + np.sqrt(1 + 4 * t * t)) / 2
+        y = x_next + (t - 1) / t_next * (x_next - x)
+        [x, t] = [x_next, t_next]
+
+    return x
+
+
+def min_variance(cov: np.ndarray) -> np.ndarray:
+    """
+    Returns:
+        long only weights of the least variance
+    """
+    return minimize_quadratic(cov, project_simplex)
+
+
+def max_sharpe(
+    mean: np.ndarray, cov: np.ndarray, rf: float = 0.0
+) -> typing.Optional[np.ndarray]:
+    """
+    rf :parameter: annualised risk free rate
+
+    Returns:
+        long only weights of the highest sharpe ratio, None when no
+        security returns more than rf
+    """
+    excess = mean - rf
+    if not (excess > 0).any():
+        return None
+
+    y = minimize_quadratic(cov, lambda v: project_budget(v, excess))
+    return y / y.sum()
+
+
+class PortfolioOptimizer:
+    """
+    Optimal weights of the latest holdings, the return moments of the
+    window are persisted between refreshes (see MomentState)
+    """
+
+    def __init__(
+        self,
+        conn: sqlite3.Connection,
+        lookback: int = 1095,
+        min_days: int = MIN_JOINT_DAYS,
+    ):
+        """
+        lookback :parameter: calendar days of returns in the window
+        min_days :parameter: least joint days the weights are computed from
+        """
+        self.conn = conn
+        self.lookback = datetime.timedelta(days=lookback)
+        self.min_days = max(min_days, 2)
+        self.window_table = ReturnWindow()
+        self.state_table = MomentState()
+
+        self.date = ""
+        self.tickers: list[str] = []
+        self.isins: list[str] = []
+        self.values = np.zeros(0)
+        self.moments: typing.Optional[ReturnMoments] = None
+
+    def __securities(
+        self, first: datetime.datetime
+    ) -> list[tuple[str, str, datetime.datetime]]:
+        """
+        first :parameter: first day to read of every holding
+        """
+        return [
+            (isin, ticker, first)
+            for [isin, ticker] in zip(self.isins, self.tickers)
+        ]
+
+    def __add(
+        self, holdings: str, days: np.ndarray, closes: np.ndarray
+    ) -> None:
+        """
+        Add the joint returns of the read closes to the moments and the
+        window rows, committed by __save
+        """
+        assert self.moments is not None
+        [from_days, returns] = joint_returns(days, closes)
+        if len(from_days) == 0:
+            return
+
+        self.moments.add(returns)
+        self.window_table.insert_tuples(
+            self.conn,
+            self.window_table.columns,
+            [
+                (str(day), holdings, json.dumps(row.tolist()))
+                for [day, row] in zip(
+                    time.convert_datetime64_to_strf(from_days), returns
+                )
+            ],
+            commit=False,
+        )
+
+    def __save(
+        self, holdings: str, days: np.ndarray, closes: np.ndarray
+    ) -> None:
+        """
+        Store the moments upto the last read day and commit the window
+        """
+        assert self.moments is not None
+        self.conn.cursor().execute(
+            f"INSERT OR REPLACE INTO {self.state_table.name} "
+            f"({', '.join(self.state_table.columns)}) VALUES "
+            f"({', '.join('?' * len(self.state_table.columns))})",
+            (
+                str(time.convert_datetime64_to_strf(days[-1])),
+                holdings,
+                self.moments.count,
+                json.dumps(self.moments.sums.tolist()),
+                json.dumps(self.moments.cross.tolist()),
+                json.dumps(closes[-1].tolist()),
+            ),
+        )
+        self.conn.commit()
+
+    def __rebuild(
+        self, holdings: str, start: datetime.datetime, end: datetime.datetime
+    ) -> None:
+        [days, closes] = get_db_csv().read_closes(
+            self.__securities(start), start, end
+        )
+        self.moments = ReturnMoments(len(self.isins))
+        self.state_table.delete_all(self.conn, self.window_table)
+        if len(days) == 0:
+            self.conn.commit()
+            return
+
+        self.__add(holdings, days, closes)
+        self.__save(holdings, days, closes)
+
+    def refresh(self) -> bool:
+        """
+        Bring the window upto the current date
+
+        Returns:
+            whether the window was rebuilt instead of updated
+        """
+        [date, tickers, isins, values] = latest_holdings(self.conn)
+        [self.date, self.tickers, self.isins] = [date, tickers, isins]
+        self.values = values
+        holdings = ",".join(isins)
+        self.window_table.ensure_table(self.conn)
+        self.state_table.ensure_table(self.conn)
+
+        end = time.get_current_date()
+        start = end - self.lookback
+        state = self.state_table.get_holdings(self.conn, holdings)
+        if state is None or state.count != self.window_table.count(
+            self.conn, holdings
+        ):
+            self.__rebuild(holdings, start, end)
+            return True
+
+        # the stored last day is read again, its returns start from it
+        [days, closes] = get_db_csv().read_closes(
+            self.__securities(state.date), state.date, end
+        )
+        if (
+            len(days) == 0
+            or days[0] != np.datetime64(state.date, "s")
+            or not np.array_equal(
+                closes[0], np.array(state.last_closes), equal_nan=True
+            )
+        ):
+            self.__rebuild(holdings, start, end)
+            return True
+
+        self.moments = ReturnMoments(len(isins))
+        self.moments.count = state.count
+        self.moments.sums = np.array(state.sums)
+        self.moments.cross = np.array(state.cross)
+        self.__add(holdings, days, closes)
+
+        start_str = time.convert_date_to_strf(start)
+        evicted = self.window_table.get_before(self.conn, holdings, start_str)
+        self.moments.remove(
+            np.array([row.returns for row in evicted]).reshape(-1, len(isins))
+        )
+        self.window_table.delete_before(self.conn, holdings, start_str)
+        self.__save(holdings, days, closes)
+        return False
+
+    def weights(
+        self, rf: float = 0.0
+    ) -> tuple[np.ndarray, np.ndarray, typing.Optional[np.ndarray]]:
+        """
+        Returns:
+            [current, min variance, max sharpe] weights of the holdings
+        """
+        count = 0 if self.moments is None else self.moments.count
+        if count < self.min_days:
+            raise Exception(
+                f"{str(datetime.datetime.now())}: "
+                f"optimizer: {count} joint days in the window, at least "
+                f"{self.min_days} needed"
+            )
+
+        cov = self.moments.covariance()
+        return (
+            self.values / self.values.sum(),
+            min_variance(cov),
+            max_sharpe(self.moments.mean(), cov, rf),
+        )
+
+    def weight_rows(self, rf: float = 0.0) -> list[tuple]:
+        """
+        Returns:
+            rows in OptimalWeights column order, NULL max sharpe weights
+            when no holding returns more than rf
+        """
+        [current, min_var, sharpe] = self.weights(rf)
+        return [
+            (
+                self.date,
+                ticker,
+                isin,
+                float(current[i]),
+                float(min_var[i]),
+                None if sharpe is None else float(sharpe[i]),
+            )
+            for [i, [ticker, isin]] in enumerate(zip(self.tickers, self.isins))
+        ]
@@ -0,0 +1,279 @@
+"""
+Build pipeline
+    - runs the build stages of database.py as a DAG:
+      ingest (index prices, trade report, bank statement) -> price
+      coverage -> holdings -> navs -> rollups
+    - the price coverage stage fails the run before any holdings or nav
+      stage on price gaps or unresolvable securities (see coverage.py)
+    - independent stages run concurrently, every stage on its own
+      database connection
+    - stage selection with --only and --from (a stage and everything
+      downstream of it)
+    - --incremental skips stages whose inputs did not change since the
+      last build (see manifest.py)
+    - prints a per stage timing summary
+
+    run using -> python calamar_backend.py --tickers nifty50 niftynext50
+"""
+import argparse
+import concurrent.futures
+import datetime
+import os
+import timeit
+import typing
+
+from calamar_backend.config import AccountConfig
+from calamar_backend.manifest import BuildManifest, Stage
+
+if typing.TYPE_CHECKING:
+    from calamar_backend.database import Database
+
+
+class StageResult:
+    """
+    Outcome of one stage: ran, skipped (unchanged), blocked (an upstream
+    stage failed) or failed
+    """
+
+    def __init__(
+        self,
+        name: str,
+        status: str,
+        elapsed: float = 0.0,
+        error: typing.Optional[str] = None,
+    ):
+        self.name = name
+        self.status = status
+        self.elapsed = elapsed
+        self.error = error
+
+    def __str__(self) -> str:
+        error = f" - {self.error}" if self.error is not None else ""
+        return f"{self.name:<16} {self.status:<8} {self.elapsed:8.2f}s{error}"
+
+
+class Pipeline:
+    """
+    Schedules the stages of one account database
+    """
+
+    def __init__(
+        self,
+        config: AccountConfig,
+        tickers: list[str],
+        start: str = "",
+        price_db: typing.Optional[str] = None,
+    ):
+        """
+        tickers :parameter: benchmark tickers (the first one marks sessions)
+        start :parameter: index price download start (YYYY-MM-DD), defaults
+        to the first date in the trade report and bank statement files
+        price_db :parameter: database to copy the index price tables from
+        instead of downloading them
+        """
+        self.config = config
+        self.tickers = tickers
+        self.start = start
+        self.price_db = price_db
+
+    def database(self) -> "Database":
+        """
+        A new connection to the account database, stages running on
+        different threads do not share connections
+        """
+        # imported here so that only running a build loads the stages
+        import calamar_backend.database as db
+
+        db_ = db.Database(self.config)
+        # concurrent stages wait for each other's writes
+        db_.conn.execute("PRAGMA busy_timeout = 60000")
+        return db_
+
+    def stages(self, db_: "Database") -> list[Stage]:
+        """
+        Database stages, the same ones (and fingerprints) as
+        Database.build
+        """
+        return db_.stages(self.tickers, self.start, self.price_db)
+
+    def select(
+        self,
+        stages: list[Stage],
+        only: typing.Optional[list[str]] = None,
+        from_: typing.Optional[str] = None,
+    ) -> set[str]:
+        """
+        only :parameter: run just these stages
+        from_ :parameter: run this stage and every stage downstream of it
+
+        Returns:
+            names of the selected stages, every stage when neither is set
+        """
+        names = [stage.name for stage in stages]
+        for name in (only or []) + ([from_] if from_ is not None else []):
+            if name not in names:
+                raise Exception(
+                    f"{str(datetime.datetime.now())}: "
+                    f"pipeline: unknown stage {name}, stages: {names}"
+                )
+
+        selected = set(names)
+        if only is not None:
+            selected = set(only)
+
+        if from_ is not None:
+            # stages are in dependency order
+            downstream = {from_}
+            for stage in stages:
+                if any(name in downstream for name in stage.upstream):
+                    downstream.add(stage.name)
+            selected = selected.intersection(downstream)
+
+        return selected
+
+    def run_stage(self, name: str) -> float:
+        """
+        Worker: run one stage on its own connection
+
+        Returns:
+            elapsed seconds
+        """
+        db_ = self.database()
+        try:
+            stage = {stage.name: stage for stage in self.stages(db_)}[name]
+            start_time = timeit.default_timer()
+            stage.fn()
+            return timeit.default_timer() - start_time
+        finally:
+            db_.conn.close()
+
+    def run(
+        self,
+        only: typing.Optional[list[str]] = None,
+        from_: typing.Optional[str] = None,
+        incremental: bool = False,
+        jobs: int = 4,
+    ) -> list[StageResult]:
+        """
+        Run the selected stages, a stage starts once all of its upstream
+        stages finished
+        Unselected stages count as finished
+
+        Returns:
+            list[StageResult] in stage order
+        """
+        db_ = self.database()
+        stages = self.stages(db_)
+        by_name = {stage.name: stage for stage in stages}
+        selected = self.select(stages, only, from_)
+        manifest = BuildManifest(db_.conn)
+
+        results: dict[str, StageResult] = {}
+        pending = [stage.name for stage in stages]
+        running: dict[concurrent.futures.Future, str] = {}
+
+        def is_ready(name: str) -> bool:
+            return all(up in results for up in by_name[name].upstream)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+            while len(pending) != 0 or len(running) != 0:
+                for name in [name for name in pending if is_ready(name)]:
+                    pending.remove(name)
+                    stage = by_name[name]
+                    failed = [
+                        up
+                        for up in stage.upstream
+                        if results[up].status in ("failed", "blocked")
+                    ]
+
+                    if len(failed) != 0:
+                        results[name] = StageResult(
+                            name, "blocked", error=f"upstream {failed}"
+                        )
+                    elif name not in selected:
+                        # registers the fingerprint for downstream stages
+                        manifest.is_current(stage)
+                        results[name] = StageResult(name, "unselected")
+                    elif incremental and manifest.is_current(stage):
+                        results[name] = StageResult(name, "skipped")
+                    else:
+                        running[pool.submit(self.run_stage, name)] = name
+
+                if len(running) == 0:
+                    continue
+
+                [done, _] = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        elapsed = future.result()
+                    except Exception as e:
+                        results[name] = StageResult(
+                            name, "failed", error=str(e)
+                        )
+                        continue
+
+                    manifest.record(by_name[name])
+                    results[name] = StageResult(name, "ran", elapsed)
+
+        db_.conn.close()
+        return [results[stage.name] for stage in stages]
+
+
+def print_summary(results: list[StageResult], elapsed: float) -> None:
+    print(f"\n==== build summary {str(datetime.datetime.now())} ====")
+    for result in results:
+        if result.status != "unselected":
+            print(str(result))
+
+    ran = [result for result in results if result.status == "ran"]
+    failed = [result for result in results if result.status == "failed"]
+    print(
+        f"stages ran: {len(ran)} failed: {len(failed)} "
+        f"wall time: {elapsed:.2f}s "
+        f"summed time: {sum(result.elapsed for result in ran):.2f}s"
+    )
+
+
+def main() -> int:
+    """
+    Returns:
+        exit status, 1 when a stage failed
+    """
+    parser = argparse.ArgumentParser(description="build calamar database")
+    parser.add_argument("--tickers", nargs="+", default=["nifty50"])
+    parser.add_argument(
+        "--only", nargs="+", default=None, help="run only these stages"
+    )
+    parser.add_argument(
+        "--from",
+        dest="from_",
+        default=None,
+        help="run this stage and every stage downstream of it",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="skip stages whose inputs did not change",
+    )
+    parser.add_argument("--start", default="")
+    parser.add_argument("--price-db", default=None)
+    parser.add_argument("--jobs", type=int, default=4)
+    parser.add_argument("--db", default=os.getenv("CALAMAR_DB"))
+    args = parser.parse_args()
+
+    config = AccountConfig.from_env()
+    config.db = args.db
+
+    pipeline = Pipeline(config, args.tickers, args.start, args.price_db)
+    start_time = timeit.default_timer()
+    results = pipeline.run(args.only, args.from_, args.incremental, args.jobs)
+    print_summary(results, timeit.default_timer() - start_time)
+
+    return int(any(result.status == "failed" for result in results))
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,233 @@
+"""
+Positions
+    - value, weight and daily pnl contribution of every holding, computed
+      from the portfolio report and its closes
+    - PositionMatrix: the portfolio_positions table as numpy columns in
+      coordinate form (day index, security index, values), for drilldowns
+      such as the top contributors between two dates
+
+    pnl of a security on a snapshot is the price move on the quantity held
+    at the previous snapshot:
+        quantity[t - 1] * (close[t] - close[t - 1])
+    a security sold out before snapshot t has a zero quantity row on t
+    (see exit_rows), which carries its last move; summed over securities
+    the pnl is the nav change less the trades valued at the closes
+"""
+import sqlite3
+import typing
+import numpy as np
+
+from calamar_backend.table_interface import Positions
+
+
+def exit_rows(
+    rows: typing.Sequence[tuple[str, str, str, float, float]],
+) -> list[tuple[str, str, str]]:
+    """
+    rows :parameter: date ordered (Date, ticker, isin, quantity, close)
+
+    Returns:
+        (Date, ticker, isin) of every security held on a snapshot and not
+        on the next one, dated on the next snapshot
+    """
+    by_day: dict[str, dict[str, str]] = {}
+    for [date, ticker, isin, _, _] in rows:
+        by_day.setdefault(date, {})[isin] = ticker
+
+    days = list(by_day)
+    return [
+        (day, ticker, isin)
+        for [prev, day] in zip(days[:-1], days[1:])
+        for [isin, ticker] in by_day[prev].items()
+        if isin not in by_day[day]
+    ]
+
+
+def compute_positions(
+    rows: typing.Sequence[tuple[str, str, str, float, float]],
+) -> list[tuple[str, str, str, float, float, float, float, float]]:
+    """
+    rows :parameter: date ordered (Date, ticker, isin, quantity, close),
+    with the zero quantity rows of the exits
+
+    Returns:
+        rows in Positions column order
+    """
+    if len(rows) == 0:
+        return []
+
+    [dates, tickers, isins, quantities, closes] = zip(*rows)
+    [_, day_idx] = np.unique(np.array(dates), return_inverse=True)
+    [_, sec_idx] = np.unique(np.array(isins), return_inverse=True)
+    quantity = np.array(quantities, dtype="float64")
+    close = np.array(closes, dtype="float64")
+
+    value = quantity * close
+    nav = np.bincount(day_idx, weights=value)[day_idx]
+    weight = np.divide(value, nav, out=np.zeros_like(value), where=nav != 0)
+
+    # previous snapshot of the same security, by security then day
+    order = np.lexsort((day_idx, sec_idx))
+    [o_sec, o_day] = [sec_idx[order], day_idx[order]]
+    held = (o_sec[1:] == o_sec[:-1]) & (o_day[1:] == o_day[:-1] + 1)
+    move = quantity[order][:-1] * (close[order][1:] - close[order][:-1])
+
+    pnl = np.zeros_like(value)
+    pnl[order[1:]] = np.where(held, move, 0.0)
+
+    return [
+        (
+            dates[i],
+            tickers[i],
+            isins[i],
+            float(quantity[i]),
+            float(close[i]),
+            float(value[i]),
+            float(weight[i]),
+            float(pnl[i]),
+        )
+        for i in range(len(rows))
+    ]
+
+
+class PositionMatrix:
+    """
+    Date x security matrix in coordinate form, entries sorted by date
+        - days: sorted Date strings
+        - isins, tickers: security axis
+        - day_idx, sec_idx: coordinates of every entry
+        - quantity, value, weight, pnl: entry values
+    """
+
+    def __init__(
+        self,
+        days: np.ndarray,
+        isins: np.ndarray,
+        tickers: np.ndarray,
+        day_idx: np.ndarray,
+        sec_idx: np.ndarray,
+        values: dict[str, np.ndarray],
+    ):
+        self.days = days
+        self.isins = isins
+        self.tickers = tickers
+        self.day_idx = day_idx
+        self.sec_idx = sec_idx
+        self.quantity = values["quantity"]
+        self.value = values["value"]
+        self.weight = values["weight"]
+        self.pnl = values["pnl"]
+
+    @classmethod
+    def from_db(cls, conn: sqlite3.Connection) -> "PositionMatrix":
+        table = Positions()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT Date, ticker, isin, quantity, value, weight, pnl "
+            f"FROM {table.name} ORDER BY Date, rowid"
+        )
+        rows = cursor.fetchall()
+        columns = list(zip(*rows)) if len(rows) != 0 else [()] * 7
+
+        [days, day_idx] = np.unique(
+            np.array(columns[0], dtype=str), return_inverse=True
+        )
+        [isins, first, sec_idx] = np.unique(
+            np.array(columns[2], dtype=str),
+            return_index=True,
+            return_inverse=True,
+        )
+        tickers = np.array(columns[1], dtype=str)[first]
+
+        values = {
+            name: np.array(columns[i], dtype="float64")
+            for [i, name] in [
+                (3, "quantity"),
+                (4, "value"),
+                (5, "weight"),
+                (6, "pnl"),
+            ]
+        }
+        return cls(
+            days,
+            isins,
+            tickers,
+            day_idx.astype("int32"),
+            sec_idx.astype("int32"),
+            values,
+        )
+
+    def __str__(self) -> str:
+        return (
+            f"(PositionMatrix days:{len(self.days)} "
+            f"securities:{len(self.isins)} entries:{len(self.day_idx)})"
+        )
+
+    def __entries(self, start: str, end: str) -> slice:
+        """
+        Entries with start <= Date <= end (DATE_FORMAT strings)
+        """
+        [first, last] = np.searchsorted(self.days, [start, end], "left")
+        if last < len(self.days) and self.days[last] == end:
+            last += 1
+        [lo, hi] = np.searchsorted(self.day_idx, [first, last], "left")
+        return slice(int(lo), int(hi))
+
+    def contributions(self, start: str, end: str) -> np.ndarray:
+        """
+        Returns:
+            pnl of every security (isins order) between start and end
+        """
+        entries = self.__entries(start, end)
+        return np.bincount(
+            self.sec_idx[entries],
+            weights=self.pnl[entries],
+            minlength=len(self.isins),
+        )
+
+    def top_contributors(
+        self, start: str, end: str, n: int = 10, largest: bool = True
+    ) -> list[tuple[str, str, float]]:
+        """
+        largest :parameter: highest pnl first, else lowest pnl first
+
+        Returns:
+            list[(ticker, isin, pnl)] of at most n securities
+        """
+        pnl = self.contributions(start, end)
+        keys = -pnl if largest else pnl
+        n = min(n, len(pnl))
+        if n == 0:
+            return []
+
+        top = np.argpartition(keys, n - 1)[:n]
+        top = top[np.argsort(keys[top], kind="stable")]
+        return [
+            (str(self.tickers[i]), str(self.isins[i]), float(pnl[i]))
+            for i in top
+        ]
+
+    def weights(self, date: str) -> list[tuple[str, str, float]]:
+        """
+        Returns:
+            list[(ticker, isin, weight)] of the last snapshot on or before
+            date
+        """
+        pos = int(np.searchsorted(self.days, date, "right")) - 1
+        if pos < 0:
+            return []
+
+        entries = self.__entries(self.days[pos], self.days[pos])
+        return [
+            (str(self.tickers[i]), str(self.isins[i]), float(w))
+            for [i, w] in zip(self.sec_idx[entries], self.weight[entries])
+        ]
+
+    def to_dense(self, field: str = "value") -> np.ndarray:
+        """
+        Returns:
+            (days x securities) array of field, 0 where not held
+        """
+        dense = np.zeros((len(self.days), len(self.isins)))
+        dense[self.day_idx, self.sec_idx] = getattr(self, field)
+        return dense
@@ -1,24 +1,30 @@
 # file that consists of getting price functions using the yahoo finance api
 import logging
-
-import yfinance as yf
-import pandas as pd
 import datetime
+import typing
 import calamar_backend.time as time
 
+# pandas and yfinance are imported on the first download, they are slow
+# to import and most runs read the csv database only
+if typing.TYPE_CHECKING:
+    import pandas as pd
+
 # disable logging in yahoo finance
 logger = logging.getLogger("yfinance")
 logger.disabled = True
 logger.propagate = False
 
 
-def download_price(ticker: str, start: str, end: str) -> pd.DataFrame:
+def download_price(ticker: str, start: str, end: str) -> "pd.DataFrame":
     """
     :param ticker: security ticker (must be present in yahoo finance)
     :param csv_file: file to save the price information
     :param start: starting date (YYYY-MM-DD)
     :param end: ending date
     """
+    import pandas as pd
+    import yfinance as yf
+
     print(
         f"{str(datetime.datetime.now())}: "
         f"downloading {ticker} from yahoo finance"
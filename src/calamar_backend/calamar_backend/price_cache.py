@@ -0,0 +1,221 @@
+"""
+Shared memory price cache
+    - a loader process parses every FY price file of the csv database once
+      and publishes the price arrays in shared memory segments:
+        - {name}_index:  json directory, "{id}_{fy}" -> (offset, rows),
+                         columns and dtype
+        - {name}_dates:  datetime64[s] dates of every file, concatenated
+        - {name}_values: (rows x columns) values, concatenated
+    - workers attach by name and read PriceArray views without copying or
+      parsing anything
+    - DatabaseCSV reads from an attached store first (see get_db_csv and
+      $CALAMAR_PRICE_SHM), files missing from it are read as usual
+"""
+import datetime
+import json
+import os
+import typing
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+
+from calamar_backend.database_csv import PriceArray
+
+# length prefix of the json directory
+INDEX_HEADER = 8
+
+
+def _attach_segment(name: str) -> shared_memory.SharedMemory:
+    """
+    Attach to an existing segment without registering it with the
+    resource tracker, which would unlink it when a worker exits
+    """
+    try:
+        # python >= 3.13
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+def _create_segment(name: str, size: int) -> shared_memory.SharedMemory:
+    # zero sized segments are not allowed
+    return shared_memory.SharedMemory(
+        name=name, create=True, size=max(size, 1)
+    )
+
+
+def read_price_files(
+    csv_dir: str,
+    columns: typing.Sequence[str] = ("Close",),
+    dtype: str = "float32",
+) -> dict[str, PriceArray]:
+    """
+    Parse every FY price file of the csv database once
+
+    Returns:
+        "{id}_{fy}" file name -> price array of the projected columns
+    """
+    import pandas as pd
+
+    arrays: dict[str, PriceArray] = {}
+    for file in sorted(os.listdir(csv_dir)):
+        [_, _, fy] = file.rpartition("_")
+        if not fy.isdigit():
+            continue
+
+        df = pd.read_csv(
+            os.path.join(csv_dir, file), usecols=["Date", *columns]
+        )
+        df["Date"] = pd.to_datetime(df["Date"])
+        df = df.set_index("Date")
+        arrays[file] = PriceArray.from_dataframe(df, columns, dtype)
+
+    return arrays
+
+
+class SharedPriceStore:
+    """
+    FY price arrays of the csv database in shared memory
+    """
+
+    def __init__(
+        self,
+        name: str,
+        segments: list[shared_memory.SharedMemory],
+        index: dict[str, typing.Any],
+        owner: bool,
+    ):
+        self.name = name
+        self.segments = segments
+        self.entries: dict[str, list[int]] = index["entries"]
+        self.columns: tuple[str, ...] = tuple(index["columns"])
+        self.owner = owner
+
+        rows = index["rows"]
+        [_, dates_seg, values_seg] = segments
+        self.dates = np.ndarray((rows,), "datetime64[s]", dates_seg.buf)
+        self.values = np.ndarray(
+            (rows, len(self.columns)), index["dtype"], values_seg.buf
+        )
+        self.dates.flags.writeable = False
+        self.values.flags.writeable = False
+
+    @classmethod
+    def publish(
+        cls,
+        csv_dir: str,
+        name: str = "calamar_prices",
+        columns: typing.Sequence[str] = ("Close",),
+        dtype: str = "float32",
+    ) -> "SharedPriceStore":
+        """
+        Loader: parse every price file in csv_dir and publish it
+
+        csv_dir :parameter: csv database directory
+        name :parameter: segment name prefix, workers attach with it
+        columns :parameter: columns to publish
+        dtype :parameter: dtype of the published values
+        """
+        arrays = read_price_files(csv_dir, columns, dtype)
+        entries: dict[str, list[int]] = {}
+        offset = 0
+        for [key, arr] in arrays.items():
+            entries[key] = [offset, len(arr.dates)]
+            offset += len(arr.dates)
+
+        index = {
+            "columns": list(columns),
+            "dtype": dtype,
+            "rows": offset,
+            "entries": entries,
+        }
+        index_bytes = json.dumps(index).encode()
+        itemsize = np.dtype(dtype).itemsize
+
+        segments = [
+            _create_segment(f"{name}_index", INDEX_HEADER + len(index_bytes)),
+            _create_segment(f"{name}_dates", offset * 8),
+            _create_segment(
+                f"{name}_values", offset * len(columns) * itemsize
+            ),
+        ]
+        index_buf = segments[0].buf
+        index_buf[:INDEX_HEADER] = len(index_bytes).to_bytes(
+            INDEX_HEADER, "little"
+        )
+        index_buf[INDEX_HEADER : INDEX_HEADER + len(index_bytes)] = index_bytes
+
+        dates = np.ndarray((offset,), "datetime64[s]", segments[1].buf)
+        values = np.ndarray((offset, len(columns)), dtype, segments[2].buf)
+        for [key, arr] in arrays.items():
+            [start, rows] = entries[key]
+            dates[start : start + rows] = arr.dates
+            values[start : start + rows] = arr.values
+        del dates, values
+
+        print(
+            f"{str(datetime.datetime.now())}: published {len(arrays)} "
+            f"price files ({offset} rows) as {name}"
+        )
+        return cls(name, segments, index, owner=True)
+
+    @classmethod
+    def attach(cls, name: str = "calamar_prices") -> "SharedPriceStore":
+        """
+        Worker: attach to a published store
+        """
+        index_seg = _attach_segment(f"{name}_index")
+        size = int.from_bytes(index_seg.buf[:INDEX_HEADER], "little")
+        index = json.loads(
+            bytes(index_seg.buf[INDEX_HEADER : INDEX_HEADER + size])
+        )
+        segments = [
+            index_seg,
+            _attach_segment(f"{name}_dates"),
+            _attach_segment(f"{name}_values"),
+        ]
+        return cls(name, segments, index, owner=False)
+
+    def get(self, isin: str, fy: int) -> typing.Optional[PriceArray]:
+        """
+        isin :parameter: isin, ticker or map_ (csv file name prefix)
+
+        Returns:
+            zero copy view of the FY price array, None when not published
+        """
+        entry = self.entries.get(f"{isin}_{fy}")
+        if entry is None:
+            return None
+
+        [start, rows] = entry
+        return PriceArray(
+            self.dates[start : start + rows],
+            self.columns,
+            self.values[start : start + rows],
+        )
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __repr__(self) -> str:
+        return (
+            f"(SharedPriceStore {self.name} files:{len(self.entries)} "
+            f"rows:{len(self.dates)} owner:{self.owner})"
+        )
+
+    def close(self) -> None:
+        """
+        Detach, the owner also removes the segments
+        """
+        # views must be released before the buffers are closed
+        del self.dates, self.values
+        for segment in self.segments:
+            segment.close()
+            if self.owner:
+                segment.unlink()
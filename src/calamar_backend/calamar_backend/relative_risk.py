@@ -0,0 +1,146 @@
+"""
+Relative risk
+    - rolling beta, correlation, tracking error and information ratio of
+      the portfolio against every benchmark index
+    - daily returns: the cash flow adjusted portfolio returns of twr_index
+      and the {ticker}_price closes on the same days
+    - every window and benchmark in one batched pass over cumulative sums
+      of the returns, their squares and cross products
+    - tracking error and information ratio are annualised
+"""
+import sqlite3
+import typing
+import numpy as np
+
+from calamar_backend.table_interface import TWR, Index
+
+TRADING_DAYS = 252
+
+
+def aligned_returns(
+    conn: sqlite3.Connection, tickers: list[str], series: str
+) -> tuple[list[str], np.ndarray, np.ndarray]:
+    """
+    series :parameter: twr_index series of the portfolio
+
+    Returns:
+        [dates, portfolio, benchmarks]
+        days of the series after its first one, the portfolio returns and
+        the (days x tickers) benchmark returns from the last close on or
+        before each day, NaN before an index's first close
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+        f"SELECT Date, log_return FROM {TWR().name} WHERE series = ? "
+        "ORDER BY Date",
+        (series,),
+    )
+    rows = cursor.fetchall()
+    dates = np.array([row[0] for row in rows])
+    portfolio = np.expm1(np.array([row[1] for row in rows], dtype="float64"))
+
+    closes = np.full((len(dates), len(tickers)), np.nan)
+    for [col, ticker] in enumerate(tickers):
+        cursor.execute(Index(ticker).get_all_query())
+        index_rows = cursor.fetchall()
+        if len(index_rows) == 0:
+            continue
+
+        index_dates = np.array([row[0] for row in index_rows])
+        index_closes = np.array([row[1] for row in index_rows], "float64")
+        pos = np.searchsorted(index_dates, dates, "right") - 1
+        closes[pos >= 0, col] = index_closes[pos[pos >= 0]]
+
+    benchmarks = closes[1:] / closes[:-1] - 1
+    return ([str(date) for date in dates[1:]], portfolio[1:], benchmarks)
+
+
+def rolling_relative_risk(
+    portfolio: np.ndarray, benchmarks: np.ndarray, windows: list[int]
+) -> dict[str, np.ndarray]:
+    """
+    portfolio :parameter: (days,) returns
+    benchmarks :parameter: (days x benchmarks) returns
+    windows :parameter: window lengths in days
+
+    Returns:
+        beta, correlation, tracking_error, information_ratio as
+        (windows x days x benchmarks) arrays, NaN until a window is full
+        of valid returns
+    """
+    [days, count] = benchmarks.shape
+    p = np.broadcast_to(portfolio[:, None], (days, count))
+    b = benchmarks
+    active = p - b
+    valid = ~(np.isnan(p) | np.isnan(b))
+
+    def prefix(x: np.ndarray) -> np.ndarray:
+        # leading zero row, so that a window is prefix[end] - prefix[start]
+        x = np.where(valid, x, 0.0)
+        return np.concatenate([np.zeros((1, count)), np.cumsum(x, axis=0)])
+
+    sums = {
+        name: prefix(x)
+        for [name, x] in [
+            ("p", p),
+            ("b", b),
+            ("pp", p * p),
+            ("bb", b * b),
+            ("pb", p * b),
+            ("a", active),
+            ("aa", active * active),
+            ("n", valid.astype("float64")),
+        ]
+    }
+
+    w = np.array(windows)[:, None]
+    end = np.arange(1, days + 1)[None, :]
+    start = np.maximum(end - w, 0)
+    win = {name: s[end] - s[start] for [name, s] in sums.items()}
+
+    n = w[:, :, None].astype("float64")
+    full = win["n"] == n
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cov = (win["pb"] - win["p"] * win["b"] / n) / (n - 1)
+        var_p = (win["pp"] - win["p"] ** 2 / n) / (n - 1)
+        var_b = (win["bb"] - win["b"] ** 2 / n) / (n - 1)
+        var_a = (win["aa"] - win["a"] ** 2 / n) / (n - 1)
+        tracking_error = np.sqrt(np.maximum(var_a, 0) * TRADING_DAYS)
+
+        stats = {
+            "beta": cov / var_b,
+            "correlation": cov / np.sqrt(var_p * var_b),
+            "tracking_error": tracking_error,
+            "information_ratio": win["a"] / n * TRADING_DAYS / tracking_error,
+        }
+
+    return {
+        name: np.where(full & np.isfinite(value), value, np.nan)
+        for [name, value] in stats.items()
+    }
+
+
+def relative_risk_rows(
+    dates: typing.Sequence[str],
+    tickers: list[str],
+    windows: list[int],
+    stats: dict[str, np.ndarray],
+) -> list[tuple]:
+    """
+    Returns:
+        rows in RelativeRisk column order, days with a full window only
+    """
+    beta = stats["beta"]
+    [w_idx, d_idx, t_idx] = np.nonzero(~np.isnan(beta))
+    return [
+        (
+            dates[d],
+            tickers[t],
+            windows[w],
+            float(beta[w, d, t]),
+            float(stats["correlation"][w, d, t]),
+            float(stats["tracking_error"][w, d, t]),
+            float(stats["information_ratio"][w, d, t]),
+        )
+        for [w, d, t] in zip(w_idx, d_idx, t_idx)
+    ]
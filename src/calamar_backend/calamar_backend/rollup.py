@@ -0,0 +1,253 @@
+"""
+NAV rollups
+    - weekly (W), monthly (M) and quarterly (Q) rollups of a nav series:
+      open, close, min, max nav and net cash flow of the period
+    - incremental: only the last stored period onwards is recomputed
+    - truncate: drop the periods from a changed date onwards
+    - series query that picks a resolution for a point budget
+"""
+import datetime
+import sqlite3
+import typing
+import numpy as np
+
+import calamar_backend.time as time
+from calamar_backend.table_interface import NAVRollup
+
+RESOLUTIONS = ("W", "M", "Q")
+
+
+def to_days(dates: typing.Sequence[str]) -> np.ndarray:
+    """
+    DATE_FORMAT strings to a datetime64[D] array
+    """
+    return np.array([date[:10] for date in dates], dtype="datetime64[D]")
+
+
+def period_starts(days: np.ndarray, resolution: str) -> np.ndarray:
+    """
+    First day of the week (monday), month or quarter of every day
+    """
+    match resolution:
+        case "W":
+            # 1970-01-01 was a thursday
+            weekday = (days.astype("int64") + 3) % 7
+            return days - weekday.astype("timedelta64[D]")
+        case "M":
+            return days.astype("datetime64[M]").astype("datetime64[D]")
+        case "Q":
+            months = days.astype("datetime64[M]").astype("int64")
+            quarter = (months - months % 3).astype("datetime64[M]")
+            return quarter.astype("datetime64[D]")
+        case _:
+            raise Exception(
+                f"{str(datetime.datetime.now())}: "
+                f"rollup: unknown resolution {resolution}"
+            )
+
+
+def compute_rollup(
+    series: str,
+    resolution: str,
+    dates: typing.Sequence[str],
+    navs: np.ndarray,
+    flow_dates: typing.Sequence[str],
+    flows: np.ndarray,
+) -> list[tuple]:
+    """
+    dates, navs :parameter: date ordered nav series
+    flow_dates, flows :parameter: cash flows, summed into the period of
+    their date
+
+    Returns:
+        rows in NAVRollup column order
+    """
+    if len(dates) == 0:
+        return []
+
+    keys = period_starts(to_days(dates), resolution)
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], len(keys)] - 1
+    group_keys = keys[starts]
+
+    period_flows = np.zeros(len(starts))
+    if len(flow_dates) != 0:
+        flow_keys = period_starts(to_days(flow_dates), resolution)
+        pos = np.searchsorted(group_keys, flow_keys)
+        found = pos < len(group_keys)
+        found[found] = group_keys[pos[found]] == flow_keys[found]
+        np.add.at(period_flows, pos[found], flows[found])
+
+    key_str = time.convert_datetime64_to_strf(
+        group_keys.astype("datetime64[s]")
+    )
+    opens = navs[starts]
+    closes = navs[ends]
+    mins = np.minimum.reduceat(navs, starts)
+    maxs = np.maximum.reduceat(navs, starts)
+
+    return [
+        (
+            str(key_str[i]),
+            series,
+            resolution,
+            dates[ends[i]],
+            float(opens[i]),
+            float(closes[i]),
+            float(mins[i]),
+            float(maxs[i]),
+            float(period_flows[i]),
+        )
+        for i in range(len(starts))
+    ]
+
+
+def update_rollups(
+    conn: sqlite3.Connection,
+    series: str,
+    flow_column: typing.Optional[str] = None,
+    flows: typing.Optional[dict[datetime.datetime, float]] = None,
+    full: bool = False,
+) -> None:
+    """
+    series :parameter: nav table (portfolio_nav, {ticker}_index_nav)
+    flow_column :parameter: sql expression of the day cash flow in the
+    series table, used when flows is not given
+    flows :parameter: day -> cash flow
+    full :parameter: drop stored rollups of the series and recompute
+
+    Only the last stored period of every resolution onwards is
+    recomputed, earlier periods are complete
+    """
+    rollup_table = NAVRollup()
+    rollup_table.ensure_table(conn)
+    cursor = conn.cursor()
+
+    for resolution in RESOLUTIONS:
+        since = None
+        if not full:
+            since = rollup_table.get_last_period(conn, series, resolution)
+        since = since if since is not None else ""
+        rollup_table.delete_from(conn, series, resolution, since)
+
+        flow_expr = flow_column if flow_column is not None else "0"
+        cursor.execute(
+            f"SELECT Date, nav, {flow_expr} FROM {series} "
+            "WHERE Date >= ? ORDER BY Date, rowid",
+            (since,),
+        )
+        rows = cursor.fetchall()
+        dates = [row[0] for row in rows]
+        navs = np.array([row[1] for row in rows], dtype="float64")
+
+        if flows is not None:
+            flow_items = [
+                (time.convert_date_to_strf(day), flow)
+                for [day, flow] in sorted(flows.items())
+                if time.convert_date_to_strf(day) >= since
+            ]
+            flow_dates = [item[0] for item in flow_items]
+            flow_values = np.array([item[1] for item in flow_items])
+        else:
+            flow_dates = dates
+            flow_values = np.array([row[2] for row in rows], dtype="float64")
+
+        rollup_table.insert_tuples(
+            conn,
+            rollup_table.columns,
+            compute_rollup(
+                series, resolution, dates, navs, flow_dates, flow_values
+            ),
+            commit=False,
+        )
+
+    conn.commit()
+
+
+def truncate_rollups(conn: sqlite3.Connection, series: str, date: str) -> None:
+    """
+    Drop the stored periods of series from the period holding date onwards,
+    the next update_rollups recomputes them
+    """
+    rollup_table = NAVRollup()
+    rollup_table.ensure_table(conn)
+    days = to_days([date])
+
+    for resolution in RESOLUTIONS:
+        start = time.convert_datetime64_to_strf(
+            period_starts(days, resolution).astype("datetime64[s]")
+        )
+        rollup_table.delete_from(conn, series, resolution, str(start[0]))
+
+    conn.commit()
+
+
+def choose_resolution(
+    conn: sqlite3.Connection,
+    series: str,
+    start: str,
+    end: str,
+    max_points: int,
+) -> str:
+    """
+    Returns:
+        "D" when the daily series fits max_points, else the finest rollup
+        resolution that fits, quarterly when none fits
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+        f"SELECT COUNT(*) FROM {series} WHERE Date BETWEEN ? AND ?",
+        (start, end),
+    )
+    if cursor.fetchone()[0] <= max_points:
+        return "D"
+
+    rollup_table = NAVRollup()
+    for resolution in RESOLUTIONS:
+        cursor.execute(
+            f"SELECT COUNT(*) FROM {rollup_table.name} WHERE series = ? "
+            "AND resolution = ? AND Date BETWEEN ? AND ?",
+            (series, resolution, start, end),
+        )
+        if cursor.fetchone()[0] <= max_points:
+            return resolution
+
+    return RESOLUTIONS[-1]
+
+
+def get_series_query(series: str, resolution: str) -> str:
+    """
+    Query for the points of a series at a resolution, takes (start, end)
+    parameters
+        - D: Date, nav
+        - W, M, Q: Date, open, close, min, max, net_flow
+    """
+    if resolution == "D":
+        return (
+            f"SELECT Date, nav FROM {series} WHERE Date BETWEEN ? AND ? "
+            "ORDER BY Date, rowid"
+        )
+
+    return (
+        f"SELECT Date, open, close, min, max, net_flow FROM "
+        f"{NAVRollup().name} WHERE series = '{series}' AND "
+        f"resolution = '{resolution}' AND Date BETWEEN ? AND ? ORDER BY Date"
+    )
+
+
+def get_series(
+    conn: sqlite3.Connection,
+    series: str,
+    start: str,
+    end: str,
+    max_points: int,
+) -> tuple[str, list[tuple]]:
+    """
+    Returns:
+        [resolution, rows] of the series between start and end, using the
+        finest resolution within max_points
+    """
+    resolution = choose_resolution(conn, series, start, end, max_points)
+    cursor = conn.cursor()
+    cursor.execute(get_series_query(series, resolution), (start, end))
+    return (resolution, cursor.fetchall())
@@ -0,0 +1,251 @@
+"""
+What-if scenarios
+    - evaluate hypothetical added or removed trades against the stored
+      holdings without rebuilding the portfolio report and nav
+    - only the traded securities are touched: their trades are replayed
+      with the scenario's on the holdings snapshot days (a holding that
+      is not positive on a snapshot is dropped, same as the portfolio
+      report) and the nav difference is
+        (quantity[t] - stored quantity[t]) * close[t]
+      from the first scenario trade onwards
+    - trades, stored quantities and closes of a security are loaded once
+      per engine, so that many scenarios can be evaluated interactively
+"""
+import datetime
+import sqlite3
+import typing
+import numpy as np
+
+import calamar_backend.time as time
+from calamar_backend.database_csv import get_db_csv
+from calamar_backend.table_interface import (
+    Index,
+    Portfolio,
+    PortfolioNAV,
+    Prices,
+    TradeReport,
+)
+from calamar_backend.table_row_interface import TradeReportRow
+
+# a missing close is looked up upto 5 days forward, same as the prices
+# table queries
+CLOSE_LOOKAHEAD = np.timedelta64(5, "D")
+
+
+class Scenario:
+    """
+    Trades added to, and trades removed from, the trade report
+    """
+
+    def __init__(
+        self,
+        added: typing.Sequence[TradeReportRow] = (),
+        removed: typing.Sequence[TradeReportRow] = (),
+    ):
+        self.added = list(added)
+        self.removed = list(removed)
+
+    def signed_trades(self) -> list[tuple[datetime.datetime, str, str, float]]:
+        """
+        Returns:
+            list[(date, ticker, isin, quantity)], buys positive, removed
+            trades with the opposite sign
+        """
+        trades = []
+        for [rows, sign] in [(self.added, 1), (self.removed, -1)]:
+            for row in rows:
+                quantity = row.quantity if row.is_buy else -row.quantity
+                trades.append(
+                    (row.date, row.ticker, row.isin, sign * quantity)
+                )
+        return trades
+
+    def __str__(self) -> str:
+        return (
+            f"(Scenario added:{len(self.added)} removed:{len(self.removed)})"
+        )
+
+
+class ScenarioEngine:
+    """
+    Evaluates scenarios against the trade report, portfolio report and
+    prices tables of a database
+    """
+
+    def __init__(
+        self,
+        conn: sqlite3.Connection,
+        tr_table: TradeReport,
+        session_ticker: str = "nifty50",
+    ):
+        """
+        session_ticker :parameter: index whose closes mark portfolio
+        sessions, same as the ledger
+        """
+        self.conn = conn
+        cursor = conn.cursor()
+
+        self.trades: dict[str, list[tuple[datetime.datetime, float]]] = {}
+        for row in tr_table.get_all(conn):
+            quantity = row.quantity if row.is_buy else -row.quantity
+            self.trades.setdefault(row.ticker, []).append((row.date, quantity))
+
+        # snapshot days: the first trade day and every session after it,
+        # upto the current date
+        cursor.execute(f"SELECT MIN(Date) FROM {Portfolio().name}")
+        day_zero = cursor.fetchone()[0]
+        cursor.execute(
+            f"SELECT Date FROM {Index(session_ticker).name} "
+            "WHERE Date > ? AND Date <= ?",
+            (
+                day_zero if day_zero is not None else "",
+                time.convert_date_to_strf(time.get_current_date()),
+            ),
+        )
+        sessions = [row[0] for row in cursor.fetchall()]
+        self.dates = sorted(
+            set(sessions).union([day_zero] if day_zero is not None else [])
+        )
+        self.days = np.array(self.dates, dtype="datetime64[s]")
+
+        cursor.execute(f"SELECT Date, nav FROM {PortfolioNAV().name}")
+        navs = dict(cursor.fetchall())
+        self.navs = np.array(
+            [navs.get(date, 0.0) for date in self.dates], dtype="float64"
+        )
+
+        # per security caches, filled on first use
+        self.quantities: dict[str, np.ndarray] = {}
+        self.closes: dict[str, np.ndarray] = {}
+
+    def __snapshot_positions(
+        self, dates: typing.Sequence[datetime.datetime]
+    ) -> np.ndarray:
+        """
+        Returns:
+            position of the first snapshot day on or after every date
+        """
+        return np.searchsorted(self.days, np.array(dates, "datetime64[s]"))
+
+    def __stored_quantities(self, ticker: str) -> np.ndarray:
+        """
+        Stored quantity of ticker on every snapshot day, 0 when not held
+        """
+        if ticker not in self.quantities:
+            cursor = self.conn.cursor()
+            cursor.execute(
+                f"SELECT Date, quantity FROM {Portfolio().name} "
+                "WHERE ticker = ?",
+                (ticker,),
+            )
+            held = dict(cursor.fetchall())
+            self.quantities[ticker] = np.array(
+                [held.get(date, 0.0) for date in self.dates], dtype="float64"
+            )
+        return self.quantities[ticker]
+
+    def __replay(
+        self, moves: list[tuple[datetime.datetime, float]]
+    ) -> np.ndarray:
+        """
+        moves :parameter: (date, signed quantity) trades of one security
+
+        Returns:
+            quantity held on every snapshot day
+        """
+        change = np.zeros(len(self.days) + 1)
+        np.add.at(
+            change,
+            self.__snapshot_positions([move[0] for move in moves]),
+            [move[1] for move in moves],
+        )
+
+        # only snapshots with trades change the quantity
+        quantity = np.zeros(len(self.days))
+        held = 0.0
+        changed = np.flatnonzero(change[:-1])
+        for [i, pos] in enumerate(changed):
+            held = max(held + change[pos], 0.0)
+            end = changed[i + 1] if i + 1 < len(changed) else len(self.days)
+            quantity[pos:end] = held
+        return quantity
+
+    def __closes(self, isin: str) -> np.ndarray:
+        """
+        Close of isin on every snapshot day found in the prices table, NaN
+        for days it does not cover
+        """
+        if isin not in self.closes:
+            cursor = self.conn.cursor()
+            cursor.execute(
+                f"SELECT Date, close FROM {Prices().name} "
+                "WHERE security_id = ? ORDER BY Date",
+                (isin,),
+            )
+            rows = cursor.fetchall()
+            price_days = np.array(
+                [row[0] for row in rows], dtype="datetime64[s]"
+            )
+            prices = np.array([row[1] for row in rows], dtype="float64")
+
+            closes = np.full(len(self.days), np.nan)
+            pos = np.searchsorted(price_days, self.days)
+            found = pos < len(price_days)
+            found[found] = (
+                price_days[pos[found]] <= self.days[found] + CLOSE_LOOKAHEAD
+            )
+            closes[found] = prices[pos[found]]
+            self.closes[isin] = closes
+
+        return self.closes[isin]
+
+    def __fill_closes(
+        self, ticker: str, isin: str, needed: np.ndarray
+    ) -> np.ndarray:
+        """
+        needed :parameter: snapshot day positions whose close is used, the
+        ones missing from the prices table are read from the csv database
+        """
+        closes = self.__closes(isin)
+        db_csv = get_db_csv()
+        for pos in needed[np.isnan(closes[needed])]:
+            closes[pos] = db_csv.read_price(
+                isin, time.convert_date_strf_to_strp(self.dates[pos]), ticker
+            )
+        return closes
+
+    def nav_delta(self, scenario: Scenario) -> tuple[list[str], np.ndarray]:
+        """
+        Returns:
+            [dates, delta] nav difference of the scenario on every snapshot
+            day from its first trade onwards
+        """
+        trades = scenario.signed_trades()
+        if len(trades) == 0:
+            return ([], np.zeros(0))
+
+        first = int(self.__snapshot_positions([t[0] for t in trades]).min())
+        delta = np.zeros(len(self.days) - first)
+
+        by_ticker: dict[tuple[str, str], list[tuple]] = {}
+        for [date, ticker, isin, quantity] in trades:
+            by_ticker.setdefault((ticker, isin), []).append((date, quantity))
+
+        for [[ticker, isin], moves] in by_ticker.items():
+            quantity = self.__replay(self.trades.get(ticker, []) + moves)
+            diff = (quantity - self.__stored_quantities(ticker))[first:]
+
+            needed = np.flatnonzero(diff != 0) + first
+            closes = self.__fill_closes(ticker, isin, needed)
+            delta[needed - first] += diff[needed - first] * closes[needed]
+
+        return (self.dates[first:], delta)
+
+    def nav(self, scenario: Scenario) -> tuple[list[str], np.ndarray]:
+        """
+        Returns:
+            [dates, nav] portfolio nav of the scenario from its first trade
+            onwards, 0 based on days without a stored nav
+        """
+        [dates, delta] = self.nav_delta(scenario)
+        return (dates, self.navs[len(self.navs) - len(dates) :] + delta)
@@ -0,0 +1,455 @@
+"""
+Read API server for the dashboard
+    Endpoints (GET, dates as YYYY-MM-DD):
+    - /portfolio_nav?start=&end=
+    - /index_nav/{ticker}?start=&end=
+    - /holdings?date=                 (latest snapshot on or before date)
+    - /ratio/{name}?start=&end=       (reads the {name}_ratio table)
+    - /nav/{series}?start=&end=&points=
+                                      (daily nav or the finest rollup that
+                                      fits the point budget)
+    - /twr/{series}?start=&end=&benchmark=
+                                      (time weighted return of a nav
+                                      series, and its excess over the
+                                      benchmark series when given)
+    - /relative_risk/{ticker}?window=&start=&end=
+    - /underwater/{series}?start=&end=
+    - /drawdown_episodes/{series}?start=&end=
+                                      (episodes starting between the dates)
+    - /xirr/{series}?start=&end=
+    - /montecarlo_bands, /montecarlo_risk   (latest projection)
+    - /optimal_weights?start=&end=
+    - /realized_gains?start=&end=     (lot parts sold between the dates)
+    - /open_lots?start=&end=          (lots bought between the dates)
+
+    Responses:
+    - json {"columns": [...], "rows": [[...], ...]}, sent in chunks
+    - cached in memory, keyed on the request and the versions of the
+      tables it reads
+    - ETag / If-None-Match answered with 304 without touching sqlite
+      while the tables are unchanged
+
+    run using -> python -m calamar_backend.server --db $CALAMAR_DB
+"""
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import datetime
+import hashlib
+import json
+import math
+import os
+import re
+import sqlite3
+import typing
+import urllib.parse
+
+import calamar_backend.time as time
+import calamar_backend.rollup as rollup
+from calamar_backend.table_interface import (
+    DrawdownEpisodes,
+    IndexNAV,
+    MonteCarloBands,
+    MonteCarloRisk,
+    NAVRollup,
+    OpenLots,
+    OptimalWeights,
+    Portfolio,
+    PortfolioNAV,
+    RealizedGains,
+    RelativeRisk,
+    TWR,
+    Underwater,
+    WriteVersions,
+    XIRR,
+)
+
+NAME_PATTERN = re.compile(r"^[a-zA-Z0-9_]+$")
+CHUNK_ROWS = 500
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, reason: str):
+        Exception.__init__(self, reason)
+        self.status = status
+        self.reason = reason
+
+
+class TableVersions:
+    """
+    Version fingerprint of tables (schema, shape and write version),
+    recomputed only after another connection committed to the database
+    (PRAGMA data_version)
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self.data_version = -1
+        self.versions: dict[str, str] = {}
+
+    def get(self, table: str) -> str:
+        cursor = self.conn.cursor()
+        data_version = cursor.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != self.data_version:
+            self.data_version = data_version
+            self.versions = {}
+
+        if table not in self.versions:
+            cursor.execute(
+                "SELECT sql FROM sqlite_master WHERE type = 'table' "
+                "AND name = ?",
+                (table,),
+            )
+            schema = cursor.fetchall()
+            if len(schema) == 0:
+                raise HTTPError(404, f"table {table} not found")
+
+            cursor.execute(
+                f"SELECT COUNT(*), MAX(rowid), MAX(Date) FROM {table}"
+            )
+            shape = cursor.fetchone()
+            # rewrites with the same shape (e.g. corrected prices) bump
+            # the write version
+            version = WriteVersions().get_version(self.conn, table)
+            self.versions[table] = f"{schema[0][0]}|{shape}|{version}"
+
+        return self.versions[table]
+
+
+class Query:
+    """
+    A parsed request: the tables read and the sql to run
+    """
+
+    def __init__(self, tables: list[str], sql: str, params: tuple):
+        self.tables = tables
+        self.sql = sql
+        self.params = params
+
+
+class ReadAPI:
+    """
+    Maps requests to queries and keeps the response cache
+    All sqlite work runs on a single worker thread
+    """
+
+    def __init__(self, db_name: str, cache_size: int = 256):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.conn = sqlite3.connect(
+            f"file:{db_name}?mode=ro", uri=True, check_same_thread=False
+        )
+        # sqlite builds without the math functions
+        try:
+            self.conn.execute("SELECT exp(0)")
+        except sqlite3.OperationalError:
+            self.conn.create_function("exp", 1, math.exp, deterministic=True)
+        self.versions = TableVersions(self.conn)
+        self.cache_size = cache_size
+        self.cache: collections.OrderedDict[
+            str, tuple[str, list[bytes]]
+        ] = collections.OrderedDict()
+
+    @staticmethod
+    def __date(params: dict[str, list[str]], key: str, default: str) -> str:
+        value = params.get(key, [default])[0]
+        try:
+            date = datetime.datetime.strptime(value, time.YF_DATE_FORMAT)
+        except ValueError:
+            raise HTTPError(400, f"bad date {key}={value}")
+        return time.convert_date_to_strf(date)
+
+    def route(self, path: str, params: dict[str, list[str]]) -> Query:
+        parts = [part for part in path.split("/") if part != ""]
+        start = self.__date(params, "start", "1900-01-01")
+        end = self.__date(params, "end", "9999-12-31")
+
+        table = None
+        if parts == ["portfolio_nav"]:
+            table = PortfolioNAV().name
+        elif len(parts) == 2 and parts[0] == "index_nav":
+            table = IndexNAV(parts[1]).name
+        elif len(parts) == 2 and parts[0] == "ratio":
+            table = f"{parts[1]}_ratio"
+        elif len(parts) == 1 and parts[0] in (
+            OptimalWeights().name,
+            RealizedGains().name,
+            OpenLots().name,
+        ):
+            table = parts[0]
+        elif parts == ["holdings"]:
+            table = Portfolio().name
+            date = self.__date(params, "date", "9999-12-31")
+            return Query(
+                [table],
+                f"SELECT * FROM {table} WHERE Date = (SELECT MAX(Date) "
+                f"FROM {table} WHERE Date <= ?) ORDER BY rowid",
+                (date,),
+            )
+
+        elif len(parts) == 2 and parts[0] == "nav":
+            series = parts[1]
+            if NAME_PATTERN.match(series) is None or not (
+                series == PortfolioNAV().name or series.endswith("_index_nav")
+            ):
+                raise HTTPError(404, f"unknown series {series}")
+
+            try:
+                points = int(params.get("points", ["1000"])[0])
+            except ValueError:
+                raise HTTPError(400, "bad points")
+
+            # both tables are checked so that missing ones give a 404
+            tables = [series, NAVRollup().name]
+            for name in tables:
+                self.versions.get(name)
+
+            resolution = rollup.choose_resolution(
+                self.conn, series, start, end, points
+            )
+            return Query(
+                tables,
+                rollup.get_series_query(series, resolution),
+                (start, end),
+            )
+
+        elif len(parts) == 2 and parts[0] == "twr":
+            twr_table = TWR()
+            series = [parts[1], *params.get("benchmark", [])[:1]]
+            expr = twr_table.window_expr()
+            twr_params = tuple(
+                param
+                for name in series
+                for param in (name, name, end, name, start)
+            )
+
+            if len(series) == 1:
+                sql = f"SELECT ? AS series, {expr} AS twr"
+            else:
+                sql = (
+                    "SELECT series, twr, benchmark, benchmark_twr, "
+                    "twr - benchmark_twr AS excess FROM (SELECT ? AS series, "
+                    f"{expr} AS twr, ? AS benchmark, {expr} AS benchmark_twr)"
+                )
+            return Query([twr_table.name], sql, twr_params)
+
+        elif len(parts) == 2 and parts[0] == "relative_risk":
+            try:
+                window = int(params.get("window", ["63"])[0])
+            except ValueError:
+                raise HTTPError(400, "bad window")
+
+            table = RelativeRisk().name
+            return Query(
+                [table],
+                f'SELECT * FROM {table} WHERE benchmark = ? AND "window" = ? '
+                "AND Date BETWEEN ? AND ? ORDER BY Date",
+                (parts[1], window, start, end),
+            )
+
+        elif len(parts) == 1 and parts[0] in (
+            MonteCarloBands().name,
+            MonteCarloRisk().name,
+        ):
+            return Query(
+                [parts[0]],
+                f"SELECT * FROM {parts[0]} ORDER BY horizon",
+                (),
+            )
+
+        elif len(parts) == 2 and parts[0] in (
+            Underwater().name,
+            DrawdownEpisodes().name,
+            XIRR().name,
+        ):
+            if NAME_PATTERN.match(parts[1]) is None:
+                raise HTTPError(404, f"unknown series {parts[1]}")
+            return Query(
+                [parts[0]],
+                f"SELECT * FROM {parts[0]} WHERE series = ? AND "
+                "Date BETWEEN ? AND ? ORDER BY Date",
+                (parts[1], start, end),
+            )
+
+        if table is None or NAME_PATTERN.match(table) is None:
+            raise HTTPError(404, f"unknown endpoint {path}")
+
+        return Query(
+            [table],
+            f"SELECT * FROM {table} WHERE Date BETWEEN ? AND ? "
+            "ORDER BY Date, rowid",
+            (start, end),
+        )
+
+    def etag(self, key: str, query: Query) -> str:
+        version = "|".join(self.versions.get(table) for table in query.tables)
+        digest = hashlib.sha1(f"{key}|{version}".encode()).hexdigest()
+        return f'"{digest[:20]}"'
+
+    def render(self, query: Query) -> list[bytes]:
+        """
+        Run the query and serialize it as json in chunks of rows
+        """
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(query.sql, query.params)
+        except sqlite3.OperationalError as e:
+            raise HTTPError(404, str(e))
+
+        columns = [col[0] for col in cursor.description]
+        chunks = [f'{{"columns": {json.dumps(columns)}, "rows": ['.encode()]
+        first = True
+
+        while True:
+            rows = cursor.fetchmany(CHUNK_ROWS)
+            if len(rows) == 0:
+                break
+
+            body = ", ".join(json.dumps(row) for row in rows)
+            chunks.append((body if first else ", " + body).encode())
+            first = False
+
+        chunks.append(b"]}")
+        return chunks
+
+    def respond(
+        self, target: str, if_none_match: typing.Optional[str]
+    ) -> tuple[int, str, list[bytes]]:
+        """
+        Runs on the sqlite thread
+
+        Returns:
+            [status, etag, body chunks]
+        """
+        url = urllib.parse.urlsplit(target)
+        params = urllib.parse.parse_qs(url.query)
+        key = f"{url.path}?{urllib.parse.urlencode(sorted(params.items()))}"
+
+        query = self.route(url.path, params)
+        etag = self.etag(key, query)
+
+        if if_none_match == etag:
+            return (304, etag, [])
+
+        cached = self.cache.get(key)
+        if cached is not None and cached[0] == etag:
+            self.cache.move_to_end(key)
+            return (200, etag, cached[1])
+
+        chunks = self.render(query)
+        self.cache[key] = (etag, chunks)
+        self.cache.move_to_end(key)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+        return (200, etag, chunks)
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """
+        HTTP/1.1 connection handler, keeps the connection alive
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (
+                    asyncio.IncompleteReadError,
+                    asyncio.LimitOverrunError,
+                ):
+                    break
+
+                lines = head.decode("latin-1").split("\r\n")
+                [method, target, _] = (lines[0].split(" ") + ["", ""])[:3]
+                headers = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        [name, value] = line.split(":", 1)
+                        headers[name.strip().lower()] = value.strip()
+
+                try:
+                    if method != "GET":
+                        raise HTTPError(405, "only GET is supported")
+                    [status, etag, chunks] = await loop.run_in_executor(
+                        self.executor,
+                        self.respond,
+                        target,
+                        headers.get("if-none-match"),
+                    )
+                except HTTPError as e:
+                    [status, etag] = [e.status, ""]
+                    chunks = [json.dumps({"error": e.reason}).encode()]
+                except Exception as e:
+                    # e.g. sqlite errors, the connection stays usable
+                    [status, etag] = [500, ""]
+                    chunks = [json.dumps({"error": str(e)}).encode()]
+
+                await self.__write(writer, status, etag, chunks)
+                if headers.get("connection", "").lower() == "close":
+                    break
+        finally:
+            writer.close()
+
+    async def __write(
+        self,
+        writer: asyncio.StreamWriter,
+        status: int,
+        etag: str,
+        chunks: list[bytes],
+    ) -> None:
+        reasons = {200: "OK", 304: "Not Modified", 400: "Bad Request"}
+        reasons.update({404: "Not Found", 405: "Method Not Allowed"})
+        reasons.update({500: "Internal Server Error"})
+        head = [f"HTTP/1.1 {status} {reasons.get(status, 'Error')}"]
+        if etag != "":
+            head.append(f"ETag: {etag}")
+
+        if status == 304:
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode())
+            await writer.drain()
+            return
+
+        head += [
+            "Content-Type: application/json",
+            "Transfer-Encoding: chunked",
+            "Cache-Control: no-cache",
+        ]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode())
+        for chunk in chunks:
+            writer.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+            await writer.drain()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def serve(self, host: str, port: int) -> asyncio.Server:
+        return await asyncio.start_server(self.handle, host, port)
+
+
+async def run(db_name: str, host: str, port: int) -> None:
+    api = ReadAPI(db_name)
+    server = await api.serve(host, port)
+    print(f"{str(datetime.datetime.now())}: serving {db_name} on {port}")
+    async with server:
+        await server.serve_forever()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="calamar read api")
+    parser.add_argument("--db", default=os.getenv("CALAMAR_DB"))
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+
+    if args.db is None:
+        raise Exception(
+            f"{str(datetime.datetime.now())}: "
+            "environment variable 'CALAMAR_DB' not set"
+        )
+
+    asyncio.run(run(args.db, args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,11 +6,24 @@ Utility Table Classes
     - Index: index table for nse index
     - IndexNav: index nav table
     - PortfolioNav: portfolio nav table
+    - Prices: security close prices loaded from the csv database
+    - Positions: per security value, weight and pnl of the holdings
+    - TWR: time weighted return prefix sums of nav series
+    - RelativeRisk: rolling risk of the portfolio against benchmarks
+    - XIRR: money weighted returns over trailing windows
+    - MonteCarloBands, MonteCarloRisk: projections of the latest holdings
+    - OptimalWeights: min variance and max sharpe weights of the holdings
+    - ReturnWindow, MomentState: persisted return window of the optimizer
+    - RealizedGains, OpenLots: FIFO tax lots of the trade report
+    - NAVRollup: weekly, monthly and quarterly nav rollups
+    - Underwater, DrawdownEpisodes, DrawdownState: drawdowns of nav series
+    - BuildCheckpoints: resume points of interrupted shadow table builds
+    - WriteVersions: write counter of every table (response etags)
 """
 
+import contextlib
 import datetime
 import sqlite3
-import pandas as pd
 import typing
 import os
 import abc
@@ -19,12 +32,33 @@ import calamar_backend.time as time
 import calamar_backend.table_row_interface as inf_row
 
 from calamar_backend.price import download_price as yf_get_price
-from calamar_backend.maps import calamar_ticker_map
+from calamar_backend.maps import get_ticker_map
+
+if typing.TYPE_CHECKING:
+    import pandas as pd
+
+# suffix of the table a builder writes to before it is swapped in
+SHADOW_SUFFIX = "__shadow"
+
+
+def table_exists(conn: sqlite3.Connection, table: str) -> bool:
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+        (table,),
+    )
+    return cursor.fetchone() is not None
 
 
 class Table(abc.ABC):
     _table = None
 
+    @property
+    def name(self) -> str:
+        if self._table is None:
+            raise Exception(f"{datetime.datetime.now()}: table not set")
+        return self._table
+
     @abc.abstractmethod
     def get_query(self, date: datetime.datetime) -> str:
         """
@@ -83,6 +117,70 @@ class Table(abc.ABC):
         self._delete_table(conn)
         self._create_table(conn)
 
+    @contextlib.contextmanager
+    def shadow_build(
+        self, conn: sqlite3.Connection, resume: bool = False
+    ) -> typing.Iterator[set[str]]:
+        """
+        Build the table under its shadow name ({table}__shadow): every
+        method of the table writes to the shadow inside the block, readers
+        keep the live table until the shadow replaces it in one transaction
+        (see swap_shadow) when the block exits without an error
+        resume :parameter: keep the shadow of an interrupted build and the
+        checkpoints it committed, instead of starting a new one
+
+        Yields:
+            keys checkpointed in the shadow (see BuildCheckpoints)
+        """
+        live = self.name
+        checkpoints = BuildCheckpoints()
+        checkpoints.ensure_table(conn)
+
+        self._table = f"{live}{SHADOW_SUFFIX}"
+        try:
+            done: set[str] = set()
+            if resume and table_exists(conn, self._table):
+                done = checkpoints.get_keys(conn, self._table)
+            else:
+                checkpoints.delete_keys(conn, self._table)
+                self.create_new_table(conn)
+
+            yield done
+        finally:
+            self._table = live
+
+        self.swap_shadow(conn)
+
+    def swap_shadow(self, conn: sqlite3.Connection) -> None:
+        """
+        Replace the live table with its shadow in one transaction, the
+        shadow's indexes are recreated under the live names
+        """
+        live = self.name
+        shadow = f"{live}{SHADOW_SUFFIX}"
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'index' "
+            "AND tbl_name = ? AND sql IS NOT NULL",
+            (shadow,),
+        )
+        indexes = cursor.fetchall()
+
+        conn.commit()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.execute(f"DROP TABLE IF EXISTS {live}")
+            cursor.execute(f"ALTER TABLE {shadow} RENAME TO {live}")
+            for [name, sql] in indexes:
+                cursor.execute(f'DROP INDEX "{name}"')
+                cursor.execute(sql.replace(shadow, live))
+            BuildCheckpoints().delete_keys(conn, shadow, commit=False)
+            WriteVersions().bump(conn, [live])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
     def __get_day_zero_query(self) -> str:
         return f"SELECT * FROM {self._table} LIMIT 1"
 
@@ -120,10 +218,195 @@ class Table(abc.ABC):
         rows: list[tuple[str, ...]] = cursor.fetchall()
         return list(map(self.create_table_rows, rows))
 
+    def get_all_query(self) -> str:
+        """
+        Query whole table ordered by date
+        Note: subclasses selecting a subset of columns in get_query should
+        select the same subset here
+        """
+        return f"SELECT * FROM {self._table} ORDER BY Date, rowid"
+
+    def get_all(self, conn: sqlite3.Connection):
+        """
+        Returns:
+            list[cls]: every row of the table ordered by date
+        """
+        cursor = conn.cursor()
+        cursor.execute(self.get_all_query())
+        rows: list[tuple[str, ...]] = cursor.fetchall()
+        return list(map(self.create_table_rows, rows))
+
+    def insert_tuples(
+        self,
+        conn: sqlite3.Connection,
+        columns: typing.Sequence[str],
+        rows: typing.Iterable[typing.Sequence],
+        commit: bool = True,
+    ) -> None:
+        """
+        Bulk insert plain tuples using a single parameterized statement
+        commit :parameter: set to False to batch several inserts into one
+        transaction
+        """
+        cursor = conn.cursor()
+        cursor.executemany(
+            f"INSERT INTO {self.name} ({', '.join(columns)}) VALUES "
+            f"({', '.join('?' * len(columns))})",
+            rows,
+        )
+        # shadow tables are versioned when they are swapped in
+        if not self.name.endswith(SHADOW_SUFFIX):
+            WriteVersions().bump(conn, [self.name])
+        if commit:
+            conn.commit()
+
+
+class WriteVersions(Table):
+    """
+    Write counter of every table, bumped in the transaction that writes
+    the table, so that readers can tell a rewrite with the same rows
+    count and dates apart
+    """
+
+    columns = ("Date", "tbl", "version")
+
+    def __init__(self):
+        self._table = "write_versions"
+
+    def _create_table(self, conn: sqlite3.Connection) -> None:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""CREATE TABLE IF NOT EXISTS {self._table} """
+            '("Date" DATE, "tbl" TEXT PRIMARY KEY, "version" INTEGER)'
+        )
+
+    def get_query(self, date: datetime.datetime) -> str:
+        return (
+            f"SELECT * FROM {self._table} "
+            f"WHERE Date = '{time.convert_date_to_strf(date)}'"
+        )
+
+    def create_table_rows(self, row: tuple) -> inf_row.WriteVersionRow:
+        return inf_row.WriteVersionRow(*row)
+
+    def bump(self, conn: sqlite3.Connection, tables: list[str]) -> None:
+        """
+        Increment the version of tables, committed by the caller with the
+        write
+        """
+        self._create_table(conn)
+        date = time.convert_date_to_strf(datetime.datetime.now())
+        cursor = conn.cursor()
+        cursor.executemany(
+            f"INSERT INTO {self._table} (Date, tbl, version) VALUES (?, ?, 1) "
+            "ON CONFLICT (tbl) DO UPDATE SET version = version + 1, "
+            "Date = excluded.Date",
+            [(date, table) for table in tables],
+        )
+
+    def get_version(self, conn: sqlite3.Connection, table: str) -> int:
+        """
+        Returns:
+            version of table, 0 when it was never bumped
+        """
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                f"SELECT version FROM {self._table} WHERE tbl = ?", (table,)
+            )
+        except sqlite3.OperationalError:
+            # no table was written since the versions were added
+            return 0
+        row = cursor.fetchone()
+        return row[0] if row is not None else 0
+
+
+class BuildCheckpoints(Table):
+    """
+    Units of work committed to a shadow table by an unfinished build, one
+    row per (table, key), written in the same transaction as the rows of
+    the unit
+    """
+
+    columns = ("Date", "tbl", "key")
 
-class BankStatement(Table):
     def __init__(self):
-        file = os.getenv("ZERODHA_BANK_STATEMENT")
+        self._table = "build_checkpoints"
+
+    def _create_table(self, conn: sqlite3.Connection) -> None:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""CREATE TABLE IF NOT EXISTS {self._table} """
+            '("Date" DATE, "tbl" TEXT, "key" TEXT, PRIMARY KEY (tbl, key))'
+        )
+        conn.commit()
+
+    def get_query(self, date: datetime.datetime) -> str:
+        return (
+            f"SELECT * FROM {self._table} "
+            f"WHERE Date = '{time.convert_date_to_strf(date)}'"
+        )
+
+    def create_table_rows(self, row: tuple) -> inf_row.BuildCheckpointRow:
+        return inf_row.BuildCheckpointRow(*row)
+
+    def ensure_table(self, conn: sqlite3.Connection) -> None:
+        self._create_table(conn)
+
+    def get_keys(self, conn: sqlite3.Connection, table: str) -> set[str]:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"SELECT key FROM {self._table} WHERE tbl = ?", (table,)
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+    def add_key(self, conn: sqlite3.Connection, table: str, key: str) -> None:
+        """
+        Record key as done, committed by the caller with the unit's rows
+        """
+        cursor = conn.cursor()
+        cursor.execute(
+            f"INSERT OR REPLACE INTO {self._table} (Date, tbl, key) "
+            "VALUES (?, ?, ?)",
+            (
+                time.convert_date_to_strf(datetime.datetime.now()),
+                table,
+                key,
+            ),
+        )
+
+    def delete_keys(
+        self,
+        conn: sqlite3.Connection,
+        table: str,
+        keys: typing.Optional[typing.Iterable[str]] = None,
+        commit: bool = True,
+    ) -> None:
+        """
+        keys :parameter: keys to delete, None deletes every key of table
+        """
+        cursor = conn.cursor()
+        if keys is None:
+            cursor.execute(
+                f"DELETE FROM {self._table} WHERE tbl = ?", (table,)
+            )
+        else:
+            cursor.executemany(
+                f"DELETE FROM {self._table} WHERE tbl = ? AND key = ?",
+                [(table, key) for key in keys],
+            )
+        if commit:
+            conn.commit()
+
+
+class BankStatement(Table):
+    def __init__(self, file: typing.Optional[str] = None):
+        """
+        file :parameter: bank statement csv, defaults to
+        $ZERODHA_BANK_STATEMENT
+        """
+        if file is None:
+            file = os.getenv("ZERODHA_BANK_STATEMENT")
 
         if file is None:
             raise Exception(
@@ -140,7 +423,12 @@ class BankStatement(Table):
     ) -> inf_row.BankStatementRow:
         return inf_row.BankStatementRow(*row)
 
-    def _create_table(self, conn: sqlite3.Connection) -> None:
+    def read_file(self) -> "pd.DataFrame":
+        """
+        Cleaned bank statement file indexed on Date
+        """
+        import pandas as pd
+
         df = pd.read_csv(self.bank_statement_file)
         df = df.dropna()
         clean_df = self.__clean_zerodha_bank_statement_file(df)
@@ -150,8 +438,10 @@ class BankStatement(Table):
         clean_df = clean_df.rename(columns={"posting_date": "Date"})
         clean_df = clean_df.set_index("Date")
         clean_df = clean_df.sort_values(by="Date")
+        return clean_df
 
-        clean_df.to_sql(
+    def _create_table(self, conn: sqlite3.Connection) -> None:
+        self.read_file().to_sql(
             self._table,
             conn,
             index=True,
@@ -166,9 +456,17 @@ class BankStatement(Table):
             f"FROM {self._table} WHERE Date = '{date_str}'"
         )
 
+    def get_all_query(self) -> str:
+        return (
+            "SELECT Date, particulars, cost_center, debit, credit "
+            f"FROM {self._table} ORDER BY Date, rowid"
+        )
+
     def __clean_zerodha_bank_statement_file(
-        self, df: pd.DataFrame
-    ) -> pd.DataFrame:
+        self, df: "pd.DataFrame"
+    ) -> "pd.DataFrame":
+        import pandas as pd
+
         df["ind_txn"] = df.apply(
             inf_row.BankStatementRow.is_valid_bank_statement, axis=1
         )
@@ -185,8 +483,18 @@ class BankStatement(Table):
 
 
 class TradeReport(Table):
-    def __init__(self):
-        file = os.getenv("ZERODHA_TRADE_REPORT")
+    def __init__(
+        self,
+        file: typing.Optional[str] = None,
+        prob_file: typing.Optional[str] = None,
+    ):
+        """
+        file :parameter: trade report csv, defaults to $ZERODHA_TRADE_REPORT
+        prob_file :parameter: problematic securities file, defaults to
+        $ZERODHA_PROBLEM_SEC
+        """
+        if file is None:
+            file = os.getenv("ZERODHA_TRADE_REPORT")
         if file is None:
             raise Exception(
                 f"{str(datetime.datetime.now())}: "
@@ -194,8 +502,17 @@ class TradeReport(Table):
             )
 
         self.trade_report_file: str = file
+        self.prob_file = prob_file
         self._table = "trade_report"
 
+    def get_prob_file(self) -> typing.Optional[str]:
+        """
+        Problematic securities file, defaults to $ZERODHA_PROBLEM_SEC
+        """
+        if self.prob_file is not None:
+            return self.prob_file
+        return os.getenv("ZERODHA_PROBLEM_SEC")
+
     def get_query(self, date: datetime.datetime) -> str:
         return (
             "SELECT Date, symbol, isin, trade_type, "
@@ -203,15 +520,23 @@ class TradeReport(Table):
             f"""'{time.convert_date_to_strf(date)}'"""
         )
 
+    def get_all_query(self) -> str:
+        return (
+            "SELECT Date, symbol, isin, trade_type, "
+            f"quantity FROM {self._table} ORDER BY Date, rowid"
+        )
+
     def create_table_rows(
         self, row: typing.Tuple[str, str, str, str, int]
     ) -> inf_row.TradeReportRow:
         return inf_row.TradeReportRow(*row)
 
-    def _create_table(self, conn: sqlite3.Connection) -> None:
+    def read_file(self) -> "pd.DataFrame":
         """
-        Inserts data in file $ZERODHA_TRADE_REPORT into trade report table
+        Trade report file indexed on Date, without problematic securities
         """
+        import pandas as pd
+
         df = pd.read_csv(self.trade_report_file)
         df = df.dropna()
 
@@ -224,7 +549,7 @@ class TradeReport(Table):
         """
         Read problematic securites from prob file and remove them from trading
         """
-        prob_file = os.getenv("ZERODHA_PROBLEM_SEC")
+        prob_file = self.get_prob_file()
         if prob_file is None:
             raise Exception(
                 f"{str(datetime.datetime.now())}:"
@@ -237,18 +562,23 @@ class TradeReport(Table):
                 sec = sec.replace("\n", "")
                 df = df[df["symbol"] != sec]
 
-        if isinstance(df, pd.DataFrame):
-            df.to_sql(
-                self._table,
-                conn,
-                index=True,
-                if_exists="replace",
-                index_label="Date",
-            )
-        else:
+        if not isinstance(df, pd.DataFrame):
             raise Exception(
                 f"{str(datetime.datetime.now())}:portfolio._create_table"
             )
+        return df
+
+    def _create_table(self, conn: sqlite3.Connection) -> None:
+        """
+        Inserts data in the trade report file into trade report table
+        """
+        self.read_file().to_sql(
+            self._table,
+            conn,
+            index=True,
+            if_exists="replace",
+            index_label="Date",
+        )
 
 
 class Index(Table):
@@ -260,7 +590,7 @@ class Index(Table):
         """
         start, end needs to be set only when you want to create a table
         """
-        self.yf_ticker = calamar_ticker_map.get(ticker)
+        self.yf_ticker = get_ticker_map().get(ticker)
         self.start = start
         self.end = end
         self._table = f"{ticker}_price"
@@ -276,6 +606,9 @@ class Index(Table):
             f"'{time.convert_date_to_strf(date)}'"
         )
 
+    def get_all_query(self) -> str:
+        return f"SELECT Date, Close FROM {self._table} ORDER BY Date, rowid"
+
     def _create_table(self, conn: sqlite3.Connection) -> None:
         if (self.start == "") or (self.end == ""):
             raise Exception(
@@ -283,7 +616,7 @@ class Index(Table):
                 "not set"
             )
 
-        df: pd.DataFrame = yf_get_price(self.yf_ticker, self.start, self.end)
+        df = yf_get_price(self.yf_ticker, self.start, self.end)
         df.to_sql(
             self._table,
             conn,
@@ -292,8 +625,35 @@ class Index(Table):
             index_label="Date",
         )
 
+    def copy_table(self, conn: sqlite3.Connection, src_db: str) -> None:
+        """
+        Copy the price table from another (read only) database instead of
+        downloading it again
+        """
+        cursor = conn.cursor()
+        cursor.execute(f"ATTACH DATABASE 'file:{src_db}?mode=ro' AS src")
+        try:
+            cursor.execute(f"DROP TABLE IF EXISTS main.{self._table}")
+            cursor.execute(
+                f"CREATE TABLE main.{self._table} AS "
+                f"SELECT * FROM src.{self._table}"
+            )
+            conn.commit()
+        finally:
+            cursor.execute("DETACH DATABASE src")
+
 
 class IndexNAV(Table):
+    columns = (
+        "Date",
+        "ticker",
+        "day_payin",
+        "day_payout",
+        "amount_invested",
+        "units",
+        "nav",
+    )
+
     def __init__(self, ticker: str):
         self.ticker = ticker
         self._table = f"{ticker}_index_nav"
@@ -332,6 +692,8 @@ class IndexNAV(Table):
 
 
 class Portfolio(Table):
+    columns = ("Date", "ticker", "isin", "quantity")
+
     def __init__(self):
         self._table = "portfolio_report"
         self.portfolio: typing.Dict[str, inf_row.TradeReportRow] = {}
@@ -355,6 +717,28 @@ class Portfolio(Table):
     ) -> inf_row.PortfolioRow:
         return inf_row.PortfolioRow(*row)
 
+    def get_securities(
+        self, conn: sqlite3.Connection
+    ) -> list[tuple[str, str, datetime.datetime, datetime.datetime]]:
+        """
+        Returns:
+            list[(isin, ticker, first held date, last held date)]
+        """
+        cursor = conn.cursor()
+        cursor.execute(
+            f"SELECT isin, ticker, MIN(Date), MAX(Date) FROM {self._table} "
+            "GROUP BY isin, ticker"
+        )
+        return [
+            (
+                isin,
+                ticker,
+                time.convert_date_strf_to_strp(start),
+                time.convert_date_strf_to_strp(end),
+            )
+            for [isin, ticker, start, end] in cursor.fetchall()
+        ]
+
     def add_to_portfolio(self, trade: inf_row.TradeReportRow) -> None:
         if trade.ticker in self.portfolio:
             if trade.is_buy:
@@ -398,6 +782,8 @@ class Portfolio(Table):
 
 
 class PortfolioNAV(Table):
+    columns = ("Date", "nav")
+
     def __init__(self):
         self._table = "portfolio_nav"
 
@@ -418,3 +804,818 @@ class PortfolioNAV(Table):
         self, row: tuple[str, float]
     ) -> inf_row.PortfolioNAVRow:
         return inf_row.PortfolioNAVRow(*row)
+
+
+class Prices(Table):
+    """
+    Close prices of portfolio securities, security_id is the isin
+    """
+
+    columns = ("Date", "security_id", "close")
+
+    def __init__(self):
+        self._table = "prices"
+
+    def _create_table(self, conn: sqlite3.Connection) -> None:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""CREATE TABLE {self._table} """
+            '("Date" DATE, "security_id" TEXT, "close" REAL)'
+        )
+        conn.commit()
+
+    def create_index(self, conn: sqlite3.Connection) -> None:
+        """
+        Covering index, nav joins never touch the table itself
+        """
+        cursor = conn.cursor()
+        cursor.execute(
+            f"CREATE INDEX {self._table}_idx ON {self._table} "
+            "(security_id, Date, close)"
+        )
+
+    def get_query(self, date: datetime.datetime) -> str:
+        return (
+            f"SELECT * FROM {self._table} "
+            f"WHERE Date = '{time.convert_date_to_strf(date)}'"
+        )
+
+    def create_table_rows(
+        self, row: tuple[str, str, float]
+    ) -> inf_row.PriceRow:
+        return inf_row.PriceRow(*row)
+
+    def insert_prices(
+        self,
+        conn: sqlite3.Connection,
+        rows: list[tuple[str, str, float]],
+        commit: bool = True,
+    ) -> None:
+        """
+        Bulk insert (Date, security_id, close) tuples
+        """
+        self.insert_tuples(conn, self.columns, rows, commit)
+
+    def delete_securities(
+        self, conn: sqlite3.Connection, isins: typing.Iterable[str]
+    ) -> None:
+        """
+        Delete the closes of isins, committed by the caller
+        """
+        cursor = conn.cursor()
+        cursor.executemany(
+            f"DELETE FROM {self._table} WHERE security_id = ?",
+            [(isin,) for isin in isins],
+        )
+
+    def nav_select_query(
+        self, pft_table: str, where: str = "", having: str = ""
+    ) -> str:
+        """
+        Values holdings x prices grouped by date
+        A missing close is looked up upto 5 days forward, same as
+        DatabaseCSV.read
+        """
+        return (
+            f"SELECT p.Date, SUM(p.quantity * {self.__close_expr()}) AS nav "
+            f"FROM {pft_table} p {where} GROUP BY p.Date {having} "
+            "ORDER BY p.Date"
+        )
+
+    def holdings_select_query(self, pft_table: str, where: str = "") -> str:
+        """
+        Every holding with its close, ordered by Date
+        """
+        return (
+            "SELECT p.Date, p.ticker, p.isin, p.quantity, "
+            f"{self.__close_expr()} AS close FROM {pft_table} p {where} "
+            "ORDER BY p.Date, p.rowid"
+        )
+
+    def __close_expr(self) -> str:
+        """
+        Close of holding p, a missing close is looked up upto 5 days
+        forward
+        """
+        return (
+            f"(SELECT pr.close FROM {self._table} pr "
+            "WHERE pr.security_id = p.isin AND pr.Date >= p.Date "
+            "AND pr.Date <= datetime(p.Date, '+5 days') "
+            "ORDER BY pr.Date LIMIT 1)"
+        )
+
+    def missing_prices_query(self, pft_table: str) -> str:
+        """
+        Holdings that can not be valued using the prices table
+        """
+        return (
+            f"SELECT p.Date, p.ticker, p.isin FROM {pft_table} p "
+            f"WHERE NOT EXISTS (SELECT 1 FROM {self._table} pr "
+            "WHERE pr.security_id = p.isin AND pr.Date >= p.Date "
+            "AND pr.Date <= datetime(p.Date, '+5 days'))"
+        )
+
+
+class Positions(Table):
+    """
+    Per security value, weight and pnl of every holding, one row per
+    (Date, isin): the coordinate form of the date x security matrix
+    """
+
+    columns = (
+        "Date",
+        "ticker",
+        "isin",
+        "quantity",
+        "close",
+        "value",
+        "weight",
+        "pnl",
+    )
+
+    def __init__(self):
+        self._table = "portfolio_positions"
+
+    def _create_table(self, conn: sqlite3.Connection) -> None:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""CREATE TABLE {self._table} """
+            '("Date" DATE, "ticker" TEXT, "isin" TEXT, "quantity" REAL, '
+            '"close" REAL, "value" REAL, "weight" REAL, "pnl" REAL)'
+        )
+        conn.commit()
+
+    def get_query(self, date: datetime.datetime) -> str:
+        return (
+            f"SELECT * FROM {self._table} "
+            f"WHERE Date = '{time.convert_date_to_strf(date)}'"
+        )
+
+    def create_table_rows(self, row: tuple) -> inf_row.PositionRow:
+        return inf_row.PositionRow(*row)
+
+
+class TWR(Table):
+    """
+    Time weighted return prefix sums of nav series (portfolio_nav,
+    {ticker}_index_nav): the cash flow adjusted daily log return and its
+    running sum
+    """
+
+    columns = ("Date", "series", "log_return", "cum_log_return")
+
+    def __init__(self):
+        self._table = "twr_index"
+
+    def _create_table(self, conn: sqlite3.Connection) -> None:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""CREATE TABLE {self._table} """
+            '("Date" DATE, "series" TEXT, "log_return" REAL, '
+            '"cum_log_return" REAL)'
+        )
+        conn.commit()
+
+    def create_index(self, conn: sqlite3.Connection) -> None:
+        """
+        Covering index, window lookups never touch the table itself
+        """
+        cursor = conn.cursor()
+        cursor.execute(
+            f"CREATE INDEX {self._table}_idx ON {self._table} "
+            "(series, Date, cum_log_return)"
+        )
+
+    def get_query(self, date: datetime.datetime) -> str:
+        return (
+            f"SELECT * FROM {self._table} "
+            f"WHERE Date = '{time.convert_date_to_strf(date)}'"
+        )
+
+    def create_table_rows(self, row: tuple) -> inf_row.TWRRow:
+        return inf_row.TWRRow(*row)
+
+    def window_expr(self) -> str:
+        """
+        Sql expression of the time weighted return of a series between two
+        dates, takes (series, end, series, start) parameters
+        Each date resolves to the last row on or before it, 0 before the
+        series starts
+        """
+        cum = (
+            f"SELECT cum_log_return FROM {self._table} WHERE series = ? "
+            "AND Date <= ? ORDER BY Date DESC LIMIT 1"
+        )
+        return f"exp(COALESCE(({cum}), 0) - COALESCE(({cum}), 0)) - 1"
+
+
+class RelativeRisk(Table):
+    """
+    Rolling beta, correlation, tracking error and information ratio of the
+    portfolio against a benchmark ticker, Date is the last day of the
+    window
+    """
+
+    columns = (
+        "Date",
+        "benchmark",
+        "window",
+        "beta",
+        "correlation",
+        "tracking_error",
+        "information_ratio",
+    )
+
+    def __init__(self):
+        self._table = "relative_risk"
+
+    def _create_table(self, conn: sqlite3.Connection) -> None:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""CREATE TABLE {self._table} """
+            '("Date" DATE, "benchmark" TEXT, "window" INTEGER, '
+            '"beta" REAL, "correlation" REAL, "tracking_error" REAL, '
+            '"information_ratio" REAL)'
+        )
+        conn.commit()
+
+    def create_index(self, conn: sqlite3.Connection) -> None:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"CREATE INDEX {self._table}_idx ON {self._table} "
+            '(benchmark, "window", Date)'
+        )
+
+    def get_query(self, date: datetime.datetime) -> str:
+        return (
+            f"SELECT * FROM {self._table} "
+            f"WHERE Date = '{time.convert_date_to_strf(date)}'"
+        )
+
+    def create_table_rows(self, row: tuple) -> inf_row.RelativeRiskRow:
+        return inf_row.RelativeRiskRow(*row)
+
+
+class XIRR(Table):
+    """
+    Money weighted return of a nav series over a trailing window of
+    calendar days (0 since the first cash flow), Date is the last day of
+    the window
+    """
+
+    columns = ("Date", "series", "window", "xirr")
+
+    def __init__(self):
+        self._table = "xirr"
+
+    def _create_table(self, conn: sqlite3.Connection) -> None:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""CREATE TABLE {self._table} """
+            '("Date" DATE, "series" TEXT, "window" INTEGER, "xirr" REAL)'
+        )
+        conn.commit()
+
+    def get_query(self, date: datetime.datetime) -> str:
+        return (
+            f"SELECT * FROM {self._table} "
+            f"WHERE Date = '{time.convert_date_to_strf(date)}'"
+        )
+
+    def create_table_rows(self, row: tuple) -> inf_row.XIRRRow:
+        return inf_row.XIRRRow(*row)
+
+
+class MonteCarloBands(Table):
+    """
+    Percentile bands of the projected nav of the latest holdings, Date is
+    the snapshot projected from, horizon the number of days after it
+    """
+
+    columns = ("Date", "horizon", "p05", "p25", "p50", "p75", "p95")
+
+    def __init__(self):
+        self._table = "montecarlo_bands"
+
+    def _create_table(self, conn: sqlite3.Connection) -> None:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""CREATE TABLE {self._table} """
+            '("Date" DATE, "horizon" INTEGER, "p05" REAL, "p25" REAL, '
+            '"p50" REAL, "p75" REAL, "p95" REAL)'
+        )
+        conn.commit()
+
+    def get_query(self, date: datetime.datetime) -> str:
+        return (
+            f"SELECT * FROM {self._table} "
+            f"WHERE Date = '{time.convert_date_to_strf(date)}'"
+        )
+
+    def create_table_rows(self, row: tuple) -> inf_row.MonteCarloBandRow:
+        return inf_row.MonteCarloBandRow(*row)
+
+
+class MonteCarloRisk(Table):
+    """
+    Value at risk and conditional value at risk (positive losses) of the
+    latest holdings over a horizon, at a confidence level
+    """
+
+    columns = ("Date", "horizon", "confidence", "var", "cvar")
+
+    def __init__(self):
+        self._table = "montecarlo_risk"
+
+    def _create_table(self, conn: sqlite3.Connection) -> None:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""CREATE TABLE {self._table} """
+            '("Date" DATE, "horizon" INTEGER, "confidence" REAL, '
+            '"var" REAL, "cvar" REAL)'
+        )
+        conn.commit()
+
+    def get_query(self, date: datetime.datetime) -> str:
+        return (
+            f"SELECT * FROM {self._table} "
+            f"WHERE Date = '{time.convert_date_to_strf(date)}'"
+        )
+
+    def create_table_rows(self, row: tuple) -> inf_row.MonteCarloRiskRow:
+        return inf_row.MonteCarloRiskRow(*row)
+
+
+class OptimalWeights(Table):
+    """
+    Current, long only min variance and max sharpe weights of the latest
+    holdings, Date is the snapshot they are computed for
+    """
+
+    columns = (
+        "Date",
+        "ticker",
+        "isin",
+        "weight",
+        "min_variance",
+        "max_sharpe",
+    )
+
+    def __init__(self):
+        self._table = "optimal_weights"
+
+    def _create_table(self, conn: sqlite3.Connection) -> None:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""CREATE TABLE {self._table} """
+            '("Date" DATE, "ticker" TEXT, "isin" TEXT, "weight" REAL, '
+            '"min_variance" REAL, "max_sharpe" REAL)'
+        )
+        conn.commit()
+
+    def get_query(self, date: datetime.datetime) -> str:
+        return (
+            f"SELECT * FROM {self._table} "
+            f"WHERE Date = '{time.convert_date_to_strf(date)}'"
+        )
+
+    def create_table_rows(self, row: tuple) -> inf_row.OptimalWeightRow:
+        return inf_row.OptimalWeightRow(*row)
+
+
+class ReturnWindow(Table):
+    """
+    Joint daily returns in the optimizer's window, one row per day a
+    return starts from, returns is a json list in holdings order
+    """
+
+    columns = ("Date", "holdings", "returns")
+
+    def __init__(self):
+        self._table = "return_window"
+
+    def _create_table(self, conn: sqlite3.Connection) -> None:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""CREATE TABLE IF NOT EXISTS {self._table} """
+            '("Date" DATE, "holdings" TEXT, "returns" TEXT, '
+            "PRIMARY KEY (holdings, Date))"
+        )
+        conn.commit()
+
+    def get_query(self, date: datetime.datetime) -> str:
+        return (
+            f"SELECT * FROM {self._table} "
+            f"WHERE Date = '{time.convert_date_to_strf(date)}'"
+        )
+
+    def create_table_rows(self, row: tuple) -> inf_row.ReturnWindowRow:
+        return inf_row.ReturnWindowRow(*row)
+
+    def ensure_table(self, conn: sqlite3.Connection) -> None:
+        self._create_table(conn)
+
+    def get_before(
+        self, conn: sqlite3.Connection, holdings: str, date: str
+    ) -> list[inf_row.ReturnWindowRow]:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"SELECT * FROM {self._table} "
+            "WHERE holdings = ? AND Date < ? ORDER BY Date",
+            (holdings, date),
+        )
+        return list(map(self.create_table_rows, cursor.fetchall()))
+
+    def count(self, conn: sqlite3.Connection, holdings: str) -> int:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"SELECT COUNT(*) FROM {self._table} WHERE holdings = ?",
+            (holdings,),
+        )
+        return cursor.fetchone()[0]
+
+    def delete_before(
+        self, conn: sqlite3.Connection, holdings: str, date: str
+    ) -> None:
+        """
+        Committed by the caller with the moments the rows are evicted from
+        """
+        cursor = conn.cursor()
+        cursor.execute(
+            f"DELETE FROM {self._table} WHERE holdings = ? AND Date < ?",
+            (holdings, date),
+        )
+
+
+class MomentState(Table):
+    """
+    Running moments of the optimizer's return window, one row per holdings
+    set (comma joined isins): the last price day read, its closes and the
+    count, sum and cross product of the window's returns as json
+    """
+
+    columns = ("Date", "holdings", "count", "sums", "cross", "last_closes")
+
+    def __init__(self):
+        self._table = "moment_state"
+
+    def _create_table(self, conn: sqlite3.Connection) -> None:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""CREATE TABLE IF NOT EXISTS {self._table} """
+            '("Date" DATE, "holdings" TEXT PRIMARY KEY, "count" INTEGER, '
+            '"sums" TEXT, "cross" TEXT, "last_closes" TEXT)'
+        )
+        conn.commit()
+
+    def get_query(self, date: datetime.datetime) -> str:
+        return (
+            f"SELECT * FROM {self._table} "
+            f"WHERE Date = '{time.convert_date_to_strf(date)}'"
+        )
+
+    def create_table_rows(self, row: tuple) -> inf_row.MomentStateRow:
+        return inf_row.MomentStateRow(*row)
+
+    def ensure_table(self, conn: sqlite3.Connection) -> None:
+        self._create_table(conn)
+
+    def get_holdings(
+        self, conn: sqlite3.Connection, holdings: str
+    ) -> typing.Optional[inf_row.MomentStateRow]:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"SELECT * FROM {self._table} WHERE holdings = ?", (holdings,)
+        )
+        row = cursor.fetchone()
+        return self.create_table_rows(row) if row is not None else None
+
+    def delete_all(
+        self, conn: sqlite3.Connection, window: ReturnWindow
+    ) -> None:
+        """
+        Drop the window and moments of every holdings set, committed by
+        the caller with the rebuilt ones
+        """
+        cursor = conn.cursor()
+        for table in (window, self):
+            cursor.execute(f"DELETE FROM {table.name}")
+
+
+class RealizedGains(Table):
+    """
+    FIFO closed parts of tax lots, Date is the sell date and lot the
+    number of the buy that opened the lot (see lots.py)
+    """
+
+    columns = (
+        "Date",
+        "ticker",
+        "isin",
+        "lot",
+        "buy_date",
+        "quantity",
+        "buy_price",
+        "sell_price",
+        "gain",
+        "holding_days",
+        "term",
+    )
+
+    def __init__(self):
+        self._table = "realized_gains"
+
+    def _create_table(self, conn: sqlite3.Connection) -> None:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""CREATE TABLE {self._table} """
+            '("Date" DATE, "ticker" TEXT, "isin" TEXT, "lot" INTEGER, '
+            '"buy_date" DATE, "quantity" REAL, "buy_price" REAL, '
+            '"sell_price" REAL, "gain" REAL, "holding_days" INTEGER, '
+            '"term" TEXT)'
+        )
+        conn.commit()
+
+    def get_query(self, date: datetime.datetime) -> str:
+        return (
+            f"SELECT * FROM {self._table} "
+            f"WHERE Date = '{time.convert_date_to_strf(date)}'"
+        )
+
+    def create_table_rows(self, row: tuple) -> inf_row.RealizedGainRow:
+        return inf_row.RealizedGainRow(*row)
+
+
+class OpenLots(Table):
+    """
+    Open parts of tax lots valued at the last close, Date is the buy date
+    """
+
+    columns = (
+        "Date",
+        "ticker",
+        "isin",
+        "lot",
+        "quantity",
+        "buy_price",
+        "close_date",
+        "close",
+        "unrealized",
+        "holding_days",
+        "term",
+    )
+
+    def __init__(self):
+        self._table = "open_lots"
+
+    def _create_table(self, conn: sqlite3.Connection) -> None:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""CREATE TABLE {self._table} """
+            '("Date" DATE, "ticker" TEXT, "isin" TEXT, "lot" INTEGER, '
+            '"quantity" REAL, "buy_price" REAL, "close_date" DATE, '
+            '"close" REAL, "unrealized" REAL, "holding_days" INTEGER, '
+            '"term" TEXT)'
+        )
+        conn.commit()
+
+    def get_query(self, date: datetime.datetime) -> str:
+        return (
+            f"SELECT * FROM {self._table} "
+            f"WHERE Date = '{time.convert_date_to_strf(date)}'"
+        )
+
+    def create_table_rows(self, row: tuple) -> inf_row.OpenLotRow:
+        return inf_row.OpenLotRow(*row)
+
+
+class NAVRollup(Table):
+    """
+    Rollups of nav series (portfolio_nav, {ticker}_index_nav)
+    Date is the first day of the period
+    """
+
+    columns = (
+        "Date",
+        "series",
+        "resolution",
+        "last_date",
+        "open",
+        "close",
+        "min",
+        "max",
+        "net_flow",
+    )
+
+    def __init__(self):
+        self._table = "nav_rollup"
+
+    def _create_table(self, conn: sqlite3.Connection) -> None:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""CREATE TABLE IF NOT EXISTS {self._table} """
+            '("Date" DATE, "series" TEXT, "resolution" TEXT, '
+            '"last_date" DATE, "open" REAL, "close" REAL, "min" REAL, '
+            '"max" REAL, "net_flow" REAL)'
+        )
+        conn.commit()
+
+    def create_index(self, conn: sqlite3.Connection) -> None:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {self._table}_idx ON {self._table} "
+            "(series, resolution, Date)"
+        )
+
+    def get_query(self, date: datetime.datetime) -> str:
+        return (
+            f"SELECT * FROM {self._table} "
+            f"WHERE Date = '{time.convert_date_to_strf(date)}'"
+        )
+
+    def create_table_rows(self, row: tuple) -> inf_row.NAVRollupRow:
+        return inf_row.NAVRollupRow(*row)
+
+    def ensure_table(self, conn: sqlite3.Connection) -> None:
+        """
+        Create the table only if it does not exist (incremental updates)
+        """
+        self._create_table(conn)
+        self.create_index(conn)
+
+    def get_last_period(
+        self, conn: sqlite3.Connection, series: str, resolution: str
+    ) -> typing.Optional[str]:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"SELECT MAX(Date) FROM {self._table} "
+            "WHERE series = ? AND resolution = ?",
+            (series, resolution),
+        )
+        return cursor.fetchone()[0]
+
+    def delete_from(
+        self, conn: sqlite3.Connection, series: str, resolution: str, date: str
+    ) -> None:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"DELETE FROM {self._table} "
+            "WHERE series = ? AND resolution = ? AND Date >= ?",
+            (series, resolution, date),
+        )
+
+
+class Underwater(Table):
+    """
+    Underwater curve of cash flow adjusted nav series: depth below the
+    running peak on every day (<= 0)
+    """
+
+    columns = ("Date", "series", "depth")
+
+    def __init__(self):
+        self._table = "underwater"
+
+    def _create_table(self, conn: sqlite3.Connection) -> None:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""CREATE TABLE IF NOT EXISTS {self._table} """
+            '("Date" DATE, "series" TEXT, "depth" REAL)'
+        )
+        conn.commit()
+
+    def create_index(self, conn: sqlite3.Connection) -> None:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {self._table}_idx ON {self._table} "
+            "(series, Date)"
+        )
+
+    def get_query(self, date: datetime.datetime) -> str:
+        return (
+            f"SELECT * FROM {self._table} "
+            f"WHERE Date = '{time.convert_date_to_strf(date)}'"
+        )
+
+    def create_table_rows(self, row: tuple) -> inf_row.UnderwaterRow:
+        return inf_row.UnderwaterRow(*row)
+
+    def ensure_table(self, conn: sqlite3.Connection) -> None:
+        self._create_table(conn)
+        self.create_index(conn)
+
+
+class DrawdownEpisodes(Table):
+    """
+    Drawdown episodes of nav series, Date is the peak the episode starts
+    from, recovery is NULL while the episode is still open
+    """
+
+    columns = ("Date", "series", "trough", "recovery", "depth")
+
+    def __init__(self):
+        self._table = "drawdown_episodes"
+
+    def _create_table(self, conn: sqlite3.Connection) -> None:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""CREATE TABLE IF NOT EXISTS {self._table} """
+            '("Date" DATE, "series" TEXT, "trough" DATE, "recovery" DATE, '
+            '"depth" REAL)'
+        )
+        conn.commit()
+
+    def create_index(self, conn: sqlite3.Connection) -> None:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {self._table}_idx ON {self._table} "
+            "(series, Date)"
+        )
+
+    def get_query(self, date: datetime.datetime) -> str:
+        return (
+            f"SELECT * FROM {self._table} "
+            f"WHERE Date = '{time.convert_date_to_strf(date)}'"
+        )
+
+    def create_table_rows(self, row: tuple) -> inf_row.DrawdownEpisodeRow:
+        return inf_row.DrawdownEpisodeRow(*row)
+
+    def ensure_table(self, conn: sqlite3.Connection) -> None:
+        self._create_table(conn)
+        self.create_index(conn)
+
+    def delete_open(self, conn: sqlite3.Connection, series: str) -> None:
+        """
+        Drop the open episode of series, an update recomputes it
+        """
+        cursor = conn.cursor()
+        cursor.execute(
+            f"DELETE FROM {self._table} "
+            "WHERE series = ? AND recovery IS NULL",
+            (series,),
+        )
+
+
+class DrawdownState(Table):
+    """
+    Running peak state of every nav series, one row per series: the last
+    day processed and the log wealth of its peak and of the trough since
+    """
+
+    columns = (
+        "Date",
+        "series",
+        "cum_log_return",
+        "peak",
+        "peak_date",
+        "trough",
+        "trough_date",
+    )
+
+    def __init__(self):
+        self._table = "drawdown_state"
+
+    def _create_table(self, conn: sqlite3.Connection) -> None:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""CREATE TABLE IF NOT EXISTS {self._table} """
+            '("Date" DATE, "series" TEXT PRIMARY KEY, '
+            '"cum_log_return" REAL, "peak" REAL, "peak_date" DATE, '
+            '"trough" REAL, "trough_date" DATE)'
+        )
+        conn.commit()
+
+    def get_query(self, date: datetime.datetime) -> str:
+        return (
+            f"SELECT * FROM {self._table} "
+            f"WHERE Date = '{time.convert_date_to_strf(date)}'"
+        )
+
+    def create_table_rows(self, row: tuple) -> inf_row.DrawdownStateRow:
+        return inf_row.DrawdownStateRow(*row)
+
+    def ensure_table(self, conn: sqlite3.Connection) -> None:
+        self._create_table(conn)
+
+    def get_series(
+        self, conn: sqlite3.Connection, series: str
+    ) -> typing.Optional[inf_row.DrawdownStateRow]:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"SELECT * FROM {self._table} WHERE series = ?", (series,)
+        )
+        row = cursor.fetchone()
+        return self.create_table_rows(row) if row is not None else None
+
+    def delete_series(
+        self, conn: sqlite3.Connection, tables: list[Table], series: str
+    ) -> None:
+        """
+        Drop every stored row of series from tables (and the state)
+        """
+        cursor = conn.cursor()
+        for table in [*tables, self]:
+            cursor.execute(
+                f"DELETE FROM {table.name} WHERE series = ?", (series,)
+            )
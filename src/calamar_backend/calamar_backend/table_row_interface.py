@@ -6,17 +6,36 @@ Utility Table Row Classes
     - IndexRow
     - IndexNavRow
     - PortfolioNavRow
+    - PriceRow
+    - PositionRow
+    - TWRRow
+    - RelativeRiskRow
+    - XIRRRow
+    - MonteCarloBandRow
+    - MonteCarloRiskRow
+    - OptimalWeightRow
+    - ReturnWindowRow
+    - MomentStateRow
+    - RealizedGainRow
+    - OpenLotRow
+    - NAVRollupRow
+    - UnderwaterRow
+    - DrawdownEpisodeRow
+    - DrawdownStateRow
+    - BuildCheckpointRow
+    - WriteVersionRow
 """
 import abc
-import pandas as pd
+import json
 import typing
 import sqlite3
-import datetime
 
 import calamar_backend.time as time
 import calamar_backend.errors as er
-import calamar_backend.table_interface as inf_tb
-from calamar_backend.database_csv import db_csv
+from calamar_backend.database_csv import get_db_csv
+
+if typing.TYPE_CHECKING:
+    import pandas as pd
 
 
 class Row(abc.ABC):
@@ -58,7 +77,7 @@ class BankStatementRow(Row):
             return (False, self.debit)
 
     @classmethod
-    def is_valid_bank_statement(cls, row: pd.Series) -> bool:
+    def is_valid_bank_statement(cls, row: "pd.Series") -> bool:
         """
         Row or pd.Series structure
         {
@@ -143,6 +162,17 @@ class IndexNAVRow(Row):
         self.nav: float = nav
         self.units: float = units
 
+    def to_tuple(self) -> tuple[str, str, float, float, float, float, float]:
+        return (
+            time.convert_date_to_strf(self.date),
+            self.ticker,
+            self.day_payin,
+            self.day_payout,
+            self.amount_invested,
+            self.units,
+            self.nav,
+        )
+
     def insert_query(self, table: str) -> str:
         return (
             f"INSERT INTO {table} (Date, ticker, day_payin, "
@@ -177,8 +207,10 @@ class IndexNAVRow(Row):
         Warning: The function should only be called only after all
         bnk transactions have been added for the day
         """
+        # imported here, table_interface imports this module
+        import calamar_backend.table_interface as inf_tb
+
         # get index date price
-        day_index_price = 0
         index_db = inf_tb.Index(self.ticker)
         rows: typing.Sequence[IndexRow] = index_db.get(conn, self.date)
 
@@ -187,6 +219,12 @@ class IndexNAVRow(Row):
         else:
             day_index_price = rows[-1].close
 
+        self.calculate_index_nav_from_close(day_index_price)
+
+    def calculate_index_nav_from_close(self, day_index_price: float) -> None:
+        """
+        Update the current index nav using an already known day Close
+        """
         day_in_n_out = self.day_payin - self.day_payout
 
         # calculate the amount added or removed that day
@@ -262,14 +300,453 @@ class PortfolioNAVRow(Row):
         isin = portfolio_sec.isin
         ticker = portfolio_sec.ticker
 
-        yf_pd_series = db_csv.read(isin, self.date, ticker)[-1]
+        price = get_db_csv().read_price(isin, self.date, ticker)
+        self.nav += price * portfolio_sec.quantity
 
-        if isinstance(yf_pd_series, pd.Series):
-            price = yf_pd_series["Close"]
-            if isinstance(price, float):
-                self.nav += price * portfolio_sec.quantity
-        else:
-            raise Exception(
-                f"{str(datetime.datetime.now())}: PortfolioNAV."
-                "add_to_portfolio_nav"
-            )
+
+class PriceRow(Row):
+    def __init__(self, date: str, security_id: str, close: float):
+        self.date = time.convert_date_strf_to_strp(date)
+        self.security_id = security_id
+        self.close = close
+
+    def insert_query(self, table: str) -> str:
+        return (
+            f"INSERT INTO {table} (Date, security_id, close) VALUES "
+            f"('{time.convert_date_to_strf(self.date)}', "
+            f"'{self.security_id}', {self.close})"
+        )
+
+    def __str__(self):
+        return (
+            f"(Date:{self.date} security_id:{self.security_id} "
+            f"close:{self.close})"
+        )
+
+
+class PositionRow(Row):
+    def __init__(
+        self,
+        date: str,
+        ticker: str,
+        isin: str,
+        quantity: float,
+        close: float,
+        value: float,
+        weight: float,
+        pnl: float,
+    ):
+        self.date = time.convert_date_strf_to_strp(date)
+        self.ticker = ticker
+        self.isin = isin
+        self.quantity = quantity
+        self.close = close
+        self.value = value
+        self.weight = weight
+        self.pnl = pnl
+
+    def insert_query(self, table: str) -> str:
+        raise NotImplementedError
+
+    def __str__(self):
+        return (
+            f"(Date:{self.date} ticker:{self.ticker} value:{self.value} "
+            f"weight:{self.weight} pnl:{self.pnl})"
+        )
+
+
+class TWRRow(Row):
+    def __init__(
+        self, date: str, series: str, log_return: float, cum_log_return: float
+    ):
+        self.date = time.convert_date_strf_to_strp(date)
+        self.series = series
+        self.log_return = log_return
+        self.cum_log_return = cum_log_return
+
+    def insert_query(self, table: str) -> str:
+        raise NotImplementedError
+
+    def __str__(self):
+        return (
+            f"(Date:{self.date} series:{self.series} "
+            f"cum_log_return:{self.cum_log_return})"
+        )
+
+
+class RelativeRiskRow(Row):
+    def __init__(
+        self,
+        date: str,
+        benchmark: str,
+        window: int,
+        beta: float,
+        correlation: float,
+        tracking_error: float,
+        information_ratio: float,
+    ):
+        self.date = time.convert_date_strf_to_strp(date)
+        self.benchmark = benchmark
+        self.window = window
+        self.beta = beta
+        self.correlation = correlation
+        self.tracking_error = tracking_error
+        self.information_ratio = information_ratio
+
+    def insert_query(self, table: str) -> str:
+        raise NotImplementedError
+
+    def __str__(self):
+        return (
+            f"(Date:{self.date} benchmark:{self.benchmark} "
+            f"window:{self.window} beta:{self.beta})"
+        )
+
+
+class XIRRRow(Row):
+    def __init__(
+        self,
+        date: str,
+        series: str,
+        window: int,
+        xirr: typing.Optional[float],
+    ):
+        self.date = time.convert_date_strf_to_strp(date)
+        self.series = series
+        self.window = window
+        self.xirr = xirr
+
+    def insert_query(self, table: str) -> str:
+        raise NotImplementedError
+
+    def __str__(self):
+        return (
+            f"(Date:{self.date} series:{self.series} window:{self.window} "
+            f"xirr:{self.xirr})"
+        )
+
+
+class MonteCarloBandRow(Row):
+    def __init__(
+        self,
+        date: str,
+        horizon: int,
+        p05: float,
+        p25: float,
+        p50: float,
+        p75: float,
+        p95: float,
+    ):
+        self.date = time.convert_date_strf_to_strp(date)
+        self.horizon = horizon
+        self.p05 = p05
+        self.p25 = p25
+        self.p50 = p50
+        self.p75 = p75
+        self.p95 = p95
+
+    def insert_query(self, table: str) -> str:
+        raise NotImplementedError
+
+    def __str__(self):
+        return (
+            f"(Date:{self.date} horizon:{self.horizon} p05:{self.p05} "
+            f"p50:{self.p50} p95:{self.p95})"
+        )
+
+
+class MonteCarloRiskRow(Row):
+    def __init__(
+        self,
+        date: str,
+        horizon: int,
+        confidence: float,
+        var: float,
+        cvar: float,
+    ):
+        self.date = time.convert_date_strf_to_strp(date)
+        self.horizon = horizon
+        self.confidence = confidence
+        self.var = var
+        self.cvar = cvar
+
+    def insert_query(self, table: str) -> str:
+        raise NotImplementedError
+
+    def __str__(self):
+        return (
+            f"(Date:{self.date} horizon:{self.horizon} "
+            f"confidence:{self.confidence} var:{self.var} cvar:{self.cvar})"
+        )
+
+
+class OptimalWeightRow(Row):
+    def __init__(
+        self,
+        date: str,
+        ticker: str,
+        isin: str,
+        weight: float,
+        min_variance: float,
+        max_sharpe: typing.Optional[float],
+    ):
+        self.date = time.convert_date_strf_to_strp(date)
+        self.ticker = ticker
+        self.isin = isin
+        self.weight = weight
+        self.min_variance = min_variance
+        self.max_sharpe = max_sharpe
+
+    def insert_query(self, table: str) -> str:
+        raise NotImplementedError
+
+    def __str__(self):
+        return (
+            f"(Date:{self.date} ticker:{self.ticker} weight:{self.weight} "
+            f"min_variance:{self.min_variance} max_sharpe:{self.max_sharpe})"
+        )
+
+
+class ReturnWindowRow(Row):
+    def __init__(self, date: str, holdings: str, returns: str):
+        self.date = time.convert_date_strf_to_strp(date)
+        self.holdings = holdings
+        self.returns: list[float] = json.loads(returns)
+
+    def insert_query(self, table: str) -> str:
+        raise NotImplementedError
+
+    def __str__(self):
+        return f"(Date:{self.date} holdings:{self.holdings})"
+
+
+class MomentStateRow(Row):
+    def __init__(
+        self,
+        date: str,
+        holdings: str,
+        count: int,
+        sums: str,
+        cross: str,
+        last_closes: str,
+    ):
+        self.date = time.convert_date_strf_to_strp(date)
+        self.holdings = holdings
+        self.count = count
+        self.sums: list[float] = json.loads(sums)
+        self.cross: list[list[float]] = json.loads(cross)
+        self.last_closes: list[float] = json.loads(last_closes)
+
+    def insert_query(self, table: str) -> str:
+        raise NotImplementedError
+
+    def __str__(self):
+        return (
+            f"(Date:{self.date} holdings:{self.holdings} count:{self.count})"
+        )
+
+
+class RealizedGainRow(Row):
+    def __init__(
+        self,
+        date: str,
+        ticker: str,
+        isin: str,
+        lot: int,
+        buy_date: str,
+        quantity: float,
+        buy_price: float,
+        sell_price: float,
+        gain: float,
+        holding_days: int,
+        term: str,
+    ):
+        self.date = time.convert_date_strf_to_strp(date)
+        self.ticker = ticker
+        self.isin = isin
+        self.lot = lot
+        self.buy_date = time.convert_date_strf_to_strp(buy_date)
+        self.quantity = quantity
+        self.buy_price = buy_price
+        self.sell_price = sell_price
+        self.gain = gain
+        self.holding_days = holding_days
+        self.term = term
+
+    def insert_query(self, table: str) -> str:
+        raise NotImplementedError
+
+    def __str__(self):
+        return (
+            f"(Date:{self.date} ticker:{self.ticker} lot:{self.lot} "
+            f"q:{self.quantity} gain:{self.gain} term:{self.term})"
+        )
+
+
+class OpenLotRow(Row):
+    def __init__(
+        self,
+        date: str,
+        ticker: str,
+        isin: str,
+        lot: int,
+        quantity: float,
+        buy_price: float,
+        close_date: str,
+        close: typing.Optional[float],
+        unrealized: typing.Optional[float],
+        holding_days: int,
+        term: str,
+    ):
+        self.date = time.convert_date_strf_to_strp(date)
+        self.ticker = ticker
+        self.isin = isin
+        self.lot = lot
+        self.quantity = quantity
+        self.buy_price = buy_price
+        self.close_date = time.convert_date_strf_to_strp(close_date)
+        self.close = close
+        self.unrealized = unrealized
+        self.holding_days = holding_days
+        self.term = term
+
+    def insert_query(self, table: str) -> str:
+        raise NotImplementedError
+
+    def __str__(self):
+        return (
+            f"(Date:{self.date} ticker:{self.ticker} lot:{self.lot} "
+            f"q:{self.quantity} unrealized:{self.unrealized} "
+            f"term:{self.term})"
+        )
+
+
+class NAVRollupRow(Row):
+    def __init__(
+        self,
+        date: str,
+        series: str,
+        resolution: str,
+        last_date: str,
+        open_: float,
+        close: float,
+        min_: float,
+        max_: float,
+        net_flow: float,
+    ):
+        self.date = time.convert_date_strf_to_strp(date)
+        self.series = series
+        self.resolution = resolution
+        self.last_date = time.convert_date_strf_to_strp(last_date)
+        self.open = open_
+        self.close = close
+        self.min = min_
+        self.max = max_
+        self.net_flow = net_flow
+
+    def insert_query(self, table: str) -> str:
+        raise NotImplementedError
+
+    def __str__(self):
+        return (
+            f"(Date:{self.date} series:{self.series} "
+            f"resolution:{self.resolution} open:{self.open} "
+            f"close:{self.close} net_flow:{self.net_flow})"
+        )
+
+
+class UnderwaterRow(Row):
+    def __init__(self, date: str, series: str, depth: float):
+        self.date = time.convert_date_strf_to_strp(date)
+        self.series = series
+        self.depth = depth
+
+    def insert_query(self, table: str) -> str:
+        raise NotImplementedError
+
+    def __str__(self):
+        return f"(Date:{self.date} series:{self.series} depth:{self.depth})"
+
+
+class DrawdownEpisodeRow(Row):
+    def __init__(
+        self,
+        date: str,
+        series: str,
+        trough: str,
+        recovery: typing.Optional[str],
+        depth: float,
+    ):
+        self.date = time.convert_date_strf_to_strp(date)
+        self.series = series
+        self.trough = time.convert_date_strf_to_strp(trough)
+        self.recovery = (
+            time.convert_date_strf_to_strp(recovery)
+            if recovery is not None
+            else None
+        )
+        self.depth = depth
+
+    def insert_query(self, table: str) -> str:
+        raise NotImplementedError
+
+    def __str__(self):
+        return (
+            f"(Date:{self.date} series:{self.series} trough:{self.trough} "
+            f"recovery:{self.recovery} depth:{self.depth})"
+        )
+
+
+class DrawdownStateRow(Row):
+    def __init__(
+        self,
+        date: str,
+        series: str,
+        cum_log_return: float,
+        peak: float,
+        peak_date: str,
+        trough: float,
+        trough_date: str,
+    ):
+        self.date = time.convert_date_strf_to_strp(date)
+        self.series = series
+        self.cum_log_return = cum_log_return
+        self.peak = peak
+        self.peak_date = time.convert_date_strf_to_strp(peak_date)
+        self.trough = trough
+        self.trough_date = time.convert_date_strf_to_strp(trough_date)
+
+    def insert_query(self, table: str) -> str:
+        raise NotImplementedError
+
+    def __str__(self):
+        return (
+            f"(Date:{self.date} series:{self.series} peak:{self.peak_date} "
+            f"trough:{self.trough_date})"
+        )
+
+
+class BuildCheckpointRow(Row):
+    def __init__(self, date: str, tbl: str, key: str):
+        self.date = time.convert_date_strf_to_strp(date)
+        self.tbl = tbl
+        self.key = key
+
+    def insert_query(self, table: str) -> str:
+        raise NotImplementedError
+
+    def __str__(self):
+        return f"(Date:{self.date} tbl:{self.tbl} key:{self.key})"
+
+
+class WriteVersionRow(Row):
+    def __init__(self, date: str, tbl: str, version: int):
+        self.date = time.convert_date_strf_to_strp(date)
+        self.tbl = tbl
+        self.version = version
+
+    def insert_query(self, table: str) -> str:
+        raise NotImplementedError
+
+    def __str__(self):
+        return f"(Date:{self.date} tbl:{self.tbl} version:{self.version})"
@@ -3,9 +3,12 @@
 """
 
 import datetime
-import pandas as pd
+import numpy as np
 import typing
 
+if typing.TYPE_CHECKING:
+    import pandas as pd
+
 DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
 YF_DATE_FORMAT = "%Y-%m-%d"
 
@@ -30,6 +33,13 @@ def convert_date_to_strf_yf(date: datetime.datetime):
     return date.strftime(YF_DATE_FORMAT)
 
 
+def convert_datetime64_to_strf(dates: np.ndarray) -> np.ndarray:
+    """
+    Vectorized DATE_FORMAT conversion of a datetime64 array
+    """
+    return np.char.replace(np.datetime_as_string(dates, unit="s"), "T", " ")
+
+
 def convert_yf_date_to_strf(row) -> str:
     """
     Utility function to convert yf date into Time class date format
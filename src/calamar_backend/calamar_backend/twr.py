@@ -0,0 +1,182 @@
+"""
+Time weighted returns
+    - cash flow adjusted daily log returns of every nav series and their
+      running sums (prefix sums), stored in the twr_index table
+    - the TWR of any window is exp(cum[end] - cum[start]) - 1: two lookups
+      whatever the window length
+    - excess return of a series over a benchmark for the same window
+
+    Series:
+    - portfolio_nav: market move of the holdings, from portfolio_positions
+        r[t] = sum pnl[t] / sum value[t - 1]
+      trades between snapshots do not count as returns
+    - {ticker}_index_nav: nav less the day's payin / payout
+        r[t] = (nav[t] - (day_payin[t] - day_payout[t])) / nav[t - 1] - 1
+"""
+import sqlite3
+import typing
+import numpy as np
+
+from calamar_backend.table_interface import TWR, Positions
+
+
+def cumulate(
+    dates: typing.Sequence[str], log_returns: np.ndarray, series: str
+) -> list[tuple[str, str, float, float]]:
+    """
+    Returns:
+        rows in TWR column order
+    """
+    cum = np.cumsum(log_returns)
+    return [
+        (dates[i], series, float(log_returns[i]), float(cum[i]))
+        for i in range(len(dates))
+    ]
+
+
+def nav_log_returns(navs: np.ndarray, flows: np.ndarray) -> np.ndarray:
+    """
+    navs, flows :parameter: date ordered nav and net cash flow of the day
+
+    Returns:
+        log return of every day, 0 on the first day and after a day
+        without a positive nav
+    """
+    log_returns = np.zeros(len(navs))
+    if len(navs) < 2:
+        return log_returns
+
+    prev = navs[:-1]
+    moved = navs[1:] - flows[1:]
+    valid = (prev > 0) & (moved > 0)
+    log_returns[1:][valid] = np.log(moved[valid] / prev[valid])
+    return log_returns
+
+
+def position_log_returns(
+    day_idx: np.ndarray, values: np.ndarray, pnls: np.ndarray, days: int
+) -> np.ndarray:
+    """
+    day_idx, values, pnls :parameter: portfolio_positions entries
+
+    Returns:
+        log return of every snapshot, 0 on the first one and after a
+        snapshot without holdings
+    """
+    value = np.bincount(day_idx, weights=values, minlength=days)
+    pnl = np.bincount(day_idx, weights=pnls, minlength=days)
+
+    log_returns = np.zeros(days)
+    if days < 2:
+        return log_returns
+
+    prev = value[:-1]
+    growth = np.divide(pnl[1:], prev, out=np.zeros(days - 1), where=prev > 0)
+    log_returns[1:] = np.log1p(np.maximum(growth, -1 + 1e-12))
+    return log_returns
+
+
+def portfolio_twr_rows(
+    conn: sqlite3.Connection,
+) -> list[tuple[str, str, float, float]]:
+    cursor = conn.cursor()
+    cursor.execute(
+        f"SELECT Date, value, pnl FROM {Positions().name} "
+        "ORDER BY Date, rowid"
+    )
+    rows = cursor.fetchall()
+    if len(rows) == 0:
+        return []
+
+    [dates, values, pnls] = zip(*rows)
+    [days, day_idx] = np.unique(np.array(dates), return_inverse=True)
+    log_returns = position_log_returns(
+        day_idx,
+        np.array(values, dtype="float64"),
+        np.array(pnls, dtype="float64"),
+        len(days),
+    )
+    return cumulate([str(day) for day in days], log_returns, "portfolio_nav")
+
+
+def index_twr_rows(
+    conn: sqlite3.Connection, series: str
+) -> list[tuple[str, str, float, float]]:
+    """
+    series :parameter: {ticker}_index_nav table
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+        f"SELECT Date, nav, day_payin - day_payout FROM {series} "
+        "ORDER BY Date, rowid"
+    )
+    rows = cursor.fetchall()
+    if len(rows) == 0:
+        return []
+
+    [dates, navs, flows] = zip(*rows)
+    log_returns = nav_log_returns(
+        np.array(navs, dtype="float64"), np.array(flows, dtype="float64")
+    )
+    return cumulate(dates, log_returns, series)
+
+
+class TWRIndex:
+    """
+    In memory twr_index: per series sorted dates and cumulative log returns
+    """
+
+    def __init__(self, series: dict[str, tuple[np.ndarray, np.ndarray]]):
+        self.series = series
+
+    @classmethod
+    def from_db(cls, conn: sqlite3.Connection) -> "TWRIndex":
+        cursor = conn.cursor()
+        cursor.execute(
+            f"SELECT series, Date, cum_log_return FROM {TWR().name} "
+            "ORDER BY series, Date"
+        )
+        grouped: dict[str, list[tuple[str, float]]] = {}
+        for [series, date, cum] in cursor.fetchall():
+            grouped.setdefault(series, []).append((date, cum))
+
+        return cls(
+            {
+                series: (
+                    np.array([row[0] for row in rows]),
+                    np.array([row[1] for row in rows], dtype="float64"),
+                )
+                for [series, rows] in grouped.items()
+            }
+        )
+
+    def __str__(self) -> str:
+        return f"(TWRIndex series:{sorted(self.series)})"
+
+    def __cum_at(self, series: str, date: str) -> float:
+        """
+        Cumulative log return of the last day on or before date, 0 before
+        the series starts
+        """
+        [dates, cum] = self.series[series]
+        pos = int(np.searchsorted(dates, date, "right")) - 1
+        return float(cum[pos]) if pos >= 0 else 0.0
+
+    def log_return(self, series: str, start: str, end: str) -> float:
+        """
+        start, end :parameter: DATE_FORMAT strings, the return is from the
+        close of start to the close of end
+        """
+        return self.__cum_at(series, end) - self.__cum_at(series, start)
+
+    def twr(self, series: str, start: str, end: str) -> float:
+        return float(np.expm1(self.log_return(series, start, end)))
+
+    def excess(
+        self, series: str, benchmark: str, start: str, end: str
+    ) -> float:
+        """
+        Returns:
+            twr of series less twr of benchmark over the same window
+        """
+        return self.twr(series, start, end) - self.twr(benchmark, start, end)
@@ -0,0 +1,284 @@
+"""
+Money weighted return (XIRR)
+    - annualised rate r solving sum(cash flow * (1 + r) ^ years to the end)
+      = 0, with payins to the account as outflows of the investor, payouts
+      as inflows and the nav on the end day as the last inflow
+    - cash flows are the dated payins and payouts of bank_statement, the
+      same flows are valued by the portfolio nav and every benchmark
+      index nav
+    - the payins are made to the trading account, not to the holdings:
+      the portfolio is valued as its nav plus the uninvested cash (payins
+      - payouts - buys + sells at the trade price upto the day, charges
+      are not in the trade report), so that cash waiting to be invested
+      is not counted as a loss; index navs invest every flow already
+    - trailing windows start with the nav of the last day on or before
+      the window start as an outflow, window 0 is since the first flow
+    - every series x window problem is padded into one (problems x flows)
+      array and solved together: newton on log(1 + r), falling back to
+      bisection of a bracketing interval when a step leaves it
+"""
+import sqlite3
+import typing
+import numpy as np
+
+import calamar_backend.time as time
+from calamar_backend.benchmarks import daily_net_flows
+from calamar_backend.table_interface import (
+    BankStatement,
+    IndexNAV,
+    PortfolioNAV,
+    TradeReport,
+)
+
+DAYS_PER_YEAR = 365.0
+# log(1 + r) bracket: -99.99% to +10000% a year
+LOWER = np.log(1e-4)
+UPPER = np.log(101.0)
+
+
+def solve_xirr(
+    amounts: np.ndarray,
+    years: np.ndarray,
+    tol: float = 1e-12,
+    max_iter: int = 200,
+) -> np.ndarray:
+    """
+    amounts :parameter: (problems x flows) cash flows, 0 for padding
+    years :parameter: (problems x flows) years from every flow to the end
+    of its problem (>= 0)
+
+    Returns:
+        (problems,) annual rates, NaN when the flows do not change sign
+        inside the bracket
+    """
+    scale = np.abs(amounts).max(axis=1, keepdims=True)
+    amounts = amounts / np.where(scale > 0, scale, 1.0)
+
+    def value(
+        x: np.ndarray, rows: slice | np.ndarray = slice(None)
+    ) -> tuple[np.ndarray, np.ndarray]:
+        # future value of the flows of rows at log rate x, its derivative
+        grown = amounts[rows] * np.exp(x[:, None] * years[rows])
+        return (grown.sum(axis=1), (grown * years[rows]).sum(axis=1))
+
+    count = len(amounts)
+    [f_lo, _] = value(np.full(count, LOWER))
+    [f_hi, _] = value(np.full(count, UPPER))
+    valid = np.sign(f_lo) * np.sign(f_hi) < 0
+
+    # orient the bracket so that f(neg) < 0 < f(pos), newton starts at 0%
+    neg = np.where(f_lo < 0, LOWER, UPPER)
+    pos = np.where(f_lo < 0, UPPER, LOWER)
+    x = np.zeros(count)
+    active = np.flatnonzero(valid)
+
+    for _ in range(max_iter):
+        if len(active) == 0:
+            break
+
+        # only the unsolved problems are evaluated
+        [f, df] = value(x[active], active)
+        neg[active] = np.where(f < 0, x[active], neg[active])
+        pos[active] = np.where(f >= 0, x[active], pos[active])
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            step = x[active] - f / df
+        inside = (step - neg[active]) * (step - pos[active]) < 0
+        x_next = np.where(inside, step, (neg[active] + pos[active]) / 2)
+
+        solved = f == 0
+        converged = solved | (np.abs(x_next - x[active]) <= tol)
+        x[active] = np.where(solved, x[active], x_next)
+        active = active[~converged]
+
+    return np.where(valid, np.expm1(x), np.nan)
+
+
+def stack_problems(
+    problems: list[tuple[np.ndarray, np.ndarray]],
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    problems :parameter: (amounts, years) arrays of any number of flows,
+    e.g. the problems of many accounts
+
+    Returns:
+        [amounts, years] one zero padded (problems x flows) array each
+    """
+    width = max(amounts.shape[1] for [amounts, _] in problems)
+    [amounts, years] = [
+        np.concatenate(
+            [
+                np.pad(problem[i], ((0, 0), (0, width - problem[i].shape[1])))
+                for problem in problems
+            ]
+        )
+        for i in (0, 1)
+    ]
+    return (amounts, years)
+
+
+def window_problems(
+    flow_days: np.ndarray,
+    flows: np.ndarray,
+    nav_days: np.ndarray,
+    navs: np.ndarray,
+    windows: typing.Sequence[int],
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    flow_days, flows :parameter: datetime64 days and payin - payout
+    nav_days, navs :parameter: date ordered nav of one series
+    windows :parameter: trailing windows in calendar days, 0 since the
+    first flow
+
+    Returns:
+        [amounts, years, valid]
+        (windows x flows + 2) problems of the series ending on its last
+        nav day (start nav, flows, end nav), valid is False for windows
+        starting before the series
+    """
+    end = nav_days[-1]
+    window = np.array(windows, dtype="timedelta64[D]")
+    start = end - window
+
+    # nav of the last day on or before the window start
+    start_pos = np.searchsorted(nav_days, start, "right") - 1
+    inception = window == np.timedelta64(0, "D")
+    valid = inception | (start_pos >= 0)
+    start_nav = np.where(inception, 0.0, navs[np.maximum(start_pos, 0)])
+    from_day = np.where(
+        inception, flow_days[0] - 1, nav_days[np.maximum(start_pos, 0)]
+    )
+
+    in_window = (flow_days > from_day[:, None]) & (flow_days <= end)
+    flow_years = (end - flow_days) / np.timedelta64(1, "D") / DAYS_PER_YEAR
+    start_years = (end - from_day) / np.timedelta64(1, "D") / DAYS_PER_YEAR
+
+    amounts = np.column_stack(
+        [
+            -start_nav,
+            np.where(in_window, -flows, 0.0),
+            np.full(len(window), navs[-1]),
+        ]
+    )
+    years = np.column_stack(
+        [
+            start_years,
+            np.broadcast_to(flow_years, in_window.shape),
+            np.zeros(len(window)),
+        ]
+    )
+    return (amounts, years, valid)
+
+
+def series_navs(
+    conn: sqlite3.Connection, series: str
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    series :parameter: portfolio_nav or a {ticker}_index_nav table
+
+    Returns:
+        [days, navs] date ordered, days without a nav are skipped
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+        f"SELECT Date, nav FROM {series} WHERE nav IS NOT NULL "
+        "ORDER BY Date, rowid"
+    )
+    rows = cursor.fetchall()
+    days = np.array([row[0][:10] for row in rows], dtype="datetime64[D]")
+    navs = np.array([row[1] for row in rows], dtype="float64")
+    return (days, navs)
+
+
+def cash_balance(
+    conn: sqlite3.Connection,
+    tr_table: TradeReport,
+    flow_days: np.ndarray,
+    flows: np.ndarray,
+    days: np.ndarray,
+) -> np.ndarray:
+    """
+    flow_days, flows :parameter: sorted datetime64 days and payin - payout
+    days :parameter: datetime64[D] days to value the cash on
+
+    Returns:
+        cash in the account at the end of every day, flows minus net trade
+        cost upto it
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT Date, CASE WHEN trade_type = 'buy' THEN quantity * price "
+        f"ELSE -quantity * price END FROM {tr_table.name} ORDER BY Date"
+    )
+    trades = cursor.fetchall()
+    trade_days = np.array(
+        [row[0][:10] for row in trades], dtype="datetime64[D]"
+    )
+    costs = np.array([row[1] for row in trades], dtype="float64")
+
+    # cumulative sums upto every day, 0 before the first entry
+    paid = np.concatenate([[0.0], np.cumsum(flows)])
+    spent = np.concatenate([[0.0], np.cumsum(costs)])
+    return (
+        paid[np.searchsorted(flow_days, days, "right")]
+        - spent[np.searchsorted(trade_days, days, "right")]
+    )
+
+
+def xirr_rows(
+    conn: sqlite3.Connection,
+    bnk_table: BankStatement,
+    tr_table: TradeReport,
+    tickers: list[str],
+    windows: typing.Sequence[int],
+) -> list[tuple[str, str, int, typing.Optional[float]]]:
+    """
+    Returns:
+        rows in XIRR column order, of the portfolio nav (with its cash) and
+        every {ticker}_index_nav series on their last nav day
+    """
+    flows = daily_net_flows(bnk_table.get_all(conn))
+    if len(flows) == 0:
+        return []
+
+    flow_days = np.array(sorted(flows), dtype="datetime64[D]")
+    net = np.array([flows[day] for day in sorted(flows)], dtype="float64")
+
+    portfolio = PortfolioNAV().name
+    names = [portfolio, *(IndexNAV(ticker).name for ticker in tickers)]
+    problems = []
+    for name in names:
+        [days, navs] = series_navs(conn, name)
+        if name == portfolio:
+            navs = navs + cash_balance(conn, tr_table, flow_days, net, days)
+        if len(days) != 0:
+            problems.append(
+                (
+                    name,
+                    days[-1],
+                    window_problems(flow_days, net, days, navs, windows),
+                )
+            )
+    if len(problems) == 0:
+        return []
+
+    rates = solve_xirr(
+        *stack_problems([problem[2][:2] for problem in problems])
+    ).reshape(len(problems), len(windows))
+
+    rows = []
+    for [[name, end, [_, _, valid]], rate] in zip(problems, rates):
+        date = str(
+            time.convert_datetime64_to_strf(end.astype("datetime64[s]"))
+        )
+        for [window, ok, value] in zip(windows, valid, rate):
+            if ok:
+                rows.append(
+                    (
+                        date,
+                        name,
+                        int(window),
+                        None if np.isnan(value) else float(value),
+                    )
+                )
+    return rows
@@ -0,0 +1,102 @@
+import os
+import sqlite3
+import tempfile
+import timeit
+from calamar_backend.batch import run_batch
+from calamar_backend.config import load_accounts
+
+tickers = ["nifty50"]
+
+
+def write_accounts(directory: str) -> str:
+    """
+    Two accounts on the test reports, the second one with a missing trade
+    report
+    """
+    accounts = [
+        ("main", os.getenv("ZERODHA_TRADE_REPORT")),
+        ("broken", os.path.join(directory, "missing.csv")),
+    ]
+    file = os.path.join(directory, "accounts.yaml")
+    with open(file, "w") as f:
+        f.write("accounts:\n")
+        for [name, trade_report] in accounts:
+            f.write(
+                f"  - name: {name}\n"
+                f"    db: {os.path.join(directory, name + '.db')}\n"
+                f"    trade_report: {trade_report}\n"
+                f"    bank_statement: {os.getenv('ZERODHA_BANK_STATEMENT')}\n"
+                f"    problem_sec: {os.getenv('ZERODHA_PROBLEM_SEC')}\n"
+            )
+
+    return file
+
+
+def test_run_batch() -> bool:
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            configs = load_accounts(write_accounts(directory))
+            results = run_batch(
+                configs,
+                tickers,
+                os.environ["CALAMAR_CSV_DB"],
+                os.environ["TICKER_MAP"],
+                # index prices of the test database, nothing is downloaded
+                price_db=os.getenv("CALAMAR_DB"),
+                processes=2,
+            )
+            print(f"\ntest_run_batch_results: {list(map(str, results))}")
+
+            # one result per account, in the order of the accounts file
+            if [result.name for result in results] != ["main", "broken"]:
+                return False
+
+            [main, broken] = results
+            if main.error is not None or "ledger" not in main.timings:
+                return False
+
+            # a failed account is reported, the others are still built
+            if broken.error is None or "ledger" in broken.timings:
+                return False
+
+            assert configs[0].db is not None
+            conn = sqlite3.connect(configs[0].db)
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM portfolio_nav")
+            [navs] = cursor.fetchone()
+            conn.close()
+            if navs == 0:
+                return False
+
+    except Exception as e:
+        print(e)
+        return False
+
+    return True
+
+
+def main():
+    print("==== Batch testing ====")
+    OKGREEN = "\033[92m"
+    FAIL = "\033[91m"
+    ENDC = "\033[0m"
+    tick = OKGREEN + "\N{check mark}" + ENDC
+    cross = FAIL + "\N{cross mark}" + ENDC
+
+    emoji = lambda x: tick if x else cross
+
+    start_time = timeit.default_timer()
+    tst_run_batch = test_run_batch()
+    end_time = timeit.default_timer()
+    elapsed_time = end_time - start_time
+
+    print("\n\n==== Batch test results ====")
+    print(f"test_run_batch: {emoji(tst_run_batch)}")
+
+    print("\n")
+    print(f"Total elapsed time for batch tests: {elapsed_time}")
+    print("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,46 @@
 import calamar_backend.database as db
 import calamar_backend.table_interface as inf
+import math
 import timeit
 import calamar_backend.time as time
+import numpy as np
+import pandas as pd
+from calamar_backend.benchmarks import daily_net_flows
+from calamar_backend.montecarlo import MIN_JOINT_DAYS
+from calamar_backend.optimizer import PortfolioOptimizer
+from calamar_backend.positions import PositionMatrix
+from calamar_backend.rollup import RESOLUTIONS, compute_rollup, update_rollups
+from calamar_backend.scenario import Scenario
+from calamar_backend.twr import TWRIndex
 
 ticker = "nifty50"
 start = "2019-12-10"
 
 
+def table_rows(db_: db.Database, table: str) -> list[tuple]:
+    cursor = db_.conn.cursor()
+    cursor.execute(f"SELECT * FROM {table} ORDER BY rowid")
+    return cursor.fetchall()
+
+
+def same_rows(rows: list[tuple], other: list[tuple]) -> bool:
+    """
+    Row by row equality, floats up to their summation order
+    """
+    if len(rows) != len(other):
+        return False
+
+    for [row, other_row] in zip(rows, other):
+        for [value, other_value] in zip(row, other_row):
+            if isinstance(value, float) and isinstance(other_value, float):
+                if not math.isclose(value, other_value, abs_tol=1e-6):
+                    return False
+            elif value != other_value:
+                return False
+
+    return True
+
+
 def test_create_index_table() -> bool:
     try:
         db_ = db.Database()
@@ -52,6 +86,27 @@ def test_create_index_nav_table() -> bool:
     return True
 
 
+def test_create_index_nav_tables() -> bool:
+    tickers = ["nifty50", "niftynext50"]
+
+    try:
+        db_ = db.Database()
+        db_.create_index_nav_tables(tickers)
+        rows = []
+        for ticker in tickers:
+            rows += inf.IndexNAV(ticker).get_day_zero(db_.conn)
+        print(
+            "\ntest_create_index_nav_tables_results: "
+            f"{list(map(str, rows))}"
+        )
+
+    except Exception as e:
+        print(e)
+        return False
+
+    return True
+
+
 def test_create_trade_report_table() -> bool:
     try:
         db_ = db.Database()
@@ -113,6 +168,510 @@ def test_create_portfolio_nav_table() -> bool:
     return True
 
 
+def test_create_portfolio_nav_table_sql() -> bool:
+    try:
+        db_ = db.Database()
+        db_.create_portfolio_nav_table()
+        serial = table_rows(db_, db_.pft_nav_table.name)
+
+        db_.create_prices_table()
+        db_.create_portfolio_nav_table_sql()
+        rows = table_rows(db_, db_.pft_nav_table.name)
+        print(f"\ntest_create_portfolio_nav_table_sql_results: {rows[-1]}")
+        # the same nav as valuing every holding day by day
+        if len(rows) == 0 or not same_rows(rows, serial):
+            return False
+
+    except Exception as e:
+        print(e)
+        return False
+
+    return True
+
+
+def test_create_portfolio_nav_table_parallel() -> bool:
+    try:
+        db_ = db.Database()
+        db_.create_portfolio_nav_table()
+        serial = table_rows(db_, db_.pft_nav_table.name)
+
+        db_.create_portfolio_nav_table_parallel(processes=2)
+        rows = table_rows(db_, db_.pft_nav_table.name)
+        print(
+            f"\ntest_create_portfolio_nav_table_parallel_results: {rows[-1]}"
+        )
+        # FY partitions merge back into the serial nav
+        if len(rows) == 0 or not same_rows(rows, serial):
+            return False
+
+    except Exception as e:
+        print(e)
+        return False
+
+    return True
+
+
+def test_create_ledger_tables() -> bool:
+    try:
+        db_ = db.Database()
+        db_.create_portfolio_table()
+        db_.create_portfolio_nav_table()
+        db_.create_index_nav_tables([ticker])
+        tables = [
+            db_.pft_table.name,
+            db_.pft_nav_table.name,
+            inf.IndexNAV(ticker).name,
+        ]
+        built = [table_rows(db_, table) for table in tables]
+
+        db_.create_ledger_tables([ticker])
+        replayed = [table_rows(db_, table) for table in tables]
+        print(
+            "\ntest_create_ledger_tables_results: "
+            f"{[len(rows) for rows in replayed]}"
+        )
+        # one merged replay writes what the separate builders write
+        if any(len(rows) == 0 for rows in replayed) or not all(
+            same_rows(rows, other) for [rows, other] in zip(replayed, built)
+        ):
+            return False
+
+    except Exception as e:
+        print(e)
+        return False
+
+    return True
+
+
+def test_create_positions_table() -> bool:
+    try:
+        db_ = db.Database()
+        db_.create_prices_table()
+        db_.create_positions_table()
+        matrix = PositionMatrix.from_db(db_.conn)
+        top = matrix.top_contributors(matrix.days[0], matrix.days[-1], 3)
+        print(f"\ntest_create_positions_table_results: {matrix} {top}")
+
+    except Exception as e:
+        print(e)
+        return False
+
+    return True
+
+
+def test_create_rollup_tables() -> bool:
+    series = "rollup_test_nav"
+    try:
+        db_ = db.Database()
+        rows = table_rows(db_, db_.pft_nav_table.name)
+        dates = [row[0] for row in rows]
+        navs = np.array([row[1] for row in rows], dtype="float64")
+
+        # the same periods as a pandas resample of the nav series
+        nav = pd.Series(navs, index=pd.to_datetime(dates))
+        rules = {"W": "W-MON", "M": "MS", "Q": "QS"}
+        for resolution in RESOLUTIONS:
+            rollup = compute_rollup(
+                series, resolution, dates, navs, [], np.array([])
+            )
+            resampled = (
+                nav.resample(rules[resolution], label="left", closed="left")
+                .agg(["first", "last", "min", "max"])
+                .dropna()
+            )
+            expected = [
+                (f"{day:%Y-%m-%d} 00:00:00", *values)
+                for [day, values] in zip(
+                    resampled.index, resampled.itertuples(index=False)
+                )
+            ]
+            computed = [(row[0], *row[4:8]) for row in rollup]
+            if len(computed) == 0 or not same_rows(computed, expected):
+                print(f"{resolution}: {computed[:2]} {expected[:2]}")
+                return False
+
+        # an incremental update after new days equals a full rebuild
+        flows = daily_net_flows(db_.bnk_table.get_all(db_.conn))
+        query = (
+            f"SELECT * FROM {inf.NAVRollup().name} WHERE series = ? "
+            "ORDER BY resolution, Date"
+        )
+        cursor = db_.conn.cursor()
+        cursor.execute(f"DROP TABLE IF EXISTS {series}")
+        cursor.execute(
+            f"CREATE TABLE {series} AS SELECT * FROM "
+            f"{db_.pft_nav_table.name} WHERE Date < ?",
+            (dates[-45],),
+        )
+        update_rollups(db_.conn, series, flows=flows, full=True)
+        cursor.execute(
+            f"INSERT INTO {series} SELECT * FROM "
+            f"{db_.pft_nav_table.name} WHERE Date >= ?",
+            (dates[-45],),
+        )
+        update_rollups(db_.conn, series, flows=flows)
+        incremental = cursor.execute(query, (series,)).fetchall()
+        update_rollups(db_.conn, series, flows=flows, full=True)
+        full = cursor.execute(query, (series,)).fetchall()
+        print(
+            f"\ntest_create_rollup_tables_results: {len(full)} {full[-1]}"
+        )
+
+        for resolution in RESOLUTIONS:
+            inf.NAVRollup().delete_from(db_.conn, series, resolution, "")
+        cursor.execute(f"DROP TABLE {series}")
+        db_.conn.commit()
+        if not same_rows(incremental, full):
+            return False
+
+    except Exception as e:
+        print(e)
+        return False
+
+    return True
+
+
+def test_create_twr_tables() -> bool:
+    try:
+        db_ = db.Database()
+        db_.create_twr_tables(["nifty50"])
+        index = TWRIndex.from_db(db_.conn)
+        [days, _] = index.series["portfolio_nav"]
+        excess = index.excess(
+            "portfolio_nav", "nifty50_index_nav", days[0], days[-1]
+        )
+        print(f"\ntest_create_twr_tables_results: {index} {excess}")
+
+    except Exception as e:
+        print(e)
+        return False
+
+    return True
+
+
+def test_create_drawdown_tables() -> bool:
+    try:
+        db_ = db.Database()
+        db_.create_drawdown_tables(["nifty50"], full=True)
+        cursor = db_.conn.cursor()
+        cursor.execute(
+            "SELECT series, MIN(depth), COUNT(*) FROM drawdown_episodes "
+            "GROUP BY series"
+        )
+        episodes = cursor.fetchall()
+        print(f"\ntest_create_drawdown_tables_results: {episodes}")
+        # an update without new days has nothing to do
+        db_.create_drawdown_tables(["nifty50"])
+        cursor.execute(
+            "SELECT series, MIN(depth), COUNT(*) FROM drawdown_episodes "
+            "GROUP BY series"
+        )
+        if cursor.fetchall() != episodes:
+            return False
+
+    except Exception as e:
+        print(e)
+        return False
+
+    return True
+
+
+def test_create_relative_risk_table() -> bool:
+    try:
+        db_ = db.Database()
+        db_.create_relative_risk_table(["nifty50"], windows=(21, 63))
+        cursor = db_.conn.cursor()
+        cursor.execute(
+            'SELECT "window", COUNT(*), AVG(beta) FROM relative_risk '
+            'GROUP BY "window"'
+        )
+        rows = cursor.fetchall()
+        print(f"\ntest_create_relative_risk_table_results: {rows}")
+
+    except Exception as e:
+        print(e)
+        return False
+
+    return True
+
+
+def test_create_xirr_table() -> bool:
+    try:
+        db_ = db.Database()
+        db_.create_xirr_table(["nifty50"])
+        cursor = db_.conn.cursor()
+        cursor.execute(
+            'SELECT series, "window", xirr FROM xirr ORDER BY series, '
+            '"window"'
+        )
+        rows = cursor.fetchall()
+        print(f"\ntest_create_xirr_table_results: {rows}")
+        if len(rows) == 0:
+            return False
+
+    except Exception as e:
+        print(e)
+        return False
+
+    return True
+
+
+def test_scenario_nav_delta() -> bool:
+    try:
+        db_ = db.Database()
+        engine = db_.get_scenario_engine()
+        trade = db_.tr_table.get_all(db_.conn)[0]
+        # removing and adding back the same trade changes nothing
+        [dates, delta] = engine.nav_delta(Scenario([trade], [trade]))
+        [_, removed] = engine.nav_delta(Scenario(removed=[trade]))
+        print(
+            f"\ntest_scenario_nav_delta_results: {len(dates)} "
+            f"{removed.min()} {removed.max()}"
+        )
+        if any(delta != 0):
+            return False
+
+        # removing a trade gives the nav rebuilt without it
+        cursor = db_.conn.cursor()
+        cursor.execute(
+            f"SELECT rowid FROM {db_.tr_table.name} ORDER BY Date, rowid"
+        )
+        rowids = [row[0] for row in cursor.fetchall()]
+        pos = len(rowids) // 2
+        trade = db_.tr_table.get_all(db_.conn)[pos]
+        [dates, navs] = engine.nav(Scenario(removed=[trade]))
+
+        cursor.execute(
+            f"DELETE FROM {db_.tr_table.name} WHERE rowid = ?", (rowids[pos],)
+        )
+        db_.conn.commit()
+        db_.create_portfolio_table()
+        db_.create_portfolio_nav_table()
+        cursor.execute(f"SELECT Date, nav FROM {db_.pft_nav_table.name}")
+        rebuilt = dict(cursor.fetchall())
+
+        # the stored tables again
+        db_.create_trade_report_table()
+        db_.create_portfolio_table()
+        db_.create_portfolio_nav_table()
+        if len(dates) == 0 or not same_rows(
+            list(zip(dates, navs.tolist())),
+            [(date, rebuilt.get(date, 0.0)) for date in dates],
+        ):
+            return False
+
+    except Exception as e:
+        print(e)
+        return False
+
+    return True
+
+
+def test_create_montecarlo_tables() -> bool:
+    try:
+        db_ = db.Database()
+        db_.create_montecarlo_tables(paths=2000, horizon=21, processes=2)
+        cursor = db_.conn.cursor()
+        cursor.execute("SELECT * FROM montecarlo_risk WHERE horizon = 1")
+        rows = cursor.fetchall()
+        print(f"\ntest_create_montecarlo_tables_results: {rows}")
+        # the same seed gives the same tables
+        db_.create_montecarlo_tables(paths=2000, horizon=21, processes=1)
+        cursor.execute("SELECT * FROM montecarlo_risk WHERE horizon = 1")
+        if cursor.fetchall() != rows:
+            return False
+
+        # too few joint days in the lookback are refused
+        try:
+            db_.create_montecarlo_tables(paths=2000, horizon=21, lookback=30)
+            return False
+        except Exception as e:
+            print(f"expected: {e}")
+
+    except Exception as e:
+        print(e)
+        return False
+
+    return True
+
+
+def test_create_optimal_weights_table() -> bool:
+    try:
+        db_ = db.Database()
+        db_.create_optimal_weights_table()
+        cursor = db_.conn.cursor()
+        cursor.execute(
+            "SELECT SUM(weight), SUM(min_variance), SUM(max_sharpe), "
+            "MIN(min_variance), MIN(max_sharpe) FROM optimal_weights"
+        )
+        sums = cursor.fetchone()
+        print(f"\ntest_create_optimal_weights_table_results: {sums}")
+        if (
+            any(abs(total - 1) > 1e-6 for total in sums[:3])
+            or min(sums[3:]) < 0
+        ):
+            return False
+
+        # a new process only updates the persisted window
+        optimizer = PortfolioOptimizer(db.Database().conn)
+        if optimizer.refresh():
+            return False
+
+        # the window covers the lookback, not only the days since the
+        # latest purchase
+        assert optimizer.moments is not None
+        if optimizer.moments.count < MIN_JOINT_DAYS:
+            return False
+
+    except Exception as e:
+        print(e)
+        return False
+
+    return True
+
+
+def test_create_tax_lot_tables() -> bool:
+    try:
+        db_ = db.Database()
+        db_.create_tax_lot_tables()
+        cursor = db_.conn.cursor()
+        queries = [
+            "SELECT * FROM realized_gains ORDER BY Date, lot",
+            "SELECT * FROM open_lots ORDER BY lot",
+        ]
+        full = [cursor.execute(query).fetchall() for query in queries]
+        print(f"\ntest_create_tax_lot_tables_results: {full[0]}")
+
+        # replaying from the last trade day gives the same lots
+        trades = db_.tr_table.get_all(db_.conn)
+        db_.update_tax_lot_tables(trades[-1].date)
+        updated = [cursor.execute(query).fetchall() for query in queries]
+        if len(full[1]) == 0 or updated != full:
+            return False
+
+    except Exception as e:
+        print(e)
+        return False
+
+    return True
+
+
+def test_check_price_coverage() -> bool:
+    try:
+        db_ = db.Database()
+        coverage = db_.check_price_coverage()
+        print(f"\ntest_check_price_coverage_results: {coverage}")
+        # the same securities as the stored portfolio report
+        held = {
+            (isin, ticker)
+            for [isin, ticker, _, _] in db_.pft_table.get_securities(db_.conn)
+        }
+        needed = {(isin, ticker) for [isin, ticker, _, _] in coverage.needed}
+        if not coverage.ok or needed != held:
+            return False
+
+    except Exception as e:
+        print(e)
+        return False
+
+    return True
+
+
+def test_shadow_build() -> bool:
+    try:
+        db_ = db.Database()
+        db_.create_prices_table()
+        cursor = db_.conn.cursor()
+        cursor.execute(f"SELECT COUNT(*) FROM {db_.prices_table.name}")
+        [live] = cursor.fetchone()
+
+        # an interrupted build leaves the live table as it was
+        try:
+            with db_.prices_table.shadow_build(db_.conn):
+                db_.prices_table.delete_securities(
+                    db_.conn,
+                    [sec[0] for sec in db_.pft_table.get_securities(db_.conn)],
+                )
+                raise InterruptedError()
+        except InterruptedError:
+            pass
+        cursor.execute(f"SELECT COUNT(*) FROM {db_.prices_table.name}")
+        [interrupted] = cursor.fetchone()
+
+        # a resumed build replaces it with the same rows
+        db_.create_prices_table()
+        cursor.execute(f"SELECT COUNT(*) FROM {db_.prices_table.name}")
+        [resumed] = cursor.fetchone()
+        print(
+            f"\ntest_shadow_build_results: {live} {interrupted} {resumed}"
+        )
+        if not live == interrupted == resumed:
+            return False
+
+    except Exception as e:
+        print(e)
+        return False
+
+    return True
+
+
+def test_update_from_reports() -> bool:
+    try:
+        db_ = db.Database()
+        since = db_.update_from_reports(["nifty50"])
+        print(f"\ntest_update_from_reports_results: {since}")
+        # a second update without changed files has nothing to redo
+        if db_.update_from_reports(["nifty50"]) is not None:
+            return False
+
+    except Exception as e:
+        print(e)
+        return False
+
+    return True
+
+
+def test_build_manifest() -> bool:
+    try:
+        db_ = db.Database()
+        db_.build([ticker])
+        # a second build without changed inputs runs nothing
+        if db_.build([ticker]) != []:
+            return False
+
+        # changing the bank statement reruns it and every stage downstream
+        # of it, in stage order
+        stages = db_.stages([ticker])
+        downstream = {"bank_statement"}
+        for stage in stages:
+            if any(name in downstream for name in stage.upstream):
+                downstream.add(stage.name)
+        expected = [stage.name for stage in stages if stage.name in downstream]
+
+        path = db_.bnk_table.bank_statement_file
+        with open(path, "rb") as file:
+            content = file.read()
+        try:
+            # a blank line, the statement rows stay the same
+            with open(path, "wb") as file:
+                file.write(content + b"\n")
+            touched = db_.build([ticker])
+        finally:
+            with open(path, "wb") as file:
+                file.write(content)
+        restored = db_.build([ticker])
+
+        print(f"\ntest_build_manifest_results: {touched}")
+        if touched != expected or restored != expected:
+            return False
+
+    except Exception as e:
+        print(e)
+        return False
+
+    return True
+
+
 def main():
     print("==== Database testing ====")
     OKGREEN = "\033[92m"
@@ -128,8 +687,32 @@ def main():
     tst_create_trade_report_table: bool = test_create_trade_report_table()
     tst_create_bank_statement_table: bool = test_create_bank_statment_table()
     tst_create_index_nav_table: bool = test_create_index_nav_table()
+    tst_create_index_nav_tables: bool = test_create_index_nav_tables()
     tst_create_portfolio_table: bool = test_create_portfolio_table()
     tst_create_portfolio_nav_table: bool = test_create_portfolio_nav_table()
+    tst_create_portfolio_nav_table_sql: bool = (
+        test_create_portfolio_nav_table_sql()
+    )
+    tst_create_portfolio_nav_table_parallel: bool = (
+        test_create_portfolio_nav_table_parallel()
+    )
+    tst_create_ledger_tables: bool = test_create_ledger_tables()
+    tst_create_positions_table: bool = test_create_positions_table()
+    tst_create_rollup_tables: bool = test_create_rollup_tables()
+    tst_create_twr_tables: bool = test_create_twr_tables()
+    tst_create_drawdown_tables: bool = test_create_drawdown_tables()
+    tst_create_relative_risk_table: bool = test_create_relative_risk_table()
+    tst_create_xirr_table: bool = test_create_xirr_table()
+    tst_scenario_nav_delta: bool = test_scenario_nav_delta()
+    tst_create_montecarlo_tables: bool = test_create_montecarlo_tables()
+    tst_create_optimal_weights_table: bool = (
+        test_create_optimal_weights_table()
+    )
+    tst_create_tax_lot_tables: bool = test_create_tax_lot_tables()
+    tst_check_price_coverage: bool = test_check_price_coverage()
+    tst_shadow_build: bool = test_shadow_build()
+    tst_update_from_reports: bool = test_update_from_reports()
+    tst_build_manifest: bool = test_build_manifest()
     end_time = timeit.default_timer()
     elapsed_time = end_time - start_time
 
@@ -144,11 +727,53 @@ def main():
         f"{emoji(tst_create_bank_statement_table)}"
     )
     print(f"test_create_index_nav_table: {emoji(tst_create_index_nav_table)}")
+    print(
+        "test_create_index_nav_tables: "
+        f"{emoji(tst_create_index_nav_tables)}"
+    )
     print(f"test_create_portfolio_table: {emoji(tst_create_portfolio_table)}")
     print(
         "test_create_portfolio_nav_table: "
         f"{emoji(tst_create_portfolio_nav_table)}"
     )
+    print(
+        "test_create_portfolio_nav_table_sql: "
+        f"{emoji(tst_create_portfolio_nav_table_sql)}"
+    )
+    print(
+        "test_create_portfolio_nav_table_parallel: "
+        f"{emoji(tst_create_portfolio_nav_table_parallel)}"
+    )
+    print(f"test_create_ledger_tables: {emoji(tst_create_ledger_tables)}")
+    print(
+        "test_create_positions_table: "
+        f"{emoji(tst_create_positions_table)}"
+    )
+    print(f"test_create_rollup_tables: {emoji(tst_create_rollup_tables)}")
+    print(f"test_create_twr_tables: {emoji(tst_create_twr_tables)}")
+    print(
+        "test_create_drawdown_tables: "
+        f"{emoji(tst_create_drawdown_tables)}"
+    )
+    print(
+        "test_create_relative_risk_table: "
+        f"{emoji(tst_create_relative_risk_table)}"
+    )
+    print(f"test_create_xirr_table: {emoji(tst_create_xirr_table)}")
+    print(f"test_scenario_nav_delta: {emoji(tst_scenario_nav_delta)}")
+    print(
+        "test_create_montecarlo_tables: "
+        f"{emoji(tst_create_montecarlo_tables)}"
+    )
+    print(
+        "test_create_optimal_weights_table: "
+        f"{emoji(tst_create_optimal_weights_table)}"
+    )
+    print(f"test_create_tax_lot_tables: {emoji(tst_create_tax_lot_tables)}")
+    print(f"test_check_price_coverage: {emoji(tst_check_price_coverage)}")
+    print(f"test_shadow_build: {emoji(tst_shadow_build)}")
+    print(f"test_update_from_reports: {emoji(tst_update_from_reports)}")
+    print(f"test_build_manifest: {emoji(tst_build_manifest)}")
     print("\n")
     print(f"Total elapsed time for database tests: {elapsed_time}")
     print("\n")
@@ -1,8 +1,11 @@
+import concurrent.futures
+import datetime
 import timeit
 import os
 import calamar_backend.time as time
 import calamar_backend.utils as ut
 from calamar_backend import database_csv as db
+from calamar_backend.price_cache import SharedPriceStore
 
 
 def test_read() -> bool:
@@ -45,6 +48,92 @@ def test_read() -> bool:
     return True
 
 
+def test_read_projection() -> bool:
+    try:
+        ticker = "RELIANCE"
+        isin = "IFK345"
+        date = time.convert_date_strf_to_strp("2023-10-05 00:00:00")
+        db_full = db.DatabaseCSV(3)
+        db_close = db.DatabaseCSV(3, columns=("Close",), dtype="float32")
+
+        [_, full] = db_full.read(isin, date, ticker)
+        [_, close] = db_close.read(isin, date, ticker)
+        price = db_close.read_price(isin, date, ticker)
+
+        assert full is not None and close is not None
+        assert list(close.index) == ["Close"]
+        assert close.dtype == "float32"
+        assert abs(price - full["Close"]) < 1e-3 * full["Close"]
+
+        # projected frames should be smaller than full frames
+        assert db_close.lru[-1][-1].nbytes < db_full.lru[-1][-1].nbytes
+        print(f"\ntest_read_projection_results:{price}")
+
+    except Exception as e:
+        print(e)
+        return False
+
+    return True
+
+
+def test_shared_store() -> bool:
+    store = None
+    try:
+        ticker = "RELIANCE"
+        isin = "IFK345"
+        date = time.convert_date_strf_to_strp("2023-10-05 00:00:00")
+        db_close = db.DatabaseCSV(3, columns=("Close",), dtype="float32")
+        price = db_close.read_price(isin, date, ticker)
+
+        store = SharedPriceStore.publish(
+            str(db.DatabaseCSV.csv_dir_path), "calamar_test_prices"
+        )
+        attached = SharedPriceStore.attach("calamar_test_prices")
+        db_shared = db.DatabaseCSV(
+            3, columns=("Close",), dtype="float32", shared=attached
+        )
+
+        # read from shared memory, nothing gets parsed into the lru
+        assert db_shared.read_price(isin, date, ticker) == price
+        assert len(db_shared.lru) == 0
+        print(f"\ntest_shared_store_results:{attached} {price}")
+
+    except Exception as e:
+        print(e)
+        return False
+
+    finally:
+        if store is not None:
+            store.close()
+
+    return True
+
+
+def test_threaded_reads() -> bool:
+    try:
+        ticker = "RELIANCE"
+        isin = "IFK345"
+        start = time.convert_date_strf_to_strp("2021-10-04 00:00:00")
+        dates = [start + datetime.timedelta(days=7 * i) for i in range(100)]
+
+        # fewer slots than FYs: every read evicts another thread's frame
+        serial = [db.DatabaseCSV(1).read_price(isin, d, ticker) for d in dates]
+        db_ = db.DatabaseCSV(2)
+        with concurrent.futures.ThreadPoolExecutor(8) as pool:
+            for _ in range(5):
+                threaded = list(
+                    pool.map(lambda d: db_.read_price(isin, d, ticker), dates)
+                )
+                assert threaded == serial
+        print(f"\ntest_threaded_reads_results:{threaded[:3]}")
+
+    except Exception as e:
+        print(e)
+        return False
+
+    return True
+
+
 def main():
     print("=== Database_csv testing ===")
     OKGREEN = "\033[92m"
@@ -57,11 +146,17 @@ def main():
 
     start_time = timeit.default_timer()
     tst_read = test_read()
+    tst_read_projection = test_read_projection()
+    tst_shared_store = test_shared_store()
+    tst_threaded_reads = test_threaded_reads()
     end_time = timeit.default_timer()
     elapsed_time = end_time - start_time
 
     print("\n\n==== Database csv test results ====")
     print(f"test_read: {emoji(tst_read)}")
+    print(f"test_read_projection: {emoji(tst_read_projection)}")
+    print(f"test_shared_store: {emoji(tst_shared_store)}")
+    print(f"test_threaded_reads: {emoji(tst_threaded_reads)}")
 
     print("\n")
     print(f"Total elapsed time for database csv tests: {elapsed_time}")
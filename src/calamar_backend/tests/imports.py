@@ -0,0 +1,90 @@
+import os
+import subprocess
+import sys
+import timeit
+
+# modules imported by the cli and the dashboard workers
+modules = [
+    "calamar_backend.database",
+    "calamar_backend.server",
+    "calamar_backend.batch",
+]
+budget = 0.5  # seconds
+heavy = ["pandas", "yfinance"]
+
+
+def import_module(module: str) -> tuple[float, list[str]]:
+    """
+    Import module in a fresh interpreter without any calamar environment
+    variables
+
+    Returns:
+        [import time, heavy modules that got imported]
+    """
+    env = {
+        k: v
+        for k, v in os.environ.items()
+        if not k.startswith("CALAMAR_")
+        and not k.startswith("ZERODHA_")
+        and k != "TICKER_MAP"
+    }
+    code = (
+        "import sys, timeit\n"
+        "start = timeit.default_timer()\n"
+        f"import {module}\n"
+        "print(timeit.default_timer() - start)\n"
+        f"print(','.join(m for m in {heavy} if m in sys.modules))\n"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", code],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.split("\n")
+    return (float(out[0]), [m for m in out[1].split(",") if m != ""])
+
+
+def test_import_budget() -> bool:
+    try:
+        ok = True
+        for module in modules:
+            [elapsed, loaded] = import_module(module)
+            print(
+                f"\ntest_import_budget_results: {module} {elapsed:.3f}s "
+                f"heavy: {loaded}"
+            )
+            ok = ok and elapsed < budget and len(loaded) == 0
+
+    except Exception as e:
+        print(e)
+        return False
+
+    return ok
+
+
+def main():
+    print("==== Imports testing ====")
+    OKGREEN = "\033[92m"
+    FAIL = "\033[91m"
+    ENDC = "\033[0m"
+    tick = OKGREEN + "\N{check mark}" + ENDC
+    cross = FAIL + "\N{cross mark}" + ENDC
+
+    emoji = lambda x: tick if x else cross
+
+    start_time = timeit.default_timer()
+    tst_import_budget = test_import_budget()
+    end_time = timeit.default_timer()
+    elapsed_time = end_time - start_time
+
+    print("\n\n==== Imports test results ====")
+    print(f"test_import_budget: {emoji(tst_import_budget)}")
+
+    print("\n")
+    print(f"Total elapsed time for imports tests: {elapsed_time}")
+    print("\n")
+
+
+if __name__ == "__main__":
+    main()
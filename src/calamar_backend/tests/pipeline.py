@@ -0,0 +1,135 @@
+import timeit
+import calamar_backend.database as db
+from calamar_backend.config import AccountConfig
+from calamar_backend.pipeline import Pipeline, StageResult
+
+tickers = ["nifty50"]
+
+
+def output_tables(db_: db.Database) -> dict[str, list[tuple]]:
+    """
+    Rows of every stage output table, sorted
+    """
+    cursor = db_.conn.cursor()
+    tables = {}
+    for stage in db_.stages(tickers):
+        for table in stage.outputs:
+            cursor.execute(f"SELECT * FROM {table}")
+            tables[table] = sorted(cursor.fetchall(), key=str)
+
+    return tables
+
+
+def statuses(results: list[StageResult], status: str) -> list[str]:
+    return [result.name for result in results if result.status == status]
+
+
+def build_tables() -> dict[str, list[tuple]]:
+    """
+    Output tables of a forced Database.build, the tables every pipeline
+    run is compared against
+    """
+    db_ = db.Database()
+    db_.build(tickers, force=True)
+    return output_tables(db_)
+
+
+def test_run(built: dict[str, list[tuple]]) -> bool:
+    try:
+        pipeline = Pipeline(AccountConfig.from_env(), tickers)
+        # independent stages run concurrently
+        results = pipeline.run(jobs=4)
+        names = [stage.name for stage in pipeline.stages(db.Database())]
+        print(f"\ntest_run_results: {list(map(str, results))}")
+        if statuses(results, "ran") != names:
+            return False
+
+        if output_tables(db.Database()) != built:
+            return False
+
+    except Exception as e:
+        print(e)
+        return False
+
+    return True
+
+
+def test_run_incremental() -> bool:
+    try:
+        pipeline = Pipeline(AccountConfig.from_env(), tickers)
+        results = pipeline.run(incremental=True)
+        print(f"\ntest_run_incremental_results: {list(map(str, results))}")
+        # nothing changed since the last run
+        if len(statuses(results, "skipped")) != len(results):
+            return False
+
+    except Exception as e:
+        print(e)
+        return False
+
+    return True
+
+
+def test_run_selection(built: dict[str, list[tuple]]) -> bool:
+    try:
+        pipeline = Pipeline(AccountConfig.from_env(), tickers)
+        only = pipeline.run(only=["xirr", "positions"])
+        from_ = pipeline.run(from_="twr")
+        print(
+            f"\ntest_run_selection_results: {statuses(only, 'ran')} "
+            f"{statuses(from_, 'ran')}"
+        )
+        # selected stages in stage order, the rest is left alone
+        if statuses(only, "ran") != ["positions", "xirr"]:
+            return False
+
+        if statuses(from_, "ran") != ["twr", "drawdowns", "relative_risk"]:
+            return False
+
+        if output_tables(db.Database()) != built:
+            return False
+
+        # an unknown stage is refused before anything runs
+        try:
+            pipeline.run(only=["holdings"])
+            return False
+        except Exception as e:
+            print(f"expected: {e}")
+
+    except Exception as e:
+        print(e)
+        return False
+
+    return True
+
+
+def main():
+    print("==== Pipeline testing ====")
+    OKGREEN = "\033[92m"
+    FAIL = "\033[91m"
+    ENDC = "\033[0m"
+    tick = OKGREEN + "\N{check mark}" + ENDC
+    cross = FAIL + "\N{cross mark}" + ENDC
+
+    emoji = lambda x: tick if x else cross
+
+    start_time = timeit.default_timer()
+    built = build_tables()
+    tst_run = test_run(built)
+    tst_run_incremental = test_run_incremental()
+    tst_run_selection = test_run_selection(built)
+    end_time = timeit.default_timer()
+    elapsed_time = end_time - start_time
+
+    print("\n\n==== Pipeline test results ====")
+    print(f"test_run: {emoji(tst_run)}")
+    print(f"test_run_incremental: {emoji(tst_run_incremental)}")
+    print(f"test_run_selection: {emoji(tst_run_selection)}")
+
+    print("\n")
+    print(f"Total elapsed time for pipeline tests: {elapsed_time}")
+    print("\n")
+
+
+if __name__ == "__main__":
+    main()
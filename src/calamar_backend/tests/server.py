@@ -0,0 +1,136 @@
+import asyncio
+import json
+import os
+import sqlite3
+import timeit
+from calamar_backend import server as sv
+from calamar_backend.table_interface import WriteVersions
+
+
+async def get(
+    port: int, target: str, etag: str = ""
+) -> tuple[int, dict[str, str], bytes]:
+    """
+    Minimal http client, decodes the chunked body
+    """
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    request = f"GET {target} HTTP/1.1\r\nHost: localhost\r\n"
+    if etag != "":
+        request += f"If-None-Match: {etag}\r\n"
+    writer.write((request + "Connection: close\r\n\r\n").encode())
+    await writer.drain()
+
+    raw = await reader.read()
+    writer.close()
+
+    [head, body] = raw.split(b"\r\n\r\n", 1)
+    lines = head.decode().split("\r\n")
+    status = int(lines[0].split(" ")[1])
+    headers = {}
+    for line in lines[1:]:
+        [name, value] = line.split(":", 1)
+        headers[name.strip().lower()] = value.strip()
+
+    data = b""
+    while len(body) > 0:
+        [size, body] = body.split(b"\r\n", 1)
+        data += body[: int(size, 16)]
+        body = body[int(size, 16) + 2 :]
+
+    return (status, headers, data)
+
+
+async def check_endpoints() -> None:
+    db_name = os.getenv("CALAMAR_DB")
+    assert db_name is not None
+    api = sv.ReadAPI(db_name)
+    server = await api.serve("127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+
+    async with server:
+        [status, headers, body] = await get(
+            port, "/portfolio_nav?start=2020-01-01&end=2020-12-31"
+        )
+        assert status == 200
+        nav = json.loads(body)
+        assert nav["columns"] == ["Date", "nav"]
+
+        # same tables, same etag -> not modified
+        [status, _, body] = await get(
+            port,
+            "/portfolio_nav?start=2020-01-01&end=2020-12-31",
+            headers["etag"],
+        )
+        assert status == 304 and body == b""
+
+        # a rewrite with the same rows count and dates changes the etag
+        conn = sqlite3.connect(db_name)
+        WriteVersions().bump(conn, ["portfolio_nav"])
+        conn.commit()
+        [status, _, _] = await get(
+            port,
+            "/portfolio_nav?start=2020-01-01&end=2020-12-31",
+            headers["etag"],
+        )
+        assert status == 200
+
+        # sqlite errors are answered with a 500
+        conn.execute("CREATE TABLE broken_ratio (value REAL)")
+        conn.commit()
+        try:
+            [status, _, body] = await get(port, "/ratio/broken")
+            assert status == 500 and "error" in json.loads(body)
+        finally:
+            conn.execute("DROP TABLE broken_ratio")
+            conn.commit()
+            conn.close()
+
+        [status, _, body] = await get(port, "/holdings?date=2021-01-01")
+        assert status == 200
+        holdings = json.loads(body)
+
+        [status, _, _] = await get(port, "/ratio/unknown")
+        assert status == 404
+
+    print(
+        f"\ntest_server_results: nav rows {len(nav['rows'])}, "
+        f"holdings {holdings['rows'][:3]}"
+    )
+
+
+def test_server() -> bool:
+    try:
+        asyncio.run(check_endpoints())
+
+    except Exception as e:
+        print(e)
+        return False
+
+    return True
+
+
+def main():
+    print("==== Server testing ====")
+    OKGREEN = "\033[92m"
+    FAIL = "\033[91m"
+    ENDC = "\033[0m"
+    tick = OKGREEN + "\N{check mark}" + ENDC
+    cross = FAIL + "\N{cross mark}" + ENDC
+
+    emoji = lambda x: tick if x else cross
+
+    start_time = timeit.default_timer()
+    tst_server = test_server()
+    end_time = timeit.default_timer()
+    elapsed_time = end_time - start_time
+
+    print("\n\n==== Server test results ====")
+    print(f"test_server: {emoji(tst_server)}")
+
+    print("\n")
+    print(f"Total elapsed time for server tests: {elapsed_time}")
+    print("\n")
+
+
+if __name__ == "__main__":
+    main()